@@ -0,0 +1,328 @@
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from synthetic_corpus import generate_corpus
+
+
+def extract_metadata_benchmark(file_name, path):
+    from metadata_util import extract_metadata
+    return extract_metadata(file_name, path)["class"]
+
+
+def columnar_benchmark(file_name, path):
+    from metadata_util import extract_columnar_metadata, ExtractionError
+    with open(path + file_name, 'rb') as file_handle:
+        try:
+            extract_columnar_metadata(file_handle)
+            return "columnar"
+        except ExtractionError:
+            return "unknown"
+
+
+def netcdf_benchmark(file_name, path):
+    from metadata_util import extract_netcdf_metadata, ExtractionError
+    with open(path + file_name, 'rb') as file_handle:
+        try:
+            extract_netcdf_metadata(file_handle)
+            return "container-format"
+        except ExtractionError:
+            return "unknown"
+
+
+def abstract_benchmark(file_name, path):
+    from metadata_util import is_abstract
+    with open(path + file_name, 'rb') as file_handle:
+        return "free-text" if is_abstract(file_handle) else "unknown"
+
+
+def spreadsheet_benchmark(file_name, path):
+    from metadata_util import extract_spreadsheet_metadata, ExtractionError
+    with open(path + file_name, 'rb') as file_handle:
+        try:
+            extract_spreadsheet_metadata(file_handle)
+            return "columnar"
+        except ExtractionError:
+            return "unknown"
+
+
+def xml_benchmark(file_name, path):
+    from metadata_util import extract_xml_metadata, ExtractionError
+    with open(path + file_name, 'rb') as file_handle:
+        try:
+            extract_xml_metadata(file_handle)
+            return "xml"
+        except ExtractionError:
+            return "unknown"
+
+
+def archive_benchmark(file_name, path):
+    from metadata_util import extract_archive_metadata, ExtractionError
+    with open(path + file_name, 'rb') as file_handle:
+        try:
+            extract_archive_metadata(file_handle)
+            return "archive"
+        except ExtractionError:
+            return "unknown"
+
+
+def free_text_benchmark(file_name, path):
+    from metadata_util import extract_free_text_metadata, ExtractionError
+    with open(path + file_name, 'rb') as file_handle:
+        try:
+            extract_free_text_metadata(file_handle)
+            return "free-text"
+        except ExtractionError:
+            return "unknown"
+
+
+# extractor name -> (benchmark function, extensions of corpus files the extractor is run on)
+extractor_benchmarks = {
+    "extract_metadata": (extract_metadata_benchmark, None),
+    "extract_columnar_metadata": (columnar_benchmark, ["csv", "dat"]),
+    "extract_netcdf_metadata": (netcdf_benchmark, ["nc"]),
+    "is_abstract": (abstract_benchmark, ["txt"]),
+    "extract_spreadsheet_metadata": (spreadsheet_benchmark, ["xlsx"]),
+    "extract_xml_metadata": (xml_benchmark, ["xml"]),
+    "extract_archive_metadata": (archive_benchmark, ["zip", "csv.gz"]),
+    "extract_free_text_metadata": (free_text_benchmark, ["txt"]),
+}
+
+# modules imported by every worker process, whose import time is paid again by each one
+startup_modules = ["metadata_util", "ftp_metadata_collector", "petrel_metadata_collector", "catalog_maker",
+                   "scheduler", "null_inference"]
+
+# dependencies that should only be loaded once an extractor or model that needs them runs
+heavy_modules = ["numpy", "netCDF4", "openpyxl", "xlrd", "pandas", "sklearn", "scipy", "matplotlib"]
+
+# run in a fresh interpreter to time a single import and report which heavy dependencies it loaded
+startup_script = """
+import sys, json, time, resource
+t0 = time.time()
+import {module}
+seconds = time.time() - t0
+print(json.dumps({{"seconds": seconds, "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "loaded": sorted(name for name in {heavy_modules!r} if name in sys.modules)}}))
+"""
+
+
+def _measure(benchmark, file_name, path, queue):
+    """Run a single benchmark in a child process and report its timing and memory high water mark."""
+
+    try:
+        t0 = time.time()
+        outcome = benchmark(file_name, path)
+        seconds = time.time() - t0
+        # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak_rss //= 1024
+        queue.put({"seconds": seconds, "peak_rss_kb": peak_rss, "outcome": outcome})
+    except Exception as e:
+        queue.put({"error": "{}: {}".format(type(e).__name__, str(e))})
+
+
+def measure(benchmark, file_name, path):
+    """Run a benchmark in a fresh process so that peak RSS belongs to that benchmark alone.
+
+        :param benchmark: (function) function taking a file name and path
+        :param file_name: (str) file name
+        :param path: (str) path to file
+        :returns: (dict) seconds taken, peak RSS in kilobytes, and the outcome or error"""
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(benchmark, file_name, path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    return result
+
+
+def measure_startup(module):
+    """Import a module in a fresh interpreter, the way a newly spawned worker would.
+
+        :param module: (str) module name
+        :returns: (dict) seconds taken by the import, peak RSS in kilobytes, and the heavy dependencies it
+        loaded, or the error"""
+
+    t0 = time.time()
+    script = startup_script.format(module=module, heavy_modules=heavy_modules)
+    process = subprocess.Popen([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    process_seconds = time.time() - t0
+    if process.returncode != 0:
+        # the last line of the traceback names the exception
+        return {"error": err.decode().strip().splitlines()[-1]}
+
+    result = json.loads(out.decode().strip().splitlines()[-1])
+    if sys.platform == "darwin":
+        result["peak_rss_kb"] //= 1024
+    result["process_seconds"] = process_seconds
+
+    return result
+
+
+def run_startup_benchmarks(repeat=3, modules=None):
+    """Measure how long each worker entry point takes to import, and which heavy dependencies come with it.
+
+        :param repeat: (int) number of runs per module - the fastest is kept
+        :param modules: (list(str)) modules to import, or None for all of startup_modules
+        :returns: (list(dict)) one result per module"""
+
+    results = []
+    for module in modules or startup_modules:
+        runs = [measure_startup(module) for _ in range(0, repeat)]
+        errors = [run["error"] for run in runs if "error" in run]
+        result = {"module": module}
+        if len(errors) > 0:
+            result["error"] = errors[0]
+        else:
+            best = min(runs, key=lambda run: run["seconds"])
+            result.update({
+                "seconds": round(best["seconds"], 6),
+                "process_seconds": round(best["process_seconds"], 6),
+                "peak_rss_kb": max([run["peak_rss_kb"] for run in runs]),
+                "loaded": best["loaded"]
+            })
+        results.append(result)
+        print("import {module}: {summary}".format(
+            summary=result.get("error") or "{seconds}s, {peak_rss_kb} KB, loads {loaded}".format(
+                seconds=result["seconds"], peak_rss_kb=result["peak_rss_kb"],
+                loaded=", ".join(result["loaded"]) or "nothing heavy"),
+            **result))
+
+    return results
+
+
+def run_benchmarks(corpus_dir, seed=0, scale=1.0, repeat=3, extractors=None, startup=True):
+    """Generate the synthetic corpus and benchmark each extractor against the files it applies to.
+
+        :param corpus_dir: (str) directory in which to generate the corpus
+        :param seed: (int) corpus random seed
+        :param scale: (float) corpus size multiplier
+        :param repeat: (int) number of runs per measurement - the fastest is kept
+        :param extractors: (list(str)) names of extractors to run, or None for all
+        :param startup: (bool) whether to also measure worker startup time with run_startup_benchmarks
+        :returns: (dict) benchmark results"""
+
+    corpus_dir = os.path.join(corpus_dir, '')
+    corpus = generate_corpus(corpus_dir, seed=seed, scale=scale)
+
+    results = []
+    for name in sorted(extractors or extractor_benchmarks.keys()):
+        benchmark, extensions = extractor_benchmarks[name]
+        for entry in corpus:
+            extension = entry["file"].split('.', 1)[1]
+            if extensions is not None and extension not in extensions:
+                continue
+
+            runs = [measure(benchmark, entry["file"], corpus_dir) for _ in range(0, repeat)]
+            errors = [run["error"] for run in runs if "error" in run]
+            result = {
+                "extractor": name,
+                "file": entry["file"],
+                "size": entry["size"],
+                "rows": entry["rows"]
+            }
+            if len(errors) > 0:
+                result["error"] = errors[0]
+            else:
+                best = min(runs, key=lambda run: run["seconds"])
+                seconds = max(best["seconds"], 1e-9)
+                result.update({
+                    "seconds": round(seconds, 6),
+                    "mb_per_s": round(entry["size"] / seconds / 1e6, 3),
+                    "rows_per_s": round(entry["rows"] / seconds, 1),
+                    "peak_rss_kb": max([run["peak_rss_kb"] for run in runs]),
+                    "outcome": best["outcome"]
+                })
+            results.append(result)
+            print("{extractor} {file}: {summary}".format(
+                summary=result.get("error") or "{mb_per_s} MB/s, {rows_per_s} rows/s, {peak_rss_kb} KB".format(
+                    **result),
+                **result))
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed": seed,
+        "scale": scale,
+        "repeat": repeat,
+        "results": results,
+        "startup": run_startup_benchmarks(repeat=repeat) if startup else []
+    }
+
+
+def git_commit():
+    """Get the commit hash of the working tree, if there is one.
+
+        :returns: (str) commit hash or None"""
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline, current):
+    """Print the throughput ratio of each measurement relative to a baseline run.
+
+        :param baseline: (dict) results of an earlier run
+        :param current: (dict) results of this run"""
+
+    baseline_results = {(result["extractor"], result["file"]): result for result in baseline["results"]}
+
+    print("\ncomparison against {}:".format(baseline.get("commit")))
+    for result in current["results"]:
+        old = baseline_results.get((result["extractor"], result["file"]))
+        if old is None or "seconds" not in old or "seconds" not in result:
+            continue
+        print("{:<28}{:<24}{:>8.2f}x throughput{:>10} KB peak RSS".format(
+            result["extractor"], result["file"],
+            old["seconds"] / result["seconds"],
+            "{:+d}".format(result["peak_rss_kb"] - old["peak_rss_kb"])))
+
+    # runs from before startup was measured have no startup results
+    baseline_startup = {result["module"]: result for result in baseline.get("startup", [])}
+    for result in current.get("startup", []):
+        old = baseline_startup.get(result["module"])
+        if old is None or "seconds" not in old or "seconds" not in result:
+            continue
+        print("{:<28}{:<24}{:>8.2f}x import speed{:>8} KB peak RSS".format(
+            "import", result["module"],
+            old["seconds"] / max(result["seconds"], 1e-9),
+            "{:+d}".format(result["peak_rss_kb"] - old["peak_rss_kb"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark metadata extractor throughput on a synthetic corpus.")
+    parser.add_argument("--corpus", default="benchmark_corpus", help="directory to generate the corpus in")
+    parser.add_argument("--output", default="benchmark_results.json", help="file to save results to")
+    parser.add_argument("--compare", help="results file from an earlier run to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--extractor", action="append", choices=sorted(extractor_benchmarks.keys()),
+                        help="only run this extractor (may be given more than once)")
+    parser.add_argument("--no-startup", action="store_true", help="don't measure worker startup time")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.corpus, seed=args.seed, scale=args.scale, repeat=args.repeat,
+                             extractors=args.extractor, startup=not args.no_startup)
+
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), current)
@@ -1,5 +1,9 @@
 import re
+import json
 from ftplib import error_perm
+from instrumentation import stats
+from checksums import ftp_checksum, format_checksum
+from sketches import QuantileSketch
 
 # pattern used to distinguish files from directories - has '.' in 2nd, 3rd, or 4th to last character
 file_pattern = re.compile("^.*\..{2,4}$")
@@ -30,7 +34,7 @@ def is_dir(ftp, item, guess_by_extension=True):
         return False
 
 
-def write_catalog(ftp, directory, catalog_writer, failure_writer):
+def write_catalog(ftp, directory, catalog_writer, failure_writer, guess_by_extension=True, summary=None):
     """Catalogs the name, path, size, and type of each file, writing it with the
     `catalog_writer` specified above
 
@@ -40,90 +44,275 @@ def write_catalog(ftp, directory, catalog_writer, failure_writer):
             headers = "filename", "path", "file type", "size (bytes)"
             :param failure_writer: (csv.writer) writer used to catalog all un-openable items in the directory
             headers = "item name", "path"
-            :returns: (dict) aggregate file number and size data for each file extension"""
+            :param guess_by_extension: (bool) whether to assume items matching file_pattern are files
+            :param summary: (CatalogSummary) summary to add each file to, or None to start a new one
+            :returns: (CatalogSummary) file number and size statistics for each file extension and directory"""
 
-    # dictionary storing information that will populate the aggregate csv
-    agg_data = {}
+    # statistics that will populate the aggregate csv, shared by every level of the recursion
+    if summary is None:
+        summary = CatalogSummary(root=directory)
 
     # record current directory in order to later return to it
     working_directory = ftp.pwd()
 
     ftp.cwd(directory)
-    print "cataloging directory: " + directory
 
     # all items in current directory
-    item_list = ftp.nlst()
+    with stats.timer("list"):
+        item_list = ftp.nlst()
+    stats.count("directories")
 
     for item in item_list:
         # if the item is a directory, this will create the correct path to get to it
         sub_directory = (directory + '{}' + item).format('/' if directory[-1] != '/' else '')
-        if is_dir(ftp, item):
-            # recursively catalog subdirectory and get its aggregate data
-            new_agg = write_catalog(ftp, sub_directory, catalog_writer, failure_writer)
-            # add subdirectory aggregate data to total aggregate data
-            combine_agg(agg_data, new_agg)
+        with stats.timer("list"):
+            item_is_dir = is_dir(ftp, item, guess_by_extension=guess_by_extension)
+        if item_is_dir:
+            # recursively catalog subdirectory, adding its files to the same summary
+            write_catalog(ftp, sub_directory, catalog_writer, failure_writer,
+                          guess_by_extension=guess_by_extension, summary=summary)
         else:
             # some items are corrupt or strange and can't be read, so throw those into a "failure" csv
             try:
-                print "cataloging item: " + item
                 extension = item.split('.', 1)[1] if '.' in item else "no extension"
-                size = ftp.size(sub_directory)
-                catalog_writer.writerow([
-                    item,
-                    directory,
-                    extension,
-                    size
-                ])
+                with stats.timer("list", extension=extension):
+                    size = ftp.size(sub_directory)
+                with stats.timer("write", extension=extension):
+                    catalog_writer.writerow([
+                        item,
+                        directory,
+                        extension,
+                        size
+                    ])
+                stats.count("files", extension=extension)
+                stats.count("bytes", size, extension=extension)
                 # add data from this file to total aggregate data
-                try:
-                    agg_data[extension]["files"] += 1
-                    agg_data[extension]["total_bytes"] += size
-                except KeyError:
-                    agg_data[extension] = {"files": 1, "total_bytes": size}
+                with stats.timer("aggregate"):
+                    summary.add(directory, extension, size)
             except error_perm:
+                stats.count("failures")
                 failure_writer.writerow([item, directory])
 
     # pop back up to the original directory
     ftp.cwd(working_directory)
 
-    return agg_data
+    return summary
 
 
-def combine_agg(parent_agg, new_agg):
-    """Combine subdirectory aggregate data with parent aggregate data.
+class CatalogSummary:
+    """Streaming statistics of a crawl: the number of files, total bytes, and a quantile sketch of file sizes
+    for each extension, and the same rolled up for each directory subtree. Memory grows with the number of
+    extensions and directories near the root, not with the number of files, so a whole archive can be
+    summarized as it is crawled, and summaries of separate crawls can be merged.
 
-            :param parent_agg: (dict) aggregate data from parent directory
-            :param new_agg: (dict) aggregate data from subdirectory
-            whether to assume items with a '.' in characters -2, -3, or -4 are files
-            this avoids the slower, more costly cwd command
-            :returns: (dict) combined aggregate data"""
+        :param root: (str) directory the crawl starts from, which directory levels are counted from
+        :param max_depth: (int) number of directory levels below the root to keep rollups for - files in
+        deeper directories are counted in their ancestor at this depth"""
 
-    for extension, extension_data in new_agg.iteritems():
+    def __init__(self, root="/", max_depth=3):
+        self.root_path = root.rstrip('/') or '/'
+        self.max_depth = max_depth
+        # extension -> sketch of file sizes
+        self.extensions = {}
+        # directory tree of {"sketch": sketch of file sizes in the subtree, "children": {name: node}}
+        self.root = {"sketch": QuantileSketch(), "children": {}}
+
+    def add(self, directory, extension, size):
+        """Add a file to the summary.
+
+            :param directory: (str) path of the directory containing the file
+            :param extension: (str) file extension
+            :param size: (int) file size in bytes"""
+
+        if extension not in self.extensions:
+            self.extensions[extension] = QuantileSketch()
+        self.extensions[extension].add(size)
+
+        if (directory + '/').startswith(self.root_path + '/'):
+            directory = directory[len(self.root_path):]
+
+        node = self.root
+        node["sketch"].add(size)
+        for name in [name for name in directory.split('/') if name != ""][:self.max_depth]:
+            if name not in node["children"]:
+                node["children"][name] = {"sketch": QuantileSketch(), "children": {}}
+            node = node["children"][name]
+            node["sketch"].add(size)
+
+    def merge(self, other):
+        """Add every file in another summary to this one.
+
+            :param other: (CatalogSummary) summary to merge"""
+
+        for extension, sketch in other.extensions.iteritems():
+            if extension not in self.extensions:
+                self.extensions[extension] = QuantileSketch()
+            self.extensions[extension].merge(sketch)
+
+        # pairs of nodes to merge, walked with an explicit stack like write_manifest
+        nodes = [(self.root, other.root, 0)]
+        while len(nodes) > 0:
+            node, other_node, depth = nodes.pop()
+            node["sketch"].merge(other_node["sketch"])
+            for name, other_child in other_node["children"].iteritems():
+                if depth >= self.max_depth:
+                    # deeper than this summary keeps, so already counted in this node's sketch
+                    continue
+                if name not in node["children"]:
+                    node["children"][name] = {"sketch": QuantileSketch(), "children": {}}
+                nodes.append((node["children"][name], other_child, depth + 1))
+
+    def write(self, summary_file):
+        """Write the summary as compact JSON: statistics for each extension, and a tree of directories
+        with the statistics of each subtree, largest first.
+
+            :param summary_file: (file) file to write to"""
+
+        json.dump({"extensions": {extension: size_statistics(sketch)
+                                  for extension, sketch in self.extensions.iteritems()},
+                   "tree": tree_summary(self.root_path, self.root)},
+                  summary_file, separators=(',', ':'))
+
+
+def size_statistics(sketch):
+    """Summarize a sketch of file sizes.
+
+        :param sketch: (sketches.QuantileSketch) sketch of file sizes
+        :returns: (dict) "files", "bytes", "p50", "p95", and "max" """
+
+    if sketch.count == 0:
+        return {"files": 0, "bytes": 0, "p50": None, "p95": None, "max": None}
+
+    return {
+        "files": sketch.count,
+        "bytes": sketch.total,
+        "p50": int(round(sketch.quantile(0.5))),
+        "p95": int(round(sketch.quantile(0.95))),
+        "max": sketch.max
+    }
+
+
+def tree_summary(name, node):
+    """Summarize a directory node of a CatalogSummary and everything below it.
+
+        :param name: (str) directory name
+        :param node: (dict) directory node
+        :returns: (dict) "name", the statistics from size_statistics, and "children" sorted by total bytes"""
+
+    summary = size_statistics(node["sketch"])
+    summary["name"] = name
+    children = [tree_summary(child_name, child) for child_name, child in node["children"].iteritems()]
+    if len(children) > 0:
+        summary["children"] = sorted(children, key=lambda child: child["bytes"], reverse=True)
+
+    return summary
+
+
+def list_directory(ftp, directory):
+    """List a directory with a single MLSD command, which returns each item's type, size, and
+    modification time along with its name.
+
+        :param ftp: (ftp.FTP) ftp handle
+        :param directory: (str) directory name
+        :returns: (list((str, dict))) item names and their facts, keyed by lowercase fact name
+        :raises: (error_perm) if the directory can't be listed or the server doesn't support MLSD"""
+
+    lines = []
+    ftp.retrlines("MLSD {}".format(directory), lines.append)
+
+    items = []
+    for line in lines:
+        fact_string, _, name = line.partition(" ")
+        facts = {}
+        for fact in fact_string.rstrip(";").split(";"):
+            key, _, value = fact.partition("=")
+            facts[key.lower()] = value
+        items.append((name, facts))
+
+    return items
+
+
+def write_manifest(ftp, directory, manifest_writer, failure_writer, checksum_method=None, summary=None):
+    """Streams every file below a directory to a manifest. Each directory costs one MLSD round trip
+    instead of an nlst plus a cwd or size per item, and no cwd is needed at all. Directories are
+    walked with an explicit stack, so depth is not limited by recursion. If the server doesn't
+    support MLSD, this falls back to write_catalog.
+
+            :param ftp: (ftp.FTP) ftp handle
+            :param directory: (str) directory name
+            :param manifest_writer: (manifest.ManifestWriter) writer used to record each file
+            :param failure_writer: (csv.writer) writer used to catalog all un-listable directories
+            headers = "item name", "path"
+            :param checksum_method: ((str, str)) method from checksums.ftp_checksum_method to have the server
+            hash each file with, costing one more round trip per file, or None to leave checksums out
+            :param summary: (CatalogSummary) summary to add each file of known size to, or None
+            :returns: (int) number of files written"""
+
+    num_files = 0
+    num_directories = 0
+    directories = [directory.rstrip('/') or '/']
+
+    while len(directories) > 0:
+        directory = directories.pop()
         try:
-            parent_agg[extension]["files"] += extension_data["files"]
-            parent_agg[extension]["total_bytes"] += extension_data["total_bytes"]
-        except KeyError:
-            parent_agg[extension] = {
-                "files": extension_data["files"],
-                "total_bytes": extension_data["total_bytes"]
-            }
+            with stats.timer("list"):
+                items = list_directory(ftp, directory)
+        except error_perm as e:
+            if str(e)[:3] in ["500", "501", "502"] and num_directories == 0:
+                # MLSD isn't supported, so use the nlst-based crawler instead
+                num_entries = manifest_writer.num_entries
+                write_catalog(ftp, directory, manifest_writer, failure_writer, summary=summary)
+                return manifest_writer.num_entries - num_entries
+            stats.count("failures")
+            parent, _, name = directory.rpartition('/')
+            failure_writer.writerow([name, parent])
+            continue
+        stats.count("directories")
+        num_directories += 1
+
+        for name, facts in items:
+            item_type = facts.get("type", "").lower()
+            path = (directory + '/' + name).replace('//', '/')
+            if item_type == "dir":
+                directories.append(path)
+            elif item_type == "file":
+                size = int(facts["size"]) if "size" in facts else None
+                extension = name.split('.', 1)[1] if '.' in name else "no extension"
+                checksum = None
+                if checksum_method is not None:
+                    value = ftp_checksum(ftp, path, checksum_method)
+                    checksum = format_checksum(checksum_method[1], value) if value is not None else None
+                with stats.timer("write", extension=extension):
+                    manifest_writer.write(name, directory, size, facts.get("modify"), checksum)
+                stats.count("files", extension=extension)
+                if size is not None:
+                    stats.count("bytes", size, extension=extension)
+                    if summary is not None:
+                        with stats.timer("aggregate"):
+                            summary.add(directory, extension, size)
+                num_files += 1
 
-    return parent_agg
+    return num_files
 
 
-def write_agg(data, agg_writer):
+def write_agg(summary, agg_writer):
     """Write the aggregate data with the `agg_writer` specified above.
 
-                :param data: (dict) aggregate data to write
+                :param summary: (CatalogSummary) summary to write
                 :param agg_writer: (csv.writer) writer used to write aggregates
-                headers = "file type", "number of files", "total size (bytes)", "average size (bytes)" """
+                headers = "file type", "number of files", "total size (bytes)", "average size (bytes)",
+                "median size (bytes)", "95th percentile size (bytes)", "max size (bytes)" """
 
-    for extension, extension_data in data.iteritems():
+    for extension, sketch in sorted(summary.extensions.iteritems()):
+        statistics = size_statistics(sketch)
         agg_writer.writerow([
             extension,
-            extension_data["files"],
-            extension_data["total_bytes"],
-            extension_data["total_bytes"] / extension_data["files"]
+            statistics["files"],
+            statistics["bytes"],
+            statistics["bytes"] / statistics["files"],
+            statistics["p50"],
+            statistics["p95"],
+            statistics["max"]
         ])
 
 
@@ -0,0 +1,123 @@
+import re
+import hashlib
+from ftplib import error_perm, error_temp
+from instrumentation import stats
+
+# checksum algorithms in order of preference, as (hashlib name, HASH command name, X command)
+algorithms = [("sha256", "SHA-256", "XSHA256"), ("sha1", "SHA-1", "XSHA1"), ("md5", "MD5", "XMD5")]
+
+# number of hex digits in each algorithm's digest
+hex_lengths = {"sha256": 64, "sha1": 40, "md5": 32}
+
+
+def local_checksum(path, algorithm="sha256", chunk_size=1024 * 1024):
+    """Hash a local file's bytes, without newline translation, so the result matches a server's checksum.
+
+        :param path: (str) file path
+        :param algorithm: (str) hashlib algorithm name
+        :param chunk_size: (int) number of bytes read at a time
+        :returns: (str) hex digest"""
+
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def ftp_features(ftp):
+    """Ask an FTP server which extensions it supports.
+
+        :param ftp: (ftp.FTP) ftp handle
+        :returns: (dict) feature name -> parameters, e.g. {"HASH": "SHA-256*;SHA-1;MD5", "MDTM": ""}"""
+
+    try:
+        response = ftp.sendcmd("FEAT")
+    except error_perm:
+        # servers that predate FEAT have no extensions worth asking about
+        return {}
+
+    features = {}
+    # the first and last lines are the status lines around the feature list
+    for line in response.splitlines()[1:-1]:
+        name, _, parameters = line.strip().partition(" ")
+        features[name.upper()] = parameters.strip()
+
+    return features
+
+
+def ftp_checksum_method(ftp, features=None):
+    """Pick the best way to have an FTP server hash files itself, preferring the HASH command, and
+    otherwise the older XSHA256, XSHA1, and XMD5 commands.
+
+        :param ftp: (ftp.FTP) ftp handle
+        :param features: (dict) features from ftp_features, if they have already been asked for
+        :returns: ((str, str)) command and hashlib name of the algorithm it uses, or None if the server
+        can't compute checksums"""
+
+    if features is None:
+        features = ftp_features(ftp)
+
+    if "HASH" in features:
+        # '*' marks the algorithm the server currently uses
+        offered = [name.rstrip('*').upper() for name in features["HASH"].split(';') if name != ""]
+        for algorithm, hash_name, x_command in algorithms:
+            if hash_name in offered:
+                try:
+                    ftp.sendcmd("OPTS HASH {}".format(hash_name))
+                    return "HASH", algorithm
+                except error_perm:
+                    pass
+
+    for algorithm, hash_name, x_command in algorithms:
+        if x_command in features:
+            return x_command, algorithm
+
+    return None
+
+
+def ftp_checksum(ftp, path, method):
+    """Have an FTP server hash a file, so that it doesn't have to be downloaded to be hashed.
+
+        :param ftp: (ftp.FTP) ftp handle
+        :param path: (str) file path, relative to the working directory or absolute
+        :param method: ((str, str)) command and algorithm from ftp_checksum_method
+        :returns: (str) hex digest, or None if the server couldn't hash the file"""
+
+    command, algorithm = method
+    try:
+        with stats.timer("checksum"):
+            response = ftp.sendcmd("{} {}".format(command, path))
+    except (error_perm, error_temp):
+        stats.count("checksum_failures")
+        return None
+
+    # replies vary between servers, e.g. "213 SHA-256 0-49 <digest> <path>" or "250 <digest>", so look for a
+    # run of hex digits of the right length after the status code
+    match = re.search(r"\b([0-9a-fA-F]{{{}}})\b".format(hex_lengths[algorithm]), response[4:])
+
+    return match.group(1).lower() if match else None
+
+
+def format_checksum(algorithm, value):
+    """Combine an algorithm and digest into the form stored in manifests, e.g. "sha256:9f86d081...".
+
+        :param algorithm: (str) hashlib algorithm name
+        :param value: (str) hex digest
+        :returns: (str) checksum"""
+
+    return "{}:{}".format(algorithm, value)
+
+
+def parse_checksum(checksum):
+    """Split a checksum stored in a manifest into its algorithm and digest.
+
+        :param checksum: (str) checksum from format_checksum, or None
+        :returns: ((str, str)) algorithm and hex digest, or None if there was no checksum"""
+
+    if checksum is None:
+        return None
+    algorithm, _, value = checksum.partition(':')
+
+    return algorithm, value
@@ -0,0 +1,194 @@
+import time
+import socket
+import threading
+from collections import deque
+from contextlib import contextmanager
+from ftplib import error_temp
+from instrumentation import stats
+
+# FTP replies meaning the server is refusing work because it is busy, e.g. "421 Too many connections"
+overload_replies = ["421", "425", "426", "450"]
+
+# HTTP statuses meaning a service is rate limiting or overloaded, as raised by globus_sdk.GlobusAPIError
+overload_statuses = [429, 502, 503, 504]
+
+
+class AdaptiveLimit:
+    """Limits how many operations of one kind, like FTP connections or Globus API calls, are in flight at
+    once, adjusting the limit as it goes: it grows by `increase` for each round of operations that succeed
+    without latency rising beyond `latency_tolerance` times its baseline, and shrinks by the factor `decrease`
+    when latency does rise or the server refuses work. At most one decrease happens per `cooldown` seconds,
+    or per round trip if that is longer, so a burst of errors from the same overload counts once, and the limit
+    only grows again once the server has gone `cooldown` seconds without refusing work.
+
+        :param name: (str) name of the operations, used in stats and status
+        :param initial: (int) limit to start at
+        :param minimum: (int) lowest limit
+        :param maximum: (int) highest limit, e.g. the number of worker threads or a server's connection cap
+        :param increase: (float) amount the limit grows by per round of successful operations
+        :param decrease: (float) factor the limit is multiplied by on overload
+        :param latency_tolerance: (float) multiple of the baseline latency treated as a sign of overload
+        :param unit_bytes: (int) number of bytes that cost as much as a round trip - latency is measured per
+        unit of this size moved, so that large transfers don't look like overload
+        :param cooldown: (float) minimum seconds between decreases
+        :param window: (float) seconds over which achieved rates are measured
+        :param is_overload: (function) takes an exception and returns whether it means the server is overloaded,
+        or None to use is_overload_error"""
+
+    def __init__(self, name, initial=4, minimum=1, maximum=32, increase=1.0, decrease=0.5, latency_tolerance=2.0,
+                 unit_bytes=64 * 1024, cooldown=1.0, window=30.0, is_overload=None):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.unit_bytes = unit_bytes
+        self.cooldown = cooldown
+        self.window = window
+        self.is_overload = is_overload or is_overload_error
+
+        self.condition = threading.Condition()
+        # kept fractional, so that each success adds a share of `increase`
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        # smoothed latency of recent operations, and the lowest it has been, drifting up slowly
+        self.latency = None
+        self.baseline_latency = None
+        self.last_decrease = 0
+        self.last_overload = 0
+        self.num_errors = 0
+        self.num_overloads = 0
+        # (time, bytes) of each operation finished within the window
+        self.completions = deque()
+        # (time, limit, reason) of recent limit changes
+        self.changes = deque(maxlen=100)
+
+    @contextmanager
+    def slot(self):
+        """Wait until fewer than `limit` operations are in flight, then run a block as one more. Errors
+        raised by the block are passed through after being counted.
+
+            :returns: (Operation) operation, whose `bytes` the block can set to have them counted in the
+            achieved rate"""
+
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                # waiting with a timeout keeps the wait interruptible
+                self.condition.wait(1.0)
+            self.in_flight += 1
+
+        operation = Operation()
+        t0 = time.time()
+        try:
+            yield operation
+        except Exception as e:
+            self.finish(time.time() - t0, operation.bytes, e)
+            raise
+        self.finish(time.time() - t0, operation.bytes, None)
+
+    def finish(self, seconds, num_bytes, error):
+        now = time.time()
+        with self.condition:
+            self.in_flight -= 1
+
+            if error is None:
+                self.completions.append((now, num_bytes))
+                seconds /= 1.0 + float(num_bytes) / self.unit_bytes
+                self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+                if self.baseline_latency is None or self.latency < self.baseline_latency:
+                    self.baseline_latency = self.latency
+                else:
+                    # so that a server that has become slower for good isn't taken to be overloaded forever
+                    self.baseline_latency += 0.01 * (self.latency - self.baseline_latency)
+
+                if self.latency > self.latency_tolerance * self.baseline_latency:
+                    self.shrink(now, "latency")
+                elif self.limit < self.maximum and now - self.last_overload >= self.cooldown:
+                    # a full round of `limit` successes adds `increase`
+                    previous = int(self.limit)
+                    self.limit = min(float(self.maximum), self.limit + self.increase / self.limit)
+                    if int(self.limit) != previous:
+                        self.changes.append((now, int(self.limit), "increase"))
+            elif self.is_overload(error):
+                self.num_overloads += 1
+                stats.count("overloads", extension=self.name)
+                self.shrink(now, "overload")
+                # the limit doesn't grow again until the server has gone a while without refusing work
+                self.last_overload = now
+            else:
+                self.num_errors += 1
+
+            self.condition.notify_all()
+
+    def shrink(self, now, reason):
+        if now - self.last_decrease < max(self.cooldown, self.latency or 0):
+            return
+        self.last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * self.decrease)
+        self.changes.append((now, int(self.limit), reason))
+        stats.count("concurrency_decreases", extension=self.name)
+
+    def status(self):
+        """Get the current limit and what it is achieving.
+
+            :returns: (dict) "name", "limit", "in_flight", "operations_per_second", "bytes_per_second",
+            "latency", "baseline_latency", "errors", "overloads", and recent "changes" of the limit as
+            [seconds ago, new limit, reason]"""
+
+        now = time.time()
+        with self.condition:
+            while len(self.completions) > 0 and self.completions[0][0] < now - self.window:
+                self.completions.popleft()
+            # rates are measured over the window, or since the first operation if that was more recent
+            elapsed = max(now - self.completions[0][0], 1.0) if len(self.completions) > 0 else self.window
+
+            return {
+                "name": self.name,
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "operations_per_second": len(self.completions) / elapsed,
+                "bytes_per_second": sum(num_bytes for _, num_bytes in self.completions) / elapsed,
+                "latency": self.latency,
+                "baseline_latency": self.baseline_latency,
+                "errors": self.num_errors,
+                "overloads": self.num_overloads,
+                "changes": [[round(now - t, 1), limit, reason] for t, limit, reason in list(self.changes)[-10:]]
+            }
+
+
+class Operation:
+    """An operation run in a slot of an AdaptiveLimit, which can record how many bytes it moved."""
+
+    def __init__(self):
+        self.bytes = 0
+
+
+@contextmanager
+def slot(limit):
+    """Run a block in a slot of a limit, if there is one.
+
+        :param limit: (AdaptiveLimit) limit, or None to run the block right away
+        :returns: (Operation) operation"""
+
+    if limit is None:
+        yield Operation()
+    else:
+        with limit.slot() as operation:
+            yield operation
+
+
+def is_overload_error(error):
+    """Determine whether an error means the server is refusing work because it is busy, rather than that
+    the operation itself was bad, like a missing file.
+
+        :param error: (Exception) error raised by an operation
+        :returns: (bool) whether the error is a sign of overload"""
+
+    if isinstance(error, error_temp):
+        return str(error)[:3] in overload_replies
+    if isinstance(error, (socket.error, EOFError)):
+        # connections refused, reset, or dropped
+        return True
+
+    return getattr(error, "http_status", None) in overload_statuses
@@ -0,0 +1,141 @@
+from __future__ import print_function
+import os
+import csv
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from ftplib import FTP
+from benchmark import git_commit
+from ftp_fixture import FixtureFTPServer, build_tree, count_files
+
+
+def catalog_guess_strategy(ftp, root, work_dir):
+    from catalog_maker import write_catalog
+    with open(os.devnull, "w") as devnull:
+        write_catalog(ftp, root, csv.writer(devnull), csv.writer(devnull))
+
+
+def catalog_probe_strategy(ftp, root, work_dir):
+    from catalog_maker import write_catalog
+    with open(os.devnull, "w") as devnull:
+        write_catalog(ftp, root, csv.writer(devnull), csv.writer(devnull), guess_by_extension=False)
+
+
+def manifest_mlsd_strategy(ftp, root, work_dir):
+    from catalog_maker import write_manifest
+    from manifest import ManifestWriter
+    with open(os.devnull, "w") as devnull:
+        write_manifest(ftp, root, ManifestWriter(devnull), csv.writer(devnull))
+
+
+def manifest_mlsd_hash_strategy(ftp, root, work_dir):
+    from catalog_maker import write_manifest
+    from checksums import ftp_checksum_method
+    from manifest import ManifestWriter
+    with open(os.devnull, "w") as devnull:
+        write_manifest(ftp, root, ManifestWriter(devnull), csv.writer(devnull),
+                       checksum_method=ftp_checksum_method(ftp))
+
+
+def collector_strategy(ftp, root, work_dir):
+    from ftp_metadata_collector import write_metadata
+    # the collector downloads into and logs errors to paths relative to the working directory
+    os.mkdir(os.path.join(work_dir, "download"))
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        with open("metadata.txt", "w") as metadata_file:
+            write_metadata(ftp, metadata_file, root)
+    finally:
+        os.chdir(cwd)
+
+
+# strategy name -> function taking an ftp handle, the root directory to crawl, and a scratch directory
+crawl_strategies = {
+    "catalog_guess_by_extension": catalog_guess_strategy,
+    "catalog_cwd_probe": catalog_probe_strategy,
+    "manifest_mlsd": manifest_mlsd_strategy,
+    "manifest_mlsd_hash": manifest_mlsd_hash_strategy,
+    "ftp_metadata_collector": collector_strategy,
+}
+
+
+def run_crawl_benchmarks(num_files=500, seed=0, latency=0.005, bandwidth=None, strategies=None,
+                         root="/cdiac/cdiac.ornl.gov/pub8/"):
+    """Crawl a synthetic tree served by a local FTP fixture with each strategy, counting round trips.
+
+        :param num_files: (int) number of files in the synthetic tree
+        :param seed: (int) tree random seed
+        :param latency: (float) seconds of latency injected before each reply
+        :param bandwidth: (int) data transfer limit in bytes per second, or None for no limit
+        :param strategies: (list(str)) names of strategies to run, or None for all
+        :param root: (str) directory to crawl
+        :returns: (dict) benchmark results"""
+
+    tree = build_tree(num_files=num_files, seed=seed, root=root)
+    server = FixtureFTPServer(tree, latency=latency, bandwidth=bandwidth)
+    host, port = server.start()
+
+    results = []
+    try:
+        for name in sorted(strategies or crawl_strategies.keys()):
+            ftp = FTP()
+            ftp.connect(host, port)
+            ftp.login()
+            server.reset_counts()
+            work_dir = tempfile.mkdtemp()
+
+            try:
+                t0 = time.time()
+                crawl_strategies[name](ftp, root, work_dir)
+                seconds = time.time() - t0
+            finally:
+                shutil.rmtree(work_dir)
+
+            commands = server.reset_counts()
+            ftp.close()
+            round_trips = sum(commands.values())
+            result = {
+                "strategy": name,
+                "seconds": round(seconds, 4),
+                "round_trips": round_trips,
+                "round_trips_per_file": round(float(round_trips) / num_files, 3),
+                "commands": commands
+            }
+            results.append(result)
+            print("{strategy}: {seconds} s, {round_trips} round trips ({round_trips_per_file} per file)".format(
+                **result))
+    finally:
+        server.stop()
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": count_files(tree),
+        "seed": seed,
+        "latency": latency,
+        "bandwidth": bandwidth,
+        "results": results
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FTP crawl strategies against a local fixture server.")
+    parser.add_argument("--output", default="crawl_benchmark_results.json", help="file to save results to")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds of latency per command")
+    parser.add_argument("--bandwidth", type=int, default=None, help="data transfer limit in bytes per second")
+    parser.add_argument("--strategy", action="append", choices=sorted(crawl_strategies.keys()),
+                        help="only run this strategy (may be given more than once)")
+    args = parser.parse_args()
+
+    results = run_crawl_benchmarks(num_files=args.files, seed=args.seed, latency=args.latency,
+                                   bandwidth=args.bandwidth, strategies=args.strategy)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4, sort_keys=True)
@@ -0,0 +1,472 @@
+from __future__ import print_function
+import time
+import random
+import hashlib
+import socket
+import argparse
+import threading
+import posixpath
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+# approximate extension frequencies in pub8_list.txt, used to make the synthetic tree look like the real archive
+extension_weights = [
+    ("csv", 6332), ("pdf", 2636), ("xml", 1229), ("xls", 1148), ("txt", 1130), (None, 884), ("zip", 816),
+    ("jpg", 590), ("nc", 138), ("doc", 121), ("png", 118), ("gz", 105), ("XLS", 85), ("dat", 69),
+    ("DS_Store", 60), ("xlsx", 55), ("html", 48), ("Z", 26)
+]
+
+# extensions for which file contents are generated as columnar text rather than opaque bytes
+text_extensions = ["csv", "txt", "dat"]
+
+# modification time reported for every item
+modified = "20170101000000"
+
+# algorithms the HASH command accepts, and the hashlib name of each
+hash_algorithms = {"SHA-256": "sha256", "SHA-1": "sha1", "MD5": "md5"}
+
+
+def build_tree(num_files=2000, seed=0, root="/cdiac/cdiac.ornl.gov/pub8/", min_depth=6, max_depth=8,
+               branching=4, max_file_size=256 * 1024):
+    """Build a synthetic directory tree shaped like pub8: files sit 6-8 path components deep with a
+    mix of extensions, and some directory names contain dots so that guessing by extension is fooled.
+
+        :param num_files: (int) number of files in the tree
+        :param seed: (int) random seed - the same seed always produces the same tree
+        :param root: (str) path under which all generated directories are placed
+        :param min_depth: (int) minimum number of path components of a file, including its name
+        :param max_depth: (int) maximum number of path components of a file, including its name
+        :param branching: (int) number of distinct sub-directory names used at each level
+        :param max_file_size: (int) maximum file size in bytes
+        :returns: (dict) nested dictionary - directories are dicts and files are their sizes in bytes"""
+
+    rng = random.Random(seed)
+    tree = {}
+    extensions = [extension for extension, weight in extension_weights for _ in range(0, weight)]
+
+    # create the fixed root directories
+    root_dir = tree
+    root_parts = [part for part in root.split("/") if part != ""]
+    for part in root_parts:
+        root_dir = root_dir.setdefault(part, {})
+
+    for i in range(0, num_files):
+        directory = root_dir
+        for level in range(len(root_parts), rng.randint(min_depth, max_depth) - 1):
+            choice = rng.randint(0, branching - 1)
+            # roughly one in ten directories has a name that looks like a file
+            name = "data.v{}.{}".format(level, choice) if choice == 0 and level % 3 == 0 \
+                else "dir_{}_{}".format(level, choice)
+            directory = directory.setdefault(name, {})
+        extension = rng.choice(extensions)
+        name = "file_{}".format(i) + ("." + extension if extension is not None else "")
+        directory[name] = min(int(rng.lognormvariate(8, 2)), max_file_size)
+
+    return tree
+
+
+def file_content(path, size):
+    """Generate deterministic contents for a synthetic file.
+
+        :param path: (str) absolute path of file
+        :param size: (int) size of file in bytes
+        :returns: (bytes) file contents"""
+
+    rng = random.Random(path)
+    extension = path.rsplit(".", 1)[1] if "." in posixpath.basename(path) else None
+
+    if extension in text_extensions:
+        lines = ["time,lat,lon,value\n"] + ["{},{:.3f},{:.3f},{:.2f}\n".format(
+            i, rng.uniform(-90, 90), rng.uniform(-180, 180), rng.gauss(10, 5)) for i in range(0, 100)]
+        block = "".join(lines).encode("ascii")
+    else:
+        block = bytes(bytearray(rng.getrandbits(8) for _ in range(0, 4096)))
+
+    return (block * (size // len(block) + 1))[:size]
+
+
+class FixtureFTPServer(socketserver.ThreadingTCPServer):
+    """Local read-only FTP server backed by a synthetic directory tree, with injected per-command
+    latency and data transfer bandwidth limits. Every command received is counted, so that crawl
+    strategies can be compared by their number of round trips.
+
+        :param tree: (dict) directory tree from build_tree
+        :param latency: (float | dict) seconds to wait before replying to each command, or a dictionary of
+        command -> seconds with an optional "default" key
+        :param bandwidth: (int) data transfer rate limit in bytes per second, or None for no limit
+        :param host: (str) interface to listen on
+        :param port: (int) port to listen on - 0 picks a free port
+        :param features: (list(str)) lines to advertise in response to FEAT
+        :param max_connections: (int) number of control connections served at once - any more are refused
+        with "421", as busy servers do - or None for no limit
+        :param idle_timeout: (float) seconds a control connection may go without a command before the server
+        closes it with "421", or None to keep idle connections open
+        :param drop_every: (int) drop the connection instead of answering every this many commands after login,
+        partway through the data if the command is a transfer, or None to never drop connections"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, tree, latency=0.0, bandwidth=None, host="127.0.0.1", port=0,
+                 features=("HASH SHA-256*;SHA-1;MD5", "MDTM", "MLST type*;size*;modify*;", "REST STREAM", "SIZE",
+                           "XMD5", "XSHA1", "XSHA256"), max_connections=None, idle_timeout=None,
+                 drop_every=None):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FixtureFTPHandler)
+        self.tree = tree
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.features = list(features)
+        self.max_connections = max_connections
+        self.num_connections = 0
+        self.idle_timeout = idle_timeout
+        self.drop_every = drop_every
+        self.num_droppable_commands = 0
+        self.command_counts = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server_address[0], self.server_address[1]
+
+    def start(self):
+        """Serve in a background thread.
+
+            :returns: ((str, int)) host and port the server is listening on"""
+
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.address
+
+    def stop(self):
+        """Stop serving and close the listening socket."""
+
+        self.shutdown()
+        self.server_close()
+
+    def count_command(self, command):
+        with self.lock:
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+    def reset_counts(self):
+        """Reset command counts, e.g. between crawl strategies.
+
+            :returns: (dict) command counts before the reset"""
+
+        with self.lock:
+            counts = self.command_counts
+            self.command_counts = {}
+
+        return counts
+
+    def should_drop(self, command):
+        if self.drop_every is None or command in ["USER", "PASS", "QUIT"]:
+            return False
+        with self.lock:
+            self.num_droppable_commands += 1
+            return self.num_droppable_commands % self.drop_every == 0
+
+    def command_latency(self, command):
+        if isinstance(self.latency, dict):
+            return self.latency.get(command, self.latency.get("default", 0.0))
+        return self.latency
+
+    def lookup(self, path):
+        """Find the item at an absolute path.
+
+            :param path: (str) normalized absolute path
+            :returns: (dict | int) directory dictionary or file size, or None if the path does not exist"""
+
+        item = self.tree
+        for part in [part for part in path.split("/") if part != ""]:
+            if not isinstance(item, dict) or part not in item:
+                return None
+            item = item[part]
+
+        return item
+
+
+class FixtureFTPHandler(socketserver.StreamRequestHandler):
+    """Handles one FTP control connection to a FixtureFTPServer."""
+
+    def setup(self):
+        # replies are small back-to-back writes, which Nagle's algorithm would otherwise delay
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        socketserver.StreamRequestHandler.setup(self)
+        self.cwd = "/"
+        self.rest = 0
+        self.passive_socket = None
+        self.hash_algorithm = "SHA-256"
+        self.dropping = False
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("latin-1"))
+        self.wfile.flush()
+
+    def resolve(self, argument):
+        if argument is None or argument == "":
+            return self.cwd
+        return posixpath.normpath(posixpath.join(self.cwd, argument)).replace("//", "/")
+
+    def handle(self):
+        with self.server.lock:
+            refused = self.server.max_connections is not None \
+                and self.server.num_connections >= self.server.max_connections
+            if not refused:
+                self.server.num_connections += 1
+        if refused:
+            self.server.count_command("refused")
+            self.reply("421 too many connections")
+            return
+        try:
+            self.serve_commands()
+        finally:
+            with self.server.lock:
+                self.server.num_connections -= 1
+
+    def serve_commands(self):
+        self.reply("220 fixture FTP server ready")
+        self.request.settimeout(self.server.idle_timeout)
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.timeout:
+                self.reply("421 idle timeout - closing control connection")
+                break
+            if not line:
+                break
+            line = line.decode("latin-1").rstrip("\r\n")
+            command, _, argument = line.partition(" ")
+            command = command.upper()
+
+            self.server.count_command(command)
+            time.sleep(self.server.command_latency(command))
+
+            if self.server.should_drop(command):
+                self.server.count_command("dropped")
+                if command not in ["RETR", "NLST", "LIST", "MLSD"]:
+                    break
+                # transfers are cut off partway through the data
+                self.dropping = True
+
+            handler = getattr(self, "ftp_" + command, None)
+            if handler is None:
+                self.reply("502 command not implemented")
+                continue
+            try:
+                if handler(argument) is False:
+                    break
+            except socket.error:
+                break
+
+        if self.passive_socket is not None:
+            self.passive_socket.close()
+
+    def ftp_USER(self, argument):
+        self.reply("331 any password will do")
+
+    def ftp_PASS(self, argument):
+        self.reply("230 logged in")
+
+    def ftp_SYST(self, argument):
+        self.reply("215 UNIX Type: L8")
+
+    def ftp_FEAT(self, argument):
+        self.reply("211-Features:")
+        for feature in self.server.features:
+            self.reply(" " + feature)
+        self.reply("211 End")
+
+    def ftp_OPTS(self, argument):
+        option, _, value = argument.partition(" ")
+        if option.upper() != "HASH":
+            self.reply("200 ok")
+        elif value == "":
+            self.reply("200 {}".format(self.hash_algorithm))
+        elif value.upper() in hash_algorithms:
+            self.hash_algorithm = value.upper()
+            self.reply("200 {}".format(self.hash_algorithm))
+        else:
+            self.reply("501 unknown algorithm {}".format(value))
+
+    def ftp_NOOP(self, argument):
+        self.reply("200 ok")
+
+    def ftp_TYPE(self, argument):
+        self.reply("200 type set")
+
+    def ftp_QUIT(self, argument):
+        self.reply("221 goodbye")
+        return False
+
+    def ftp_PWD(self, argument):
+        self.reply('257 "{}" is the current directory'.format(self.cwd))
+
+    def ftp_CWD(self, argument):
+        path = self.resolve(argument)
+        if isinstance(self.server.lookup(path), dict):
+            self.cwd = path
+            self.reply("250 directory changed to {}".format(path))
+        else:
+            self.reply("550 {}: no such directory".format(argument))
+
+    def ftp_CDUP(self, argument):
+        self.ftp_CWD("..")
+
+    def ftp_SIZE(self, argument):
+        item = self.server.lookup(self.resolve(argument))
+        if item is None or isinstance(item, dict):
+            self.reply("550 {}: not a regular file".format(argument))
+        else:
+            self.reply("213 {}".format(item))
+
+    def ftp_MDTM(self, argument):
+        item = self.server.lookup(self.resolve(argument))
+        if item is None or isinstance(item, dict):
+            self.reply("550 {}: not a regular file".format(argument))
+        else:
+            self.reply("213 {}".format(modified))
+
+    def file_digest(self, argument, algorithm):
+        path = self.resolve(argument)
+        item = self.server.lookup(path)
+        if item is None or isinstance(item, dict):
+            self.reply("550 {}: not a regular file".format(argument))
+            return None, None
+        return item, hashlib.new(algorithm, file_content(path, item)).hexdigest()
+
+    def ftp_HASH(self, argument):
+        size, digest = self.file_digest(argument, hash_algorithms[self.hash_algorithm])
+        if digest is not None:
+            self.reply("213 {} 0-{} {} {}".format(self.hash_algorithm, max(size - 1, 0), digest, argument))
+
+    def ftp_XSHA256(self, argument):
+        size, digest = self.file_digest(argument, "sha256")
+        if digest is not None:
+            self.reply("250 {}".format(digest))
+
+    def ftp_XSHA1(self, argument):
+        size, digest = self.file_digest(argument, "sha1")
+        if digest is not None:
+            self.reply("250 {}".format(digest))
+
+    def ftp_XMD5(self, argument):
+        size, digest = self.file_digest(argument, "md5")
+        if digest is not None:
+            self.reply("250 {}".format(digest))
+
+    def ftp_REST(self, argument):
+        self.rest = int(argument)
+        self.reply("350 restarting at {}".format(self.rest))
+
+    def ftp_PASV(self, argument):
+        self.open_passive_socket()
+        host, port = self.passive_socket.getsockname()
+        self.reply("227 Entering Passive Mode ({},{},{})".format(host.replace(".", ","), port >> 8, port & 0xFF))
+
+    def ftp_EPSV(self, argument):
+        self.open_passive_socket()
+        self.reply("229 Entering Extended Passive Mode (|||{}|)".format(self.passive_socket.getsockname()[1]))
+
+    def open_passive_socket(self):
+        if self.passive_socket is not None:
+            self.passive_socket.close()
+        self.passive_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive_socket.bind((self.server.server_address[0], 0))
+        self.passive_socket.listen(1)
+
+    def send_data(self, data):
+        """Send data over the passive data connection, throttled to the server's bandwidth."""
+
+        if self.passive_socket is None:
+            self.reply("425 use PASV first")
+            return
+        self.reply("150 opening data connection")
+        self.passive_socket.settimeout(10)
+        connection, _ = self.passive_socket.accept()
+        self.passive_socket.close()
+        self.passive_socket = None
+        try:
+            chunk_size = 8192
+            end = len(data) // 2 if self.dropping else len(data)
+            for i in range(0, end, chunk_size):
+                chunk = data[i:min(i + chunk_size, end)]
+                connection.sendall(chunk)
+                if self.server.bandwidth:
+                    time.sleep(float(len(chunk)) / self.server.bandwidth)
+        finally:
+            connection.close()
+        if self.dropping:
+            raise socket.error("dropped by fixture")
+        self.reply("226 transfer complete")
+
+    def listing(self, argument):
+        path = self.resolve(argument)
+        item = self.server.lookup(path)
+        if not isinstance(item, dict):
+            self.reply("550 {}: no such directory".format(argument))
+            return None
+        return sorted(item.items())
+
+    def ftp_NLST(self, argument):
+        items = self.listing(argument)
+        if items is not None:
+            self.send_data("".join([name + "\r\n" for name, _ in items]).encode("latin-1"))
+
+    def ftp_LIST(self, argument):
+        items = self.listing(argument)
+        if items is not None:
+            self.send_data("".join([
+                "{} 1 ftp ftp {:>12} Jan 01  2017 {}\r\n".format(
+                    "drwxr-xr-x" if isinstance(value, dict) else "-rw-r--r--",
+                    0 if isinstance(value, dict) else value, name)
+                for name, value in items]).encode("latin-1"))
+
+    def ftp_MLSD(self, argument):
+        items = self.listing(argument)
+        if items is not None:
+            self.send_data("".join([
+                ("type=dir;modify={};" if isinstance(value, dict) else "type=file;size={1};modify={0};").format(
+                    modified, value) + " " + name + "\r\n"
+                for name, value in items]).encode("latin-1"))
+
+    def ftp_RETR(self, argument):
+        path = self.resolve(argument)
+        item = self.server.lookup(path)
+        rest, self.rest = self.rest, 0
+        if item is None or isinstance(item, dict):
+            self.reply("550 {}: not a regular file".format(argument))
+            return
+        self.send_data(file_content(path, item)[rest:])
+
+
+def count_files(tree):
+    """Count the files in a directory tree.
+
+        :param tree: (dict) directory tree from build_tree
+        :returns: (int) number of files"""
+
+    return sum([count_files(value) if isinstance(value, dict) else 1 for value in tree.values()])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic pub8-shaped tree over FTP.")
+    parser.add_argument("--port", type=int, default=2121)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of latency per command")
+    parser.add_argument("--bandwidth", type=int, default=None, help="data transfer limit in bytes per second")
+    args = parser.parse_args()
+
+    tree = build_tree(num_files=args.files, seed=args.seed)
+    server = FixtureFTPServer(tree, latency=args.latency, bandwidth=args.bandwidth, port=args.port)
+    print("serving {} files on {}:{}".format(count_files(tree), *server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
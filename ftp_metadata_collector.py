@@ -1,9 +1,16 @@
 import os
 import json
+import time
+import socket
+import threading
 from hashlib import sha256
 from re import compile
-from ftplib import error_perm
-from metadata_util import get_metadata
+from ftplib import error_perm, error_temp
+from concurrency import AdaptiveLimit
+from metadata_util import extract_metadata
+from manifest import full_path
+from instrumentation import stats
+from checksums import ftp_checksum, parse_checksum
 
 # pattern used to distinguish files from directories - has '.' in 2nd, 3rd, or 4th to last character
 file_pattern = compile("^.*\..{2,4}$")
@@ -37,13 +44,15 @@ def is_dir(ftp, item, guess_by_extension=True):
         return False
 
 
-def write_metadata(ftp, metadata_file, directory):
+def write_metadata(ftp, metadata_file, directory, checksum_method=None):
     """Catalogs the name, path, size, and type of each file, along with any metadata we
     can collect, writing JSON to the metadata_file.
 
             :param ftp: (ftp.FTP) ftp handle
             :param metadata_file: (files) JSON file for metadata
             :param directory: (str) directory name
+            :param checksum_method: ((str, str)) method from checksums.ftp_checksum_method to have the server
+            hash each file with, or None to only hash downloaded files locally
             :returns: (dict) aggregate file number and size data for each file extension"""
 
     # dictionary storing information that will populate the aggregate csv
@@ -59,66 +68,31 @@ def write_metadata(ftp, metadata_file, directory):
     # print "collecting metadata from directory: " + directory
 
     # all items in current directory
-    item_list = ftp.nlst()
+    with stats.timer("list"):
+        item_list = ftp.nlst()
+    stats.count("directories")
 
     for item in item_list:
-        if is_dir(ftp, item):
+        with stats.timer("list"):
+            item_is_dir = is_dir(ftp, item)
+        if item_is_dir:
             # recursively catalog subdirectory and get its metadata stats
-            new_agg_data = write_metadata(ftp, metadata_file, directory + item)
+            new_agg_data = write_metadata(ftp, metadata_file, directory + item, checksum_method=checksum_method)
             # add subdirectory stats to total stats
-            combine_agg(agg_data, new_agg_data)
+            with stats.timer("aggregate"):
+                combine_agg(agg_data, new_agg_data)
             # print stats
         else:
             # some items are corrupt or strange and can't have htier size collected, so skip them
             try:
-                print "collecting metadata from item: " + directory + item
                 extension = item.split('.', 1)[1] if '.' in item else "no extension"
-                metadata = {
-                    "file": item,
-                    "path": directory,
-                    "type": extension,
-                    "size": ftp.size(item)
-                }
-
-                # if we might be able to get real metadata from this file, download it
-                if extension in ["txt", "csv", "dat"]:
-                    try:
-                        local_path_to_item = "download/{}".format(item)
-                        with open(local_path_to_item, 'wb') as f:
-                            ftp.retrbinary('RETR {}'.format(item), f.write)
-
-                            # metadata["size"] = os.path.getsize(local_path_to_item)
-                            # metadata["checksum"] = sha256(open(local_path_to_item, 'rb').read()).hexdigest()
-
-                            content_metadata = get_metadata(item, "download/")
-
-                            # add data from this file to total aggregate data
-                            # try:
-                            #     agg_data[extension]["total_bytes"] += metadata["size"]
-                            # except KeyError:
-                            #     agg_data[extension] = {
-                            #         "total_bytes": metadata["size"],
-                            #         "total_bytes_with_metadata": 0
-                            #     }
-
-                            if content_metadata != {}:
-                                metadata["content_metadata"] = content_metadata
-                                agg_data[extension]["total_bytes_with_metadata"] += metadata["size"]
-
-                            # write metadata to file
-                            try:
-                                metadata_file.write(json.dumps(metadata) + ",")
-                            except Exception as e:
-                                with open("errors.txt", "w") as error_file:
-                                    error_file.write(directory + item + ":(a) error = " + str(e) + "\n")
-
-                        os.remove(local_path_to_item)
-                    except Exception as e:
-                        with open("errors.txt", "w") as error_file:
-                            error_file.write(directory + item + ":(b) error = " + str(e) + "\n")
-
+                with stats.timer("list", extension=extension):
+                    size = ftp.size(item)
+                write_file_metadata(ftp, metadata_file, item, directory, item, extension, size, agg_data,
+                                    checksum_method=checksum_method)
             except Exception as e:  # error_perm if size cannot be read
-                with open("errors.txt", "w") as error_file:
+                stats.count("failures")
+                with open("errors.txt", "a") as error_file:
                     error_file.write(directory + item + ":(c) error = " + str(e) + "\n")
                 pass
 
@@ -128,6 +102,224 @@ def write_metadata(ftp, metadata_file, directory):
     return agg_data
 
 
+def write_file_metadata(ftp, metadata_file, item, directory, remote_path, extension, size, agg_data,
+                        local_path="download/", checksum_method=None, checksum=None):
+    """Download a file that might have extractable metadata, extract it, and write the file's
+    metadata as JSON to the metadata_file.
+
+            :param ftp: (ftp.FTP) ftp handle
+            :param metadata_file: (files) JSON file for metadata
+            :param item: (str) file name
+            :param directory: (str) directory containing the file, ending with '/'
+            :param remote_path: (str) path to RETR the file by, relative to the working directory or absolute
+            :param extension: (str) file extension
+            :param size: (int) file size in bytes
+            :param agg_data: (dict) aggregate data to add this file to
+            :param local_path: (str) local directory to download into
+            :param checksum_method: ((str, str)) method from checksums.ftp_checksum_method to have the server
+            hash the file with, or None to hash the file locally after downloading it
+            :param checksum: ((str, str)) algorithm and hex digest of the file, if already known"""
+
+    metadata = {
+        "file": item,
+        "path": directory,
+        "type": extension,
+        "size": size
+    }
+
+    # if we might be able to get real metadata from this file, download it
+    if extension in ["txt", "csv", "dat"]:
+        try:
+            # having the server hash the file saves reading it all again after the download
+            if checksum is None and checksum_method is not None:
+                value = ftp_checksum(ftp, remote_path, checksum_method)
+                if value is not None:
+                    checksum = (checksum_method[1], value)
+
+            local_path_to_item = local_path + item
+            with open(local_path_to_item, 'wb') as f:
+                with stats.timer("download", extension=extension):
+                    ftp.retrbinary('RETR {}'.format(remote_path), f.write)
+                # make sure the whole download is on disk before it is read back for extraction
+                f.flush()
+
+                # manifests made from a plain list of paths don't know how big each file is
+                if metadata["size"] is None:
+                    metadata["size"] = os.path.getsize(local_path_to_item)
+                stats.count("downloaded_bytes", metadata["size"], extension=extension)
+
+                # the local checksum is only computed if the server didn't provide one
+                content_metadata = extract_metadata(item, local_path, checksum=checksum)
+                metadata["checksum"] = content_metadata["system"]["checksum"]
+                metadata["checksum_algorithm"] = content_metadata["system"]["checksum_algorithm"]
+
+                # add data from this file to total aggregate data
+                try:
+                    agg_data[extension]["total_bytes"] += metadata["size"]
+                except KeyError:
+                    agg_data[extension] = {
+                        "total_bytes": metadata["size"],
+                        "total_bytes_with_metadata": 0
+                    }
+
+                if content_metadata["class"] != "unknown":
+                    metadata["content_metadata"] = content_metadata
+                    agg_data[extension]["total_bytes_with_metadata"] += metadata["size"]
+
+                # write metadata to file
+                try:
+                    with stats.timer("write", extension=extension):
+                        metadata_file.write(json.dumps(metadata) + ",")
+                except Exception as e:
+                    with open("errors.txt", "a") as error_file:
+                        error_file.write(directory + item + ":(a) error = " + str(e) + "\n")
+        except (error_temp, socket.error, EOFError):
+            # the connection or server failed rather than the file, which the caller has to know about
+            raise
+        except Exception as e:
+            stats.count("failures")
+            with open("errors.txt", "a") as error_file:
+                error_file.write(directory + item + ":(b) error = " + str(e) + "\n")
+        finally:
+            # the download is removed however extraction went, so failures don't fill the disk
+            if os.path.exists(local_path + item):
+                os.remove(local_path + item)
+    else:
+        # counted so that progress against a manifest includes the files there was nothing to collect from
+        stats.count("skipped", extension=extension)
+
+
+def write_metadata_from_manifest(ftp, metadata_file, entries, local_path="download/", checksum_method=None):
+    """Collect metadata from the files listed in a manifest, so that the server only has to be
+    asked for the files themselves rather than crawled again.
+
+            :param ftp: (ftp.FTP) ftp handle
+            :param metadata_file: (files) JSON file for metadata
+            :param entries: (iterable(dict)) manifest entries, e.g. from manifest.read_manifest filtered by
+            extension, size, or path prefix
+            :param local_path: (str) local directory to download into
+            :param checksum_method: ((str, str)) method from checksums.ftp_checksum_method to have the server
+            hash files with, or None to only hash downloaded files locally - files whose manifest entry
+            already has a checksum aren't hashed again
+            :returns: (dict) aggregate file number and size data for each file extension"""
+
+    agg_data = {}
+
+    for entry in entries:
+        try:
+            write_file_metadata(ftp, metadata_file, entry["file"], entry["path"], full_path(entry),
+                                entry["extension"], entry["size"], agg_data, local_path=local_path,
+                                checksum_method=checksum_method, checksum=parse_checksum(entry["checksum"]))
+        except Exception as e:
+            stats.count("failures")
+            with open("errors.txt", "a") as error_file:
+                error_file.write(full_path(entry) + ":(c) error = " + str(e) + "\n")
+
+    return agg_data
+
+
+def write_metadata_in_parallel(connect, metadata_file, entries, local_path="download/", checksum_method=None,
+                               max_connections=8, limit=None, max_attempts=5, progress=None):
+    """Collect metadata from the files listed in a manifest over several FTP connections at once. The number
+    of connections in use adapts to the server: it grows while files keep arriving quickly, and shrinks when
+    transfers slow down or the server refuses connections, e.g. with "421 too many connections".
+
+            :param connect: (function) opens and logs in a new ftp.FTP connection
+            :param metadata_file: (files) JSON file for metadata
+            :param entries: (iterable(dict)) manifest entries
+            :param local_path: (str) local directory to download into - each connection uses its own subdirectory
+            :param checksum_method: ((str, str)) method from checksums.ftp_checksum_method to have the server
+            hash files with, or None to only hash downloaded files locally
+            :param max_connections: (int) most connections to open at once
+            :param limit: (concurrency.AdaptiveLimit) limit on connections in use, whose status shows how it has
+            adapted - by default one starting at 2 and growing to `max_connections`
+            :param max_attempts: (int) number of times a file is tried when the connection or server fails
+            :param progress: (progress.Progress) reporter to show the files still to collect and the connection
+            limit in, if any
+            :returns: (dict) aggregate file number and size data for each file extension"""
+
+    if limit is None:
+        limit = AdaptiveLimit("ftp_connections", initial=min(2, max_connections), maximum=max_connections)
+    pending = [(entry, 0) for entry in entries]
+    pending.reverse()
+    agg_data = {}
+    lock = threading.Lock()
+    num_connections = [0]
+    if progress is not None:
+        progress.watch_queue("files", lambda: len(pending))
+        progress.watch_limit(limit)
+
+    class LockedFile:
+        # lets the threads share the metadata file without interleaving their writes
+        def write(self, text):
+            with lock:
+                metadata_file.write(text)
+
+    def collect(worker_path):
+        ftp = None
+        if not os.path.isdir(worker_path):
+            os.makedirs(worker_path)
+        while True:
+            with lock:
+                if len(pending) == 0:
+                    break
+                entry, attempts = pending.pop()
+            file_agg = {}
+            try:
+                with limit.slot() as operation:
+                    if ftp is None:
+                        ftp = connect()
+                        with lock:
+                            num_connections[0] += 1
+                    write_file_metadata(ftp, LockedFile(), entry["file"], entry["path"], full_path(entry),
+                                        entry["extension"], entry["size"], file_agg, local_path=worker_path,
+                                        checksum_method=checksum_method, checksum=parse_checksum(entry["checksum"]))
+                    operation.bytes = entry["size"] or 0
+            except Exception as e:
+                if ftp is not None:
+                    # the connection may be unusable, so start again with a new one
+                    ftp.close()
+                    ftp = None
+                    with lock:
+                        num_connections[0] -= 1
+                if attempts + 1 < max_attempts:
+                    if limit.is_overload(e):
+                        # give the server a moment before asking again
+                        time.sleep(min(0.1 * 2 ** attempts, 5.0))
+                    with lock:
+                        pending.append((entry, attempts + 1))
+                    continue
+                stats.count("failures")
+                with open("errors.txt", "a") as error_file:
+                    error_file.write(full_path(entry) + ":(c) error = " + str(e) + "\n")
+                continue
+
+            with lock:
+                combine_agg(agg_data, file_agg)
+                # give connections back once the limit has come down
+                close = num_connections[0] > int(limit.limit)
+                if close:
+                    num_connections[0] -= 1
+            if close:
+                ftp.close()
+                ftp = None
+
+        if ftp is not None:
+            ftp.close()
+            with lock:
+                num_connections[0] -= 1
+
+    workers = [threading.Thread(target=collect, args=(os.path.join(local_path, str(i), ""),))
+               for i in range(max_connections)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return agg_data
+
+
 def combine_agg(parent_agg, new_agg):
     """Combine subdirectory aggregate data with parent aggregate data.
 
@@ -0,0 +1,211 @@
+import time
+import socket
+import posixpath
+import threading
+from ftplib import FTP, error_temp, error_reply, error_proto
+from instrumentation import stats
+
+# errors after which the connection can't be trusted, so the session logs in again and retries - permanent
+# errors like "550 no such file" are passed straight through
+connection_errors = (socket.error, EOFError, error_temp, error_reply, error_proto)
+
+
+class FTPSession:
+    """Stands in for an ftplib.FTP connection in the crawlers and collectors, for crawls that run longer
+    than a control connection lasts. When a command fails because the connection dropped, timed out, or
+    the server was briefly unavailable, the session logs in again, returns to the working directory and
+    the options set with OPTS, and retries the command after an exponentially growing wait. Downloads pick
+    up where they were cut off with REST. While no command is running, e.g. during a long extraction, a
+    NOOP is sent every `keepalive` seconds so that the server doesn't close the connection as idle.
+
+    Only commands that can be repeated safely should be sent through a session - which all of the
+    crawlers' are, since they only read.
+
+        :param host: (str) server host name
+        :param port: (int) server port
+        :param user: (str) user name
+        :param passwd: (str) password
+        :param timeout: (float) seconds to wait on the server before treating the connection as dropped
+        :param max_retries: (int) number of times a command is retried before its error is raised
+        :param backoff: (float) seconds to wait before the first retry, doubling with each one after
+        :param max_backoff: (float) longest wait between retries
+        :param keepalive: (float) seconds without a command after which a NOOP is sent, or None to not send
+        any"""
+
+    def __init__(self, host, port=21, user="anonymous", passwd="", timeout=60, max_retries=5, backoff=1.0,
+                 max_backoff=60.0, keepalive=60.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.keepalive = keepalive
+
+        # held for the whole of each command, so that keepalives never interrupt one
+        self.lock = threading.RLock()
+        self.ftp = None
+        self.directory = None
+        # OPTS commands sent, e.g. to pick a HASH algorithm, which are repeated on each new connection
+        self.options = []
+        self.num_connections = 0
+        self.last_command = time.time()
+        self.closed = threading.Event()
+
+        self.call(lambda ftp: None)
+        if keepalive is not None:
+            thread = threading.Thread(target=self.send_keepalives)
+            thread.daemon = True
+            thread.start()
+
+    def connect(self):
+        ftp = FTP()
+        ftp.connect(self.host, self.port, timeout=self.timeout)
+        ftp.login(self.user, self.passwd)
+        if self.directory is None:
+            self.directory = ftp.pwd()
+        else:
+            ftp.cwd(self.directory)
+        for option in self.options:
+            ftp.sendcmd(option)
+
+        if self.num_connections > 0:
+            stats.count("reconnects")
+        self.num_connections += 1
+        self.ftp = ftp
+
+    def drop(self):
+        if self.ftp is not None:
+            try:
+                self.ftp.close()
+            except connection_errors:
+                pass
+            self.ftp = None
+
+    def call(self, command):
+        """Run a command on the connection, logging in again and retrying if the connection fails.
+
+            :param command: (function) takes an ftplib.FTP connection and runs the command on it
+            :returns: result of the command"""
+
+        for attempt in range(self.max_retries + 1):
+            with self.lock:
+                try:
+                    if self.ftp is None:
+                        self.connect()
+                    result = command(self.ftp)
+                    self.last_command = time.time()
+                    return result
+                except connection_errors:
+                    self.drop()
+                    if attempt == self.max_retries:
+                        raise
+            stats.count("retries")
+            time.sleep(min(self.backoff * 2 ** attempt, self.max_backoff))
+
+    def pwd(self):
+        self.directory = self.call(lambda ftp: ftp.pwd())
+        return self.directory
+
+    def cwd(self, directory):
+        result = self.call(lambda ftp: ftp.cwd(directory))
+        self.directory = posixpath.normpath(posixpath.join(self.directory, directory))
+        return result
+
+    def nlst(self, *args):
+        return self.call(lambda ftp: ftp.nlst(*args))
+
+    def size(self, file_name):
+        return self.call(lambda ftp: ftp.size(file_name))
+
+    def sendcmd(self, cmd):
+        result = self.call(lambda ftp: ftp.sendcmd(cmd))
+        if cmd.upper().startswith("OPTS ") and cmd not in self.options:
+            self.options.append(cmd)
+        return result
+
+    def voidcmd(self, cmd):
+        return self.call(lambda ftp: ftp.voidcmd(cmd))
+
+    def retrlines(self, cmd, callback=None):
+        """Run a listing command like NLST or MLSD. Lines are only passed on once the whole listing has
+        arrived, so that a listing retried partway through doesn't repeat lines.
+
+            :param cmd: (str) command
+            :param callback: (function) called with each line, or None to print them
+            :returns: (str) final response"""
+
+        def listing(ftp):
+            lines = []
+            response = ftp.retrlines(cmd, lines.append)
+            return response, lines
+
+        response, lines = self.call(listing)
+        for line in lines:
+            if callback is None:
+                print line
+            else:
+                callback(line)
+
+        return response
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        """Run a transfer command like RETR. If the connection drops partway through a RETR, the retry asks
+        the server to restart from the last byte received rather than from the beginning.
+
+            :param cmd: (str) command
+            :param callback: (function) called with each block of data
+            :param blocksize: (int) maximum block size
+            :param rest: (int) offset to start the transfer from
+            :returns: (str) final response"""
+
+        position = [rest or 0]
+
+        def receive(block):
+            position[0] += len(block)
+            callback(block)
+
+        def transfer(ftp):
+            if position[0] > 0 and position[0] != rest:
+                stats.count("resumed_transfers")
+            return ftp.retrbinary(cmd, receive, blocksize, position[0] or None)
+
+        if not cmd.upper().startswith("RETR"):
+            return self.call(lambda ftp: ftp.retrbinary(cmd, callback, blocksize, rest))
+
+        return self.call(transfer)
+
+    def send_keepalives(self):
+        while not self.closed.wait(min(self.keepalive, 5.0)):
+            if time.time() - self.last_command < self.keepalive:
+                continue
+            # a command that is already running keeps the connection alive itself
+            if not self.lock.acquire(False):
+                continue
+            try:
+                if self.ftp is not None:
+                    self.ftp.voidcmd("NOOP")
+                    stats.count("keepalives")
+                self.last_command = time.time()
+            except connection_errors:
+                # the next command will log in again
+                self.drop()
+            finally:
+                self.lock.release()
+
+    def quit(self):
+        self.closed.set()
+        with self.lock:
+            try:
+                if self.ftp is not None:
+                    self.ftp.quit()
+            except connection_errors:
+                pass
+            self.ftp = None
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            self.drop()
@@ -0,0 +1,139 @@
+import json
+import time
+import threading
+
+
+class Stats(object):
+    """Accumulates per-stage timings and counters, broken down by file extension and class.
+    Each update is a couple of dictionary operations, so it is cheap enough to leave on
+    for full runs."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def timer(self, stage, extension=None, file_class=None):
+        """Time a block of code as a stage.
+
+            :param stage: (str) stage name, e.g. "list", "download", "hash", "classify", "parse",
+            "aggregate", or "write"
+            :param extension: (str) extension of the file being processed, if any
+            :param file_class: (str) class of the file being processed, if known - can also be set on
+            the returned timer once the block has determined it
+            :returns: (Timer) context manager"""
+
+        return Timer(self, stage, extension, file_class)
+
+    def add_time(self, stage, seconds, extension=None, file_class=None):
+        """Record time spent in a stage.
+
+            :param stage: (str) stage name
+            :param seconds: (float) time spent
+            :param extension: (str) extension of the file being processed, if any
+            :param file_class: (str) class of the file being processed, if any"""
+
+        with self.lock:
+            add_to_breakdown(self.timers, stage, seconds, extension, file_class)
+
+    def count(self, name, amount=1, extension=None, file_class=None):
+        """Increment a counter.
+
+            :param name: (str) counter name, e.g. "files" or "bytes"
+            :param amount: (int) amount to add
+            :param extension: (str) extension of the file being counted, if any
+            :param file_class: (str) class of the file being counted, if any"""
+
+        with self.lock:
+            add_to_breakdown(self.counters, name, amount, extension, file_class)
+
+    def total(self, name):
+        """Get a counter's total without copying everything, e.g. to report progress.
+
+            :param name: (str) counter name
+            :returns: (int | float) total, or 0 if nothing has been counted"""
+
+        with self.lock:
+            return self.counters[name]["total"] if name in self.counters else 0
+
+    def summary(self):
+        """Get all timings and counters.
+
+            :returns: (dict) JSON-serializable summary"""
+
+        with self.lock:
+            return json.loads(json.dumps({
+                "wall_seconds": time.time() - self.started,
+                "timers": self.timers,
+                "counters": self.counters
+            }))
+
+    def dump(self, stats_file):
+        """Write all timings and counters to a JSON stats file.
+
+            :param stats_file: (str) path of the stats file"""
+
+        with open(stats_file, "w") as f:
+            json.dump(self.summary(), f, indent=4, sort_keys=True)
+
+    def reset(self):
+        """Clear all timings and counters."""
+
+        with self.lock:
+            self.started = time.time()
+            self.timers = {}
+            self.counters = {}
+
+
+class Timer(object):
+    """Context manager that records the time spent in its block with a Stats object."""
+
+    __slots__ = ["stats", "stage", "extension", "file_class", "t0"]
+
+    def __init__(self, stats, stage, extension=None, file_class=None):
+        self.stats = stats
+        self.stage = stage
+        self.extension = extension
+        self.file_class = file_class
+        self.t0 = None
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add_time(self.stage, time.time() - self.t0, self.extension,
+                            self.file_class if exc_type is None else "error")
+        return False
+
+
+def add_to_breakdown(totals, name, amount, extension=None, file_class=None):
+    """Add an amount to a named total and its per-extension and per-class breakdowns.
+
+        :param totals: (dict) totals to add to
+        :param name: (str) name of total
+        :param amount: (int | float) amount to add
+        :param extension: (str) extension to attribute the amount to, if any
+        :param file_class: (str) class to attribute the amount to, if any"""
+
+    try:
+        total = totals[name]
+        total["count"] += 1
+        total["total"] += amount
+        if amount > total["max"]:
+            total["max"] = amount
+    except KeyError:
+        total = totals[name] = {"count": 1, "total": amount, "max": amount, "extension": {}, "class": {}}
+
+    for breakdown, key in [("extension", extension), ("class", file_class)]:
+        if key is not None:
+            try:
+                total[breakdown][key][0] += 1
+                total[breakdown][key][1] += amount
+            except KeyError:
+                total[breakdown][key] = [1, amount]
+
+
+# shared stats object used by the collectors, so that timings from every stage of a run end up together
+stats = Stats()
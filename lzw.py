@@ -0,0 +1,101 @@
+class LZWError(Exception):
+    """Error to throw when data is not valid Unix compress (.Z) data"""
+
+
+def decompress_lzw(data, max_bytes=None):
+    """Decompress data in the Unix compress (.Z) format, which the standard library can't read.
+    This follows the decoder in pigz, including compress's quirk of discarding the rest of a group
+    of eight codes whenever the code width changes or the table is cleared.
+
+        :param data: (bytes) compressed data, including the 3 byte header
+        :param max_bytes: (int) stop once more than this many bytes have been decompressed, or None for no limit
+        :returns: (bytearray) decompressed data - longer than max_bytes if it was cut off
+        :raises: (LZWError) if the data is not valid compress data"""
+
+    data = bytearray(data)
+    if len(data) < 3 or data[0] != 0x1f or data[1] != 0x9d:
+        raise LZWError("missing compress header")
+    max_bits = data[2] & 0x1f
+    block_mode = data[2] & 0x80
+    if max_bits < 9 or max_bits > 16:
+        raise LZWError("invalid maximum code width {}".format(max_bits))
+
+    output = bytearray()
+    # pad so that reading three bytes from the end never runs off the data
+    total_bits = len(data) * 8
+    data.extend(b"\x00\x00")
+
+    bits = 9
+    mask = 0x1ff
+    end = 256 if block_mode else 255
+    prefix = [0] * 65536
+    suffix = bytearray(65536)
+    position = 24
+    # number of codes read from the current group of eight
+    group_codes = 0
+
+    if position + bits > total_bits:
+        return output
+    index = position >> 3
+    code = ((data[index] | data[index + 1] << 8 | data[index + 2] << 16) >> (position & 7)) & mask
+    position += bits
+    group_codes += 1
+    if code > 255:
+        raise LZWError("invalid first code")
+    final = prev = code
+    output.append(final)
+
+    while True:
+        # if the table will be full after this code, widen the codes
+        if end >= mask and bits < max_bits:
+            if group_codes % 8 != 0:
+                position += (8 - group_codes % 8) * bits
+            group_codes = 0
+            bits += 1
+            mask = (mask << 1) | 1
+
+        if position + bits > total_bits:
+            break
+        index = position >> 3
+        code = ((data[index] | data[index + 1] << 8 | data[index + 2] << 16) >> (position & 7)) & mask
+        position += bits
+        group_codes += 1
+
+        # clear code resets the table
+        if code == 256 and block_mode:
+            if group_codes % 8 != 0:
+                position += (8 - group_codes % 8) * bits
+            group_codes = 0
+            bits = 9
+            mask = 0x1ff
+            end = 255
+            continue
+
+        # a code one past the end of the table repeats the previous match plus its first character
+        temp = code
+        match = bytearray()
+        if code > end:
+            if code != end + 1 or prev > end:
+                raise LZWError("invalid code {}".format(code))
+            match.append(final)
+            code = prev
+
+        # walk the table to build the match in reverse
+        while code >= 256:
+            match.append(suffix[code])
+            code = prefix[code]
+        match.append(code)
+        final = code
+
+        if end < mask:
+            end += 1
+            prefix[end] = prev
+            suffix[end] = final
+        prev = temp
+
+        match.reverse()
+        output.extend(match)
+        if max_bytes is not None and len(output) > max_bytes:
+            break
+
+    return output
@@ -0,0 +1,136 @@
+import csv
+
+# manifest columns - the first four match the rows written by catalog_maker.write_catalog, so catalogs are manifests
+manifest_headers = ["file", "path", "extension", "size", "modified", "checksum"]
+
+# header rows that may start a manifest, i.e. this format's or the one written to cdiac_catalog.csv
+known_headers = [manifest_headers[0], "filename"]
+
+
+class ManifestWriter:
+    """Streams manifest entries to a CSV file, one row per file, as a crawler finds them.
+    It also accepts the rows written by catalog_maker.write_catalog, so it can be passed as
+    the `catalog_writer` of any existing crawler.
+
+        :param manifest_file: (file) open file to write the manifest to
+        :param write_header: (bool) whether to write the header row first"""
+
+    def __init__(self, manifest_file, write_header=True):
+        self.writer = csv.writer(manifest_file)
+        self.num_entries = 0
+        if write_header:
+            self.writer.writerow(manifest_headers)
+
+    def write(self, file_name, path, size=None, modified=None, checksum=None):
+        """Add a file to the manifest.
+
+            :param file_name: (str) file name
+            :param path: (str) directory containing the file
+            :param size: (int) size in bytes, if known
+            :param modified: (str) last modification time, if known
+            :param checksum: (str) checksum prefixed with its algorithm, e.g. "sha256:9f86d081...", if known"""
+
+        self.writer.writerow([
+            file_name,
+            normalize_path(path),
+            get_extension(file_name),
+            size if size is not None else "",
+            modified if modified is not None else "",
+            checksum if checksum is not None else ""
+        ])
+        self.num_entries += 1
+
+    def writerow(self, row):
+        """Add a catalog row of file name, path, extension, and size (and optionally modification time).
+
+            :param row: (list) catalog row"""
+
+        self.write(row[0], row[1], row[3], row[4] if len(row) > 4 else None)
+
+
+def read_manifest(manifest_file, extensions=None, min_size=None, max_size=None, prefix=None):
+    """Stream entries from a manifest, a catalog written by write_catalog, or a plain list of
+    full paths like pub8_list.txt, keeping only those that pass the given filters.
+
+        :param manifest_file: (file) open manifest file
+        :param extensions: (list(str)) extensions to keep, or None to keep all
+        :param min_size: (int) minimum size in bytes - entries of unknown size are dropped if given
+        :param max_size: (int) maximum size in bytes - entries of unknown size are dropped if given
+        :param prefix: (str) path prefix that kept entries must start with
+        :returns: (generator(dict)) entries with "file", "path", "extension", "size", "modified", and "checksum" keys"""
+
+    for row in csv.reader(manifest_file):
+        if len(row) == 0 or row[0] in known_headers:
+            continue
+        if len(row) == 1:
+            # plain list of full paths
+            path, file_name = row[0].strip().rsplit("/", 1)
+            entry = {
+                "file": file_name,
+                "path": normalize_path(path),
+                "extension": get_extension(file_name),
+                "size": None,
+                "modified": None,
+                "checksum": None
+            }
+        else:
+            entry = {
+                "file": row[0],
+                "path": normalize_path(row[1]),
+                "extension": row[2],
+                "size": int(row[3]) if row[3] != "" else None,
+                "modified": row[4] if len(row) > 4 and row[4] != "" else None,
+                "checksum": row[5] if len(row) > 5 and row[5] != "" else None
+            }
+
+        if matches(entry, extensions=extensions, min_size=min_size, max_size=max_size, prefix=prefix):
+            yield entry
+
+
+def matches(entry, extensions=None, min_size=None, max_size=None, prefix=None):
+    """Determine if a manifest entry passes a set of filters.
+
+        :param entry: (dict) manifest entry
+        :param extensions: (list(str)) extensions to keep, or None to keep all
+        :param min_size: (int) minimum size in bytes
+        :param max_size: (int) maximum size in bytes
+        :param prefix: (str) path prefix
+        :returns: (bool) whether the entry passes"""
+
+    if extensions is not None and entry["extension"] not in extensions:
+        return False
+    if min_size is not None and (entry["size"] is None or entry["size"] < min_size):
+        return False
+    if max_size is not None and (entry["size"] is None or entry["size"] > max_size):
+        return False
+    if prefix is not None and not full_path(entry).startswith(prefix):
+        return False
+
+    return True
+
+
+def full_path(entry):
+    """Get the full path of a manifest entry.
+
+        :param entry: (dict) manifest entry
+        :returns: (str) path including the file name"""
+
+    return entry["path"] + entry["file"]
+
+
+def normalize_path(path):
+    """Make sure a directory path ends with '/'.
+
+        :param path: (str) directory path
+        :returns: (str) directory path ending with '/'"""
+
+    return path if path.endswith('/') else path + '/'
+
+
+def get_extension(file_name):
+    """Get a file's extension in the same way as the collectors, i.e. everything after the first '.'.
+
+        :param file_name: (str) file name
+        :returns: (str) extension, or 'no extension' if there is none"""
+
+    return file_name.split('.', 1)[1] if '.' in file_name else "no extension"
@@ -1,12 +1,132 @@
+import io
 import csv
+import codecs
+import gzip
 import json
-import numpy
+import zlib
+import tarfile
+import zipfile
 import os
 import re
-from netCDF4 import Dataset
+import math
+import time
+import random
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 from operator import itemgetter
+from contextlib import contextmanager
 from hashlib import sha256
+from instrumentation import stats
+from lzw import decompress_lzw, LZWError
+from checksums import local_checksum
+from sketches import HyperLogLog, KLLSketch
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+# number of bytes read from the start of a file to identify its format
+header_size = 512
+
+# number of bytes read from the start of a text file to guess its encoding
+encoding_sample_size = 64 * 1024
+
+# lines of a text file, however they end
+line_pattern = re.compile(b"[^\r\n]+")
+
+# size in bytes of the first block a time-budgeted sample reads, to measure how fast its rows are read
+probe_block_size = 8 * 1024
+
+# factor by which the time a time-budgeted sample's next blocks are expected to take is padded, to leave time
+# to summarise the columns afterwards
+time_margin = 1.5
+
+# number of bytes read at a time to finish a sampled block's last line
+line_search_size = 1024
+
+# groups that date and time patterns may have
+date_groups = ("year", "month", "day", "hour", "minute", "second")
+
+# date and time formats recognized in columns - a column's format is inferred once, from a sample of its first
+# values, and every other value in the column is parsed with that format's pattern alone
+date_patterns = [
+    ("YYYY-MM-DD hh:mm:ss", r"(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})[T ]"
+                            r"(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}(?:\.\d*)?))?Z?$"),
+    ("YYYY-MM-DD", r"(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})$"),
+    ("YYYY/MM/DD", r"(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})$"),
+    ("MM/DD/YYYY", r"(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{4})$"),
+    ("DD/MM/YYYY", r"(?P<day>\d{1,2})/(?P<month>\d{1,2})/(?P<year>\d{4})$"),
+    ("MM/DD/YY", r"(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{2})$"),
+    ("DD/MM/YY", r"(?P<day>\d{1,2})/(?P<month>\d{1,2})/(?P<year>\d{2})$"),
+    ("DD.MM.YYYY", r"(?P<day>\d{1,2})\.(?P<month>\d{1,2})\.(?P<year>\d{4})$"),
+    ("DD-Mon-YYYY", r"(?P<day>\d{1,2})-(?P<month>[A-Za-z]{3})-(?P<year>\d{4})$"),
+    ("hh:mm:ss", r"(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}(?:\.\d*)?))?$")
+]
+
+# compiled date formats, as (name, pattern, position of each of date_groups in the pattern or -1)
+date_formats = []
+for name, pattern in date_patterns:
+    pattern = re.compile(pattern)
+    date_formats.append((name, pattern, tuple(pattern.groupindex.get(group, 0) - 1 for group in date_groups)))
+
+month_numbers = {name: i + 1 for i, name in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep",
+                                                       "oct", "nov", "dec"])}
+
+# number of rows of a table whose dates are checked against every format they could be in before each date
+# column's format is settled, and how many more rows are checked while a column still fits more than one
+date_sample_rows = 20
+max_date_sample_rows = 1000
+
+# number of distinct intervals between consecutive times counted per date column
+max_intervals = 100
+
+# each column's distinct values are counted in 2 ** distinct_precision bytes, to within about 3%
+distinct_precision = 10
+
+# each numeric column's quantiles are estimated from about 3 * quantile_k of its values, to within about
+# 1.7 / quantile_k in rank, so the memory a column's sketch takes doesn't grow with its rows
+quantile_k = 200
+
+# number of distinct days and times of day whose conversion to seconds is remembered per date column
+max_cached_dates = 10000
+
+# magic numbers at the start of files, and the format each identifies
+magic_numbers = [
+    (b"CDF\x01", "netcdf"),
+    (b"CDF\x02", "netcdf"),
+    (b"CDF\x05", "netcdf"),
+    (b"\x89HDF", "hdf5"),
+    (b"PK\x03\x04", "zip"),
+    (b"PK\x05\x06", "zip"),
+    (b"\x1f\x8b", "gzip"),
+    (b"\x1f\x9d", "compress"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "ole2"),
+    (b"%PDF", "pdf"),
+    (b"%!PS", "postscript"),
+    (b"\x89PNG", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF8", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\x7fELF", "elf"),
+]
+
+# formats whose members are extracted
+archive_formats = ["zip", "gzip", "compress"]
+
+# maximum proportion of control characters in the header of a text file
+max_control_ratio = 0.3
+
+# local names of xml elements whose text describes a dataset, and the metadata key their text is saved under
+descriptive_elements = {
+    "title": "title",
+    "entry_title": "title",
+    "abstract": "abstract",
+    "summary": "abstract",
+    "keyword": "keywords",
+    "themekey": "keywords",
+    "placekey": "keywords",
+}
 
 
 class ExtractionError(Exception):
@@ -17,58 +137,147 @@ class ExtractionPassed(Exception):
     """Indicator to throw when extractor passes for fast file classification"""
 
 
-def extract_metadata(file_name, path, classification_only=False):
+def extract_metadata(file_name, path, classification_only=False, vector_writer=None, checksum=None, search_index=None,
+                     index_path=None, sample_bytes=None, sample_seconds=None):
     """Create metadata JSON from file.
 
         :param file_name: (str) file name
         :param path: (str) absolute or relative path to file
         :param classification_only: (bool) whether to exit after ascertaining file class
+        :param vector_writer: (text_profile.VectorWriter) writer to save free-text files' bag-of-words vectors with,
+        whose row number is recorded in the text profile
+        :param checksum: ((str, str)) algorithm and hex digest of the file, if the server it came from has
+        already hashed it - otherwise the file is hashed locally with sha256
+        :param search_index: (search_index.SearchIndex) index to add the file's full metadata to, before it is
+        reduced to the keys returned
+        :param index_path: (str) full path to index the file under, if not its local path
+        :param sample_bytes: (int) number of bytes of a column-formatted file to read, sampling the rest, or
+        None to read it whole
+        :param sample_seconds: (float) seconds to spend on a column-formatted file, sampling what can't be read
+        in that time, or None to read it whole
         :returns: (dict) metadata dictionary"""
 
-    with open(path + file_name, 'rU') as file_handle:
+    extension = file_name.split('.', 1)[1] if '.' in file_name else "no extension"
+    if checksum is None:
+        with stats.timer("hash", extension=extension):
+            checksum = ("sha256", local_checksum(path + file_name, "sha256"))
 
-        extension = file_name.split('.', 1)[1] if '.' in file_name else "no extension"
+    with open(path + file_name, 'rb') as file_handle:
         metadata = {
             "system": {
                 "file": file_name,
                 "path": path,
                 "extension": extension,
                 "size": os.path.getsize(path + file_name),
-                "checksum": sha256(file_handle.read()).hexdigest()
+                "checksum": checksum[1],
+                "checksum_algorithm": checksum[0]
             },
             "class": "unknown"
         }
-        # checksum puts cursor at end of file - reset to beginning for metadata extraction
-        file_handle.seek(0)
 
-        if extension == "nc":
-            try:
-                metadata.update(extract_netcdf_metadata(file_handle, classification_only=classification_only))
-                metadata["class"] = "container-format"
-            except ExtractionPassed:
-                metadata["class"] = "container-format"
-            except ExtractionError:
-                # not a netCDF file
-                pass
-        else:
-            try:
-                metadata.update(extract_columnar_metadata(file_handle, classification_only=classification_only))
-                metadata["class"] = "columnar"
-            except ExtractionPassed:
-                metadata["class"] = "columnar"
-            except ExtractionError:
-                # not a columnar file
-                # check if this file is a usable abstract-like file
-                if metadata["system"]["size"] > 1000 and is_abstract(file_handle):
-                    metadata["class"] = "free-text"
+        with stats.timer("classify" if classification_only else "parse", extension=extension) as timer:
+            metadata["class"] = extract_content_metadata(file_handle, metadata, classification_only=classification_only,
+                                                         sample_bytes=sample_bytes, sample_seconds=sample_seconds)
+            timer.file_class = metadata["class"]
+
+    stats.count("files", extension=extension, file_class=metadata["class"])
+    stats.count("bytes", metadata["system"]["size"], extension=extension, file_class=metadata["class"])
+
+    if vector_writer is not None and "vector" in metadata:
+        metadata["text_profile"]["vector_row"] = vector_writer.write(metadata["vector"])
 
+    if search_index is not None:
+        with stats.timer("index", extension=extension):
+            search_index.add(index_path or path + file_name, metadata)
+
+    drop_sketches(metadata)
+
+    # a sampled file's label is kept, so that its approximate metadata is never mistaken for exact
     for key in metadata.keys():
-        if key not in ["system", "class"]:
+        if key not in ["system", "class", "members", "text_profile", "sample"]:
             metadata.pop(key)
 
     return metadata
 
 
+def drop_sketches(metadata):
+    """Remove the serialized sketches kept with each column, which are only needed to combine the columns of
+    tables read in pieces, from metadata and from the metadata of its sheets and archive members.
+
+        :param metadata: (dict) metadata dictionary"""
+
+    for columns in [metadata.get("columns", {})] + [table["columns"] for table in metadata.get("tables", [])]:
+        for column in columns.values():
+            column.pop("sketches", None)
+    for sheet in metadata.get("sheets", {}).values():
+        drop_sketches(sheet)
+    for member in metadata.get("members", []):
+        drop_sketches(member)
+
+
+def extract_content_metadata(file_handle, metadata, classification_only=False, nested=False, sample_bytes=None,
+                             sample_seconds=None):
+    """Identify an open file's format from its first few bytes, and try the extractors registered for
+    that format in order, adding what the first successful one finds to a metadata dictionary. Formats
+    with no extractors, like images and PDFs, are rejected without reading any further.
+
+        :param file_handle: (file) open file
+        :param metadata: (dict) metadata dictionary to add to
+        :param classification_only: (bool) whether to exit after ascertaining file class
+        :param nested: (bool) whether the file is an archive member, in which case archives inside
+        it are classified but not opened
+        :param sample_bytes: (int) byte budget of a column-formatted file, as for extract_columnar_metadata
+        :param sample_seconds: (float) time budget of a column-formatted file, as for extract_columnar_metadata
+        :returns: (str) file class"""
+
+    with stats.timer("sniff"):
+        file_handle.seek(0)
+        file_format = sniff_format(file_handle.read(header_size))
+        file_handle.seek(0)
+
+    if nested and file_format in archive_formats:
+        return "archive"
+
+    for file_class, extractor in extractors.get(file_format, []):
+        options = {}
+        if extractor is extract_columnar_metadata:
+            # only tables read from text can be sampled
+            options = {"sample_bytes": sample_bytes, "sample_seconds": sample_seconds}
+        try:
+            metadata.update(extractor(file_handle, classification_only=classification_only, **options))
+            return file_class
+        except ExtractionPassed:
+            return file_class
+        except ExtractionError:
+            # not this kind of file - try the next extractor
+            file_handle.seek(0)
+
+    return "unknown"
+
+
+def sniff_format(header):
+    """Identify a file's format from its magic number, or failing that, from whether it looks like text.
+
+        :param header: (bytes) first bytes of the file
+        :returns: (str) format name, or "markup", "text", or "binary" if it has no known magic number"""
+
+    for magic, file_format in magic_numbers:
+        if header.startswith(magic):
+            return file_format
+
+    if b"\x00" in header:
+        return "binary"
+    # count bytes that don't appear in text, ignoring high bytes since they may be part of a multi-byte character
+    control = sum(1 for c in bytearray(header) if c < 32 and c not in (8, 9, 10, 11, 12, 13, 27) or c == 127)
+    if len(header) > 0 and float(control) / len(header) > max_control_ratio:
+        return "binary"
+    # markup starts with a declaration or an element, possibly after a byte order mark
+    if header.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<"):
+        return "markup"
+
+    return "text"
+
+
 def extract_netcdf_metadata(file_handle, classification_only=False):
     """Create netcdf metadata JSON from file.
 
@@ -76,8 +285,16 @@ def extract_netcdf_metadata(file_handle, classification_only=False):
         :param classification_only: (bool) whether to exit after ascertaining file class
         :returns: (dict) metadata dictionary"""
 
+    # netCDF4 and numpy take longer to import than most extractions take to run, so they are only loaded
+    # once a netcdf or hdf5 file turns up
+    from netCDF4 import Dataset
+
     try:
-        dataset = Dataset(os.path.realpath(file_handle.name))
+        if isinstance(file_handle, MemberFile):
+            # archive members only exist in memory
+            dataset = Dataset(file_handle.name, memory=file_handle.getvalue())
+        else:
+            dataset = Dataset(os.path.realpath(file_handle.name))
     except IOError:
         raise ExtractionError
 
@@ -139,6 +356,8 @@ class NumpyDecoder(json.JSONEncoder):
     other metadata scrapers like the csv, which returns a python dict"""
 
     def default(self, obj):
+        import numpy
+
         if isinstance(obj, numpy.generic):
             return numpy.asscalar(obj)
         elif isinstance(obj, numpy.ndarray):
@@ -149,128 +368,641 @@ class NumpyDecoder(json.JSONEncoder):
             return super(NumpyDecoder, self).default(obj)
 
 
-def extract_columnar_metadata(file_handle, classification_only=False, min_classification_rows=10):
-    """Get metadata from column-formatted file.
+def extract_archive_metadata(file_handle, classification_only=False, max_members=1000,
+                             max_member_bytes=64 * 1024 * 1024, max_total_bytes=256 * 1024 * 1024):
+    """Extract metadata from each member of a zip, gzip, or compress (.Z) archive, including tar
+    archives inside gzip or compress. Members are streamed into memory one at a time and passed to
+    the same extractors as regular files, without unpacking anything to disk.
+
+        :param file_handle: (file) open archive
+        :param classification_only: (bool) whether to exit after ascertaining each member's class
+        :param max_members: (int) number of members after which the rest of the archive is ignored
+        :param max_member_bytes: (int) uncompressed size above which a member is skipped
+        :param max_total_bytes: (int) total uncompressed bytes after which the rest of the archive is ignored
+        :returns: (dict) metadata dictionary with a "members" list of child entries
+        :raises: (ExtractionError) if the file is not a readable archive"""
+
+    metadata = {"members": []}
+    total_bytes = 0
+
+    with binary_mode(file_handle) as binary_handle:
+        try:
+            for name, declared_size, open_member in archive_members(binary_handle, max_total_bytes):
+                if len(metadata["members"]) >= max_members or total_bytes >= max_total_bytes:
+                    metadata["truncated"] = True
+                    break
+
+                base_name = os.path.basename(name)
+                extension = base_name.split('.', 1)[1] if '.' in base_name else "no extension"
+                member = {
+                    "system": {
+                        "file": name,
+                        "extension": extension,
+                        "size": declared_size
+                    },
+                    "class": "unknown"
+                }
+                metadata["members"].append(member)
+
+                if declared_size is not None and declared_size > max_member_bytes:
+                    member["skipped"] = "over {} bytes".format(max_member_bytes)
+                    continue
+                # don't trust the declared size, since a bomb can lie about it
+                try:
+                    data = open_member().read(max_member_bytes + 1)
+                except (RuntimeError, NotImplementedError) as e:
+                    # zipfile can't read encrypted members, or ones compressed with bzip2 or lzma, but the
+                    # rest of the archive may still be readable
+                    member["skipped"] = "encrypted" if isinstance(e, RuntimeError) else str(e)
+                    continue
+                if len(data) > max_member_bytes:
+                    member["skipped"] = "over {} bytes".format(max_member_bytes)
+                    continue
+                total_bytes += len(data)
+
+                member["system"]["size"] = len(data)
+                member["system"]["checksum"] = sha256(data).hexdigest()
+                member["system"]["checksum_algorithm"] = "sha256"
+                # the member's own metadata, like its columns, is kept with it so that it can be indexed
+                member["class"] = extract_content_metadata(MemberFile(data, name), member,
+                                                           classification_only=classification_only, nested=True)
+                # only the vectors of files collected directly are saved
+                member.pop("vector", None)
+        except (zipfile.BadZipfile, tarfile.TarError, LZWError, IOError, EOFError, zlib.error):
+            # keep whatever members were read before the archive turned out to be damaged or cut off
+            if len(metadata["members"]) == 0:
+                raise ExtractionError
+            metadata["truncated"] = True
+
+    return metadata
+
+
+def archive_members(file_handle, max_total_bytes):
+    """Iterate over the members of an archive without reading their contents.
+
+        :param file_handle: (file) archive opened in binary mode
+        :param max_total_bytes: (int) number of bytes after which compress (.Z) data is cut off
+        :returns: (generator((str, int, function))) member name, declared uncompressed size (None if unknown),
+        and a function that opens the member for reading
+        :raises: (ExtractionError) if the file is not an archive"""
+
+    archive_name = os.path.basename(file_handle.name)
+    magic = file_handle.read(2)
+    # is_zipfile looks for the central directory at the end of the file, so rewind after it
+    is_zip = zipfile.is_zipfile(file_handle)
+    file_handle.seek(0)
+
+    if is_zip:
+        zip_file = zipfile.ZipFile(file_handle)
+        for info in zip_file.infolist():
+            if not info.filename.endswith('/'):
+                yield info.filename, info.file_size, lambda info=info: zip_file.open(info)
+
+    elif magic == b"\x1f\x8b":
+        # peek at the decompressed header to see if this is a tarball
+        is_tar = is_tar_header(gzip.GzipFile(fileobj=file_handle, mode='rb').read(512))
+        file_handle.seek(0)
+        if is_tar:
+            for member in tar_members(gzip.GzipFile(fileobj=file_handle, mode='rb')):
+                yield member
+        else:
+            yield archive_name.rsplit('.', 1)[0], None, lambda: gzip.GzipFile(fileobj=file_handle, mode='rb')
+
+    elif magic == b"\x1f\x9d":
+        data = bytes(decompress_lzw(file_handle.read(), max_bytes=max_total_bytes))
+        if is_tar_header(data[:512]):
+            for member in tar_members(io.BytesIO(data)):
+                yield member
+        else:
+            yield archive_name.rsplit('.', 1)[0], len(data), lambda: io.BytesIO(data)
+
+    else:
+        raise ExtractionError
+
+
+def tar_members(stream):
+    """Iterate over the regular files in a tar stream, which must be read in order.
+
+        :param stream: (file) uncompressed tar stream
+        :returns: (generator((str, int, function))) member name, size, and a function that opens the member"""
+
+    tar_file = tarfile.open(fileobj=stream, mode='r|')
+    for member in tar_file:
+        if member.isfile():
+            yield member.name, member.size, lambda member=member: tar_file.extractfile(member)
+
+
+def is_tar_header(block):
+    """Determine if a block of bytes starts with a POSIX tar header.
+
+        :param block: (bytes) first 512 bytes of a file
+        :returns: (bool) whether block is a tar header"""
+
+    return block[257:262] == b"ustar"
+
+
+@contextmanager
+def binary_mode(file_handle):
+    """Get a handle on a file that reads it without newline translation, since callers may have opened it in
+    'rU' mode but archives and spreadsheets are binary.
+
+        :param file_handle: (file) open file
+        :returns: (file) binary handle on the same file, positioned at its start"""
+
+    if 'b' in getattr(file_handle, "mode", 'b'):
+        file_handle.seek(0)
+        yield file_handle
+    else:
+        with open(file_handle.name, 'rb') as binary_handle:
+            yield binary_handle
+
+
+class MemberFile(io.BytesIO):
+    """In-memory archive member with a name, so that extractors can treat it like an open file.
+
+        :param data: (bytes) member contents
+        :param name: (str) member name"""
+
+    def __init__(self, data, name):
+        io.BytesIO.__init__(self, data)
+        self.name = name
+
+
+def extract_columnar_metadata(file_handle, classification_only=False, min_classification_rows=10, sample_bytes=None,
+                              sample_seconds=None, random_sample=False):
+    """Get metadata from column-formatted file. Files often hold several tables stacked one above another, so
+    the file is split into all of its tables in a single scan from the bottom up, and each table's columns are
+    aggregated separately. The file is parsed as bytes, and only the text that ends up in its metadata is
+    decoded, with an encoding guessed from the start of the file.
+
+    Given a byte or time budget, a file too large to read within it is sampled instead, with a SampleReader:
+    its tables are found and aggregated from the rows of blocks read from its bottom, its top, and in between.
+    The metadata of a sampled file has a "sample" dictionary with the "fraction" of its bytes read, and each
+    table's "rows" counts only the rows read, with the number it is estimated to have in "estimated_rows".
 
         :param file_handle: (file) open file
         :param classification_only: (bool) whether to exit after ascertaining file class
         :param min_classification_rows: (int) number of rows necessary to classify file as columnar
+        :param sample_bytes: (int) number of bytes to read at most, or None to read the whole file
+        :param sample_seconds: (float) seconds to spend reading and aggregating rows at most, or None to take
+        as long as the whole file takes
+        :param random_sample: (bool) whether to sample blocks at random rather than evenly spaced
         :returns: (dict) ascertained metadata
         :raises: (ExtractionError) if the file cannot be read as a columnar file"""
 
-    extension = file_handle.name.split('.', 1)[1] if '.' in file_handle.name else "no extension"
+    file_name = os.path.basename(file_handle.name)
+    extension = file_name.split('.', 1)[1] if '.' in file_name else "no extension"
+
+    # size of extracted free-text preamble in bytes
+    preamble_size = 1000
+
+    with binary_mode(file_handle) as binary_handle:
+        # under a byte budget, the encoding is guessed from a share of it
+        encoding_sample = binary_handle.read(encoding_sample_size if sample_bytes is None
+                                             else min(encoding_sample_size, sample_bytes // 4))
+        encoding = detect_encoding(encoding_sample)
+
+        # choose csv.reader parameters based on file type - if not csv, use whitespace-delimited
+        delimiter = "," if extension in ["csv", "exc.csv"] else "whitespace"
+        if sample_bytes is None and sample_seconds is None:
+            reverse_reader = ReverseReader(binary_handle, delimiter=delimiter)
+        else:
+            reverse_reader = SampleReader(binary_handle, delimiter=delimiter, max_bytes=sample_bytes,
+                                          max_seconds=sample_seconds, random_blocks=random_sample,
+                                          bytes_read=len(encoding_sample))
+
+        metadata = extract_table_segments(((reverse_reader.row_start, row) for row in reverse_reader),
+                                          reverse_reader.size, extension, classification_only=classification_only,
+                                          min_classification_rows=min_classification_rows, encoding=encoding)
+        metadata["encoding"] = encoding
+        if isinstance(reverse_reader, SampleReader) and reverse_reader.sampled_bytes < reverse_reader.size:
+            add_sample_estimates(metadata, reverse_reader.ranges, reverse_reader.size, random_sample)
+
+        # extract the free-text preamble above the first table, which may contain headers
+        preamble_end = metadata["tables"][0]["start"]
+        if preamble_end > 0:
+            binary_handle.seek(max(0, preamble_end - preamble_size))
+            preamble = decode_text(binary_handle.read(preamble_end - binary_handle.tell()), encoding)
+            metadata["preamble"] = preamble.replace(u"\r\n", u"\n").replace(u"\r", u"\n")
+
+    return metadata
+
+
+def add_sample_estimates(metadata, ranges, size, random_sample=False):
+    """Label the metadata of a sampled file with how much of it was read, and estimate how many rows each of
+    its tables has from the share of the table's bytes that the rows read came from.
+
+        :param metadata: (dict) metadata from extract_table_segments
+        :param ranges: (list((int, int))) start and end of each block read
+        :param size: (int) file size in bytes
+        :param random_sample: (bool) whether the blocks were picked at random"""
+
+    num_rows = 0
+    for table in metadata["tables"]:
+        covered = sum(max(0, min(end, table["end"]) - max(start, table["start"])) for start, end in ranges)
+        table["estimated_rows"] = int(round(table["rows"] * float(table["end"] - table["start"]) / covered)) \
+            if covered > 0 else table["rows"]
+        num_rows += table["estimated_rows"]
+
+    sampled_bytes = sum(end - start for start, end in ranges)
+    metadata["sample"] = {
+        "fraction": round(float(sampled_bytes) / size, 4),
+        "bytes": sampled_bytes,
+        "blocks": len(ranges),
+        "method": "random" if random_sample else "even",
+        "estimated_rows": num_rows
+    }
+
+
+def extract_spreadsheet_metadata(file_handle, classification_only=False, min_classification_rows=10,
+                                 max_rows=100000, max_bytes=16 * 1024 * 1024):
+    """Get metadata from each sheet of an Excel workbook (.xlsx or .xls), reading one sheet at a time. Each
+    sheet's rows go through the same table detection and aggregation as column-formatted files, so every
+    sheet that contains a table gets the same metadata a column-formatted file would, with tables located by
+    row number instead of byte offset.
+
+        :param file_handle: (file) open file
+        :param classification_only: (bool) whether to exit after ascertaining file class
+        :param min_classification_rows: (int) number of rows necessary to classify file as columnar
+        :param max_rows: (int) number of rows after which the rest of a sheet is ignored
+        :param max_bytes: (int) number of bytes of cell text after which the rest of a sheet is ignored
+        :returns: (dict) metadata dictionary with a "sheets" dictionary of sheet name -> sheet metadata
+        :raises: (ExtractionError) if the file is not a workbook, no sheet contains a table, or the
+        library needed to read the workbook is not installed"""
+
+    file_name = os.path.basename(file_handle.name)
+    extension = file_name.split('.', 1)[1] if '.' in file_name else "no extension"
+    metadata = {"sheets": {}}
+
+    with binary_mode(file_handle) as binary_handle:
+        for sheet_name, sheet_rows in workbook_sheets(binary_handle):
+            # tables are found from the bottom up, so the capped rows of one sheet are held to be reversed
+            rows = []
+            num_bytes = 0
+            truncated = False
+            for row in sheet_rows:
+                if len(rows) >= max_rows or num_bytes >= max_bytes:
+                    truncated = True
+                    break
+                row = [cell_to_field(value) for value in row]
+                # skip empty rows, like the blank lines skipped in column-formatted files
+                if any(field != "" for field in row):
+                    rows.append(row)
+                    num_bytes += sum(len(field) for field in row)
+
+            # trailing empty cells aren't always stored, so pad rows to the width of the sheet
+            width = max([len(row) for row in rows] or [0])
+            rows = [row + [""] * (width - len(row)) for row in rows]
+
+            # a sheet's tables are located by row number rather than by byte offset
+            try:
+                sheet_metadata = extract_table_segments(
+                    ((i, rows[i]) for i in range(len(rows) - 1, -1, -1)), len(rows), extension,
+                    classification_only=classification_only, min_classification_rows=min_classification_rows)
+            except ExtractionError:
+                # this sheet doesn't contain a table
+                continue
+            if truncated:
+                sheet_metadata["truncated"] = True
+            metadata["sheets"][sheet_name] = sheet_metadata
+
+    if len(metadata["sheets"]) == 0:
+        raise ExtractionError
+
+    return metadata
+
+
+def workbook_sheets(binary_handle):
+    """Iterate over the sheets of an Excel workbook. Rows of .xlsx sheets are streamed in openpyxl's read-only
+    mode, while .xls sheets are loaded and unloaded one at a time by xlrd. Both libraries are only imported
+    when a workbook is found.
+
+        :param binary_handle: (file) workbook opened in binary mode
+        :returns: (generator((str, iterator(list)))) sheet name and its rows of cell values
+        :raises: (ExtractionError) if the file is not a workbook or the library needed to read it is not installed"""
+
+    if binary_handle.read(4) == b"PK\x03\x04":
+        binary_handle.seek(0)
+        # most zip files aren't workbooks, so check for one before handing the file to openpyxl
+        try:
+            is_workbook = "xl/workbook.xml" in zipfile.ZipFile(binary_handle).namelist()
+        except zipfile.BadZipfile:
+            is_workbook = False
+        binary_handle.seek(0)
+        if not is_workbook:
+            raise ExtractionError
+
+        try:
+            import openpyxl
+            from openpyxl.utils.exceptions import InvalidFileException
+        except ImportError:
+            raise ExtractionError
+        try:
+            workbook = openpyxl.load_workbook(binary_handle, read_only=True, data_only=True)
+        except (InvalidFileException, zipfile.BadZipfile, KeyError, ValueError, IOError):
+            raise ExtractionError
+
+        for sheet in workbook.worksheets:
+            yield sheet.title, ([cell.value for cell in row] for row in sheet.iter_rows())
+
+    else:
+        try:
+            import xlrd
+        except ImportError:
+            raise ExtractionError
+        try:
+            if isinstance(binary_handle, MemberFile):
+                workbook = xlrd.open_workbook(file_contents=binary_handle.getvalue(), on_demand=True)
+            else:
+                workbook = xlrd.open_workbook(os.path.realpath(binary_handle.name), on_demand=True)
+        except (xlrd.XLRDError, xlrd.compdoc.CompDocError, IOError):
+            raise ExtractionError
+
+        for sheet_name in workbook.sheet_names():
+            sheet = workbook.sheet_by_name(sheet_name)
+            yield sheet_name, (sheet.row_values(i) for i in range(0, sheet.nrows))
+            workbook.unload_sheet(sheet_name)
+
+
+def cell_to_field(value):
+    """Convert a spreadsheet cell value to a field like those read from column-formatted files.
+
+        :param value: cell value
+        :returns: (str) field"""
 
-    # choose csv.reader parameters based on file type - if not csv, use whitespace-delimited
-    reverse_reader = ReverseReader(file_handle, delimiter="," if extension in ["csv", "exc.csv"] else "whitespace")
+    if value is None:
+        return ""
+    # xlrd reads every number as a float
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, unicode):
+        return value.encode("utf-8").strip()
 
-    # base dictionary in which to store all the metadata
-    metadata = {"columns": {}}
+    return str(value).strip()
+
+
+def extract_table_segments(rows, end, extension, classification_only=False, min_classification_rows=10,
+                           encoding="utf-8"):
+    """Split rows read from the bottom of a file or sheet up into tables, in a single pass. A table is a run of
+    rows of the same length, with at least a few rows of values below any header rows, and anything between
+    tables is text. Each table's columns are aggregated as its rows are read, so no row is read twice.
+
+    The last table in the file must start at its bottom, give or take a few footer rows, or the file isn't
+    treated as columnar at all - this keeps text files from being scanned to the top for tables.
+
+        :param rows: (iterator((int, list(str)))) offset at which each row starts, and its fields, last row first
+        :param end: (int) offset of the end of the last row
+        :param extension: (str) extension of the file the rows come from
+        :param classification_only: (bool) whether to exit after ascertaining file class
+        :param min_classification_rows: (int) number of rows necessary to classify file as columnar
+        :param encoding: (str) encoding of the fields, which are decoded only once they are in the metadata
+        :returns: (dict) metadata with the last table's "columns" and "headers", every table in "tables", and
+        a "segments" index of where each table and each run of text between them starts and ends
+        :raises: (ExtractionError) if the last rows don't form a table"""
 
     # minimum number of rows to be considered an extractable table
     min_rows = 3
-    # size of extracted free-text preamble in characters
-    preamble_size = 1000
 
-    headers = []
-    col_types = []
-    col_aliases = []
-    num_rows = 0
-    # used to check if all rows are the same length, if not, this is not a valid columnar file
-    row_length = 0
-    is_first_row = True
-    fully_parsed = True
+    # tables from the bottom up - the one rows are being added to is last
+    tables = []
+    # whether the rows being read belong to the last table in the tables list
+    in_table = False
 
-    # save the last l rows to try to parse them later
-    # if there are less than l rows, you must catch the StopIteration exception
+    # hold back the last few rows, which are often footers that would throw off the column types, and add
+    # them to the last table once its types are known
     last_rows = []
     try:
-        last_rows = [reverse_reader.next() for i in range(0, 3)]
+        last_rows = [next(rows) for i in range(0, 3)]
     except StopIteration:
         pass
-
-    # now we try to extract a table from the remaining n-l rows
-    for row in reverse_reader:
-        # if row is not the same length as previous row, raise an error showing this is not a valid columnar file
-        if not is_first_row and row_length != len(row):
+    # start of the row below the current one
+    below = last_rows[-1][0] if len(last_rows) > 0 else end
+
+    for start, row in rows:
+        table = tables[-1] if in_table else None
+
+        # a row that isn't the same length as the table's rows, or a header row on top of too few values, ends it -
+        # rows of the table are only checked for dates in the formats its columns started with
+        is_header = is_header_row(row, table["col_formats"]) if table is not None and \
+            len(row) == table["row_length"] else None
+        if table is not None and (is_header is None or is_header and table["rows"] < min_rows):
+            in_table = False
+            if table["rows"] < min_rows:
+                tables.pop()
             # tables are not worth extracting if under this row threshold
-            if num_rows < min_rows:
+            if len(tables) == 0:
                 raise ExtractionError
-            else:
-                fully_parsed = False
-                break
-        # update row length for next check
-        row_length = len(row)
-
-        if is_first_row:
-            # make column aliases so that we can create aggregates even for unlabelled columns
-            col_aliases = ["__{}__".format(i) for i in range(0, row_length)]
-            # type check the first row to decide which aggregates to use
-            col_types = ["num" if is_number(field) else "str" for field in row]
-            is_first_row = False
+            table = None
+
+        if table is None:
+            # header rows below any values, and other rows of text, belong to no table
+            is_header = is_header_row(row)
+            if is_header:
+                if len(tables) == 0:
+                    raise ExtractionError
+                below = start
+                continue
+            table = {
+                "metadata": {"columns": {}},
+                "headers": [],
+                "row_length": len(row),
+                # make column aliases so that we can create aggregates even for unlabelled columns
+                "col_aliases": ["__{}__".format(i) for i in range(0, len(row))],
+                # type check the first row to decide which aggregates to use
+                "col_types": [],
+                # format of each date column, once settled by settle_column_formats
+                "col_formats": None,
+                # date formats each column's values so far fit, and the rows held back until they are settled
+                "candidates": [],
+                "sample": [],
+                "rows": 0,
+                "end": below
+            }
+            for field in row:
+                candidates = [] if is_number(field) else date_format_candidates(field)
+                table["col_types"].append("date" if len(candidates) > 0 else "num" if is_number(field) else "str")
+                table["candidates"].append(candidates)
+            tables.append(table)
+            in_table = True
 
         # if the row is a header row, add all its fields to the headers list
-        if is_header_row(row):
-            # tables are likely not representative of the file if under this row threshold, don't extract metadata
-            if num_rows < min_rows:
-                raise ExtractionError
+        if is_header:
+            settle_column_formats(table)
             # set the column aliases to the most recent header row if they are unique
             if len(set(row)) == len(row):
                 for i in range(0, len(row)):
-                    metadata["columns"][row[i]] = metadata["columns"].pop(col_aliases[i])
-                col_aliases = row
+                    table["metadata"]["columns"][row[i]] = table["metadata"]["columns"].pop(table["col_aliases"][i])
+                table["col_aliases"] = row
 
             for header in row:
                 if header != "":
-                    headers.append(header)
+                    table["headers"].append(header)
 
         else:
-            num_rows += 1
-            add_row_to_aggregates(metadata, row, col_aliases, col_types, num_rows == 1)
+            table["rows"] += 1
+            if table["sample"] is None:
+                add_row_to_aggregates(table["metadata"], row, table["col_aliases"], table["col_types"], False,
+                                      col_formats=table["col_formats"])
+            else:
+                sample_column_formats(table, row)
 
-        if classification_only and num_rows > min_classification_rows:
-            raise ExtractionPassed
+        table["start"] = start
+        below = start
 
-    # add the originally skipped rows into the aggregates
-    for row in last_rows:
-        if len(row) == row_length:
-            add_row_to_aggregates(metadata, row, col_aliases, col_types, num_rows == 1)
-
-    # number of characters in file before last un-parse-able row
-    if not fully_parsed:
-        file_handle.seek(reverse_reader.prev_position)
-        remaining_chars = file_handle.tell() - 1
-        # extract free-text preamble, which may contain headers
-        if remaining_chars >= preamble_size:
-            file_handle.seek(-preamble_size, 1)
-        else:
-            file_handle.seek(0)
-        preamble = ""
-        # do this instead of passing a numerical length argument to read()
-        # in order to avoid multi-byte character encoding difficulties
-        while file_handle.tell() <= reverse_reader.prev_position:
-            preamble += file_handle.read(1)
-        # add preamble to the metadata if the whole file hasn't already been processed
-        if len(preamble) > 0:
-            metadata["preamble"] = preamble
+        if classification_only and table["rows"] > min_classification_rows:
+            raise ExtractionPassed
 
-    # add header list to metadata
-    if len(headers) > 0:
-        metadata["headers"] = list(set(headers))
+    # the top of the file ends a table as well, but the last table in the file may be short
+    if in_table and len(tables) > 1 and tables[-1]["rows"] < min_rows:
+        tables.pop()
+    if len(tables) == 0:
+        raise ExtractionError
 
-    add_final_aggregates(metadata, col_aliases, col_types, num_rows)
+    for table in tables:
+        settle_column_formats(table)
+
+    # add the originally skipped rows into the aggregates of the last table
+    last_table = tables[0]
+    for i, (start, row) in enumerate(last_rows):
+        if len(row) == last_table["row_length"] and not is_header_row(row, last_table["col_formats"]):
+            last_table["rows"] += 1
+            add_row_to_aggregates(last_table["metadata"], row, last_table["col_aliases"], last_table["col_types"],
+                                  False, col_formats=last_table["col_formats"])
+            last_table["end"] = max(last_table["end"], last_rows[i - 1][0] if i > 0 else end)
+
+    # list tables in the order they appear, with the runs of text around them
+    metadata = {"tables": [], "segments": []}
+    position = 0
+    for table in reversed(tables):
+        if len(table["headers"]) > 0:
+            table["metadata"]["headers"] = list(set(table["headers"]))
+
+        with stats.timer("aggregate", extension=extension):
+            add_final_aggregates(table["metadata"], table["col_aliases"], table["col_types"], table["rows"],
+                                 col_formats=table["col_formats"])
+        decode_table_text(table["metadata"], encoding)
+
+        table["metadata"].update({"start": table["start"], "end": table["end"], "rows": table["rows"]})
+        if table["start"] > position:
+            metadata["segments"].append({"type": "text", "start": position, "end": table["start"]})
+        metadata["segments"].append({"type": "table", "start": table["start"], "end": table["end"],
+                                     "table": len(metadata["tables"])})
+        metadata["tables"].append(table["metadata"])
+        position = table["end"]
+    if position < end:
+        metadata["segments"].append({"type": "text", "start": position, "end": end})
+
+    # the last table is the one most files have, so its columns are also kept where they always were
+    metadata["columns"] = metadata["tables"][-1]["columns"]
+    if "headers" in metadata["tables"][-1]:
+        metadata["headers"] = metadata["tables"][-1]["headers"]
 
     return metadata
 
 
-def add_row_to_aggregates(metadata, row, col_aliases, col_types, is_first_value_row):
+def decode_table_text(metadata, encoding):
+    """Decode the column names, headers, and modes of a table, which are the only fields kept in its metadata.
+
+        :param metadata: (dict) table metadata with final aggregates
+        :param encoding: (str) encoding of the table's fields"""
+
+    columns = {}
+    for col_alias, column in metadata["columns"].items():
+        if "mode" in column:
+            column["mode"] = decode_text(column["mode"], encoding)
+        columns[decode_text(col_alias, encoding)] = column
+    metadata["columns"] = columns
+
+    if "headers" in metadata:
+        metadata["headers"] = [decode_text(header, encoding) for header in metadata["headers"]]
+
+
+def decode_text(text, encoding):
+    """Decode text from a file whose parts may not all share one encoding. Text that is valid utf-8 is taken
+    to be utf-8, and anything else is decoded with the file's encoding, replacing bytes that aren't valid in
+    it rather than failing the whole file.
+
+        :param text: (bytes) text
+        :param encoding: (str) encoding guessed for the file
+        :returns: (unicode) decoded text"""
+
+    try:
+        return text.decode("utf-8-sig" if encoding == "utf-8-sig" else "utf-8")
+    except UnicodeDecodeError:
+        return text.decode(encoding, "replace")
+
+
+def detect_encoding(sample):
+    """Guess a text file's encoding from a sample of its bytes.
+
+        :param sample: (bytes) bytes from the start of the file
+        :returns: (str) codec name"""
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # the sample may end partway through a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        sample.decode("cp1252")
+        return "cp1252"
+    except UnicodeDecodeError:
+        # every byte is a latin-1 character
+        return "latin-1"
+
+
+def sample_column_formats(table, row):
+    """Hold back a row of a table whose date columns' formats aren't settled yet, keeping only the formats that
+    fit every value seen in each column, and settle them once the sample is big enough. A sample keeps growing
+    while any column still fits more than one format, e.g. month-first and day-first dates whose days have all
+    been 12 or less, up to max_date_sample_rows rows.
+
+        :param table: (dict) table from extract_table_segments
+        :param row: (list(str)) row of values"""
+
+    table["sample"].append(row)
+    for i, candidates in enumerate(table["candidates"]):
+        # blank fields are nulls, which no format has to fit
+        if len(candidates) > 0 and row[i] != "":
+            table["candidates"][i] = [date_format for date_format in candidates if is_date(row[i], date_format)]
+
+    num_formats = [len(candidates) for candidates in table["candidates"]]
+    if len(table["sample"]) >= max_date_sample_rows or max(num_formats) <= 1 and (
+            len(table["sample"]) >= date_sample_rows or "date" not in table["col_types"]):
+        settle_column_formats(table)
+
+
+def settle_column_formats(table):
+    """Settle each date column of a table on the first format, in date_formats order, that fit all of its
+    sampled values - columns that no format fits are strings after all - and aggregate the rows held back.
+
+        :param table: (dict) table from extract_table_segments"""
+
+    if table["sample"] is None:
+        return
+
+    table["col_formats"] = [candidates[0] if len(candidates) > 0 else None for candidates in table["candidates"]]
+    table["col_types"] = ["str" if col_type == "date" and date_format is None else col_type
+                          for col_type, date_format in zip(table["col_types"], table["col_formats"])]
+    for i, row in enumerate(table["sample"]):
+        add_row_to_aggregates(table["metadata"], row, table["col_aliases"], table["col_types"], i == 0,
+                              col_formats=table["col_formats"])
+    table["sample"] = None
+
+
+def add_row_to_aggregates(metadata, row, col_aliases, col_types, is_first_value_row, col_formats=None):
     """Adds row data to aggregates.
 
         :param metadata: (dict) metadata dictionary to add to
         :param row: (list(str)) row of strings to add
         :param col_aliases: (list(str)) list of headers
-        :param col_types: (list("num" | "str")) list of header types
+        :param col_types: (list("num" | "str" | "date")) list of header types
         :param is_first_value_row: (bool) whether this is the first value row, so we need to initialize
-        the necessary aggregate dictionary in the metadata"""
+        the necessary aggregate dictionary in the metadata
+        :param col_formats: (list(tuple)) format of each date column from settle_column_formats"""
 
     for i in range(0, len(row)):
         value = row[i]
@@ -279,12 +1011,16 @@ def add_row_to_aggregates(metadata, row, col_aliases, col_types, is_first_value_
 
         if is_first_value_row:
             metadata["columns"][col_alias] = {}
-            metadata["columns"][col_alias]["frequencies"] = {str(value): 1}
-        else:
-            if str(value) in metadata["columns"][col_alias]["frequencies"].keys():
-                metadata["columns"][col_alias]["frequencies"][str(value)] += 1
+            # nearly every time is distinct, so counting them would only fill memory - they are sketched instead
+            if col_type != "date":
+                metadata["columns"][col_alias]["frequencies"] = {str(value): 1}
             else:
-                metadata["columns"][col_alias]["frequencies"][str(value)] = 1
+                metadata["columns"][col_alias]["distinct_sketch"] = HyperLogLog(precision=distinct_precision)
+            if col_type == "num":
+                metadata["columns"][col_alias]["value_sketch"] = KLLSketch(k=quantile_k)
+        elif col_type != "date":
+            frequencies = metadata["columns"][col_alias]["frequencies"]
+            frequencies[str(value)] = frequencies.get(str(value), 0) + 1
 
         if col_type == "num":
             # cast the field to a number to do numerical aggregates
@@ -294,6 +1030,9 @@ def add_row_to_aggregates(metadata, row, col_aliases, col_types, is_first_value_
             except ValueError:
                 continue
 
+            if not math.isinf(value) and not math.isnan(value):
+                metadata["columns"][col_alias]["value_sketch"].add(value)
+
             # start off the metadata if this is the first row of values
             if is_first_value_row:
                 metadata["columns"][col_alias]["min"] = [float("inf"), float("inf"), float("inf")]
@@ -324,26 +1063,74 @@ def add_row_to_aggregates(metadata, row, col_aliases, col_types, is_first_value_
                     metadata["columns"][col_alias]["max"][2] = value
                 metadata["columns"][col_alias]["total"] += value
 
+        elif col_type == "date":
+            column = metadata["columns"][col_alias]
+            column["distinct_sketch"].add(value)
+            try:
+                value = parse_date(value, col_formats[i], column.setdefault("cache", {}))
+            except ValueError:
+                continue
+
+            if "earliest" not in column:
+                column["earliest"] = value
+                column["latest"] = value
+                column["intervals"] = {}
+            else:
+                if value < column["earliest"]:
+                    column["earliest"] = value
+                elif value > column["latest"]:
+                    column["latest"] = value
+                # count the gaps between consecutive times to find how often the column was sampled
+                interval = abs(column["previous"] - value)
+                if interval > 0 and (interval in column["intervals"] or len(column["intervals"]) < max_intervals):
+                    column["intervals"][interval] = column["intervals"].get(interval, 0) + 1
+            column["previous"] = value
+
         elif col_type == "str":
             # TODO: add string-specific field aggregates?
             pass
 
 
-def add_final_aggregates(metadata, col_aliases, col_types, num_rows):
+def add_final_aggregates(metadata, col_aliases, col_types, num_rows, col_formats=None):
     """Adds row data to aggregates.
 
         :param metadata: (dict) metadata dictionary to add to
         :param col_aliases: (list(str)) list of headers
-        :param col_types: (list("num" | "str")) list of header types
-        :param num_rows: (int) number of value rows"""
+        :param col_types: (list("num" | "str" | "date")) list of header types
+        :param num_rows: (int) number of value rows
+        :param col_formats: (list(tuple)) format of each date column from settle_column_formats"""
 
     # calculate averages for numerical columns if aggregates were taken,
     # (which only happens when there is a single row of headers)
     for i in range(0, len(col_aliases)):
         col_alias = col_aliases[i]
-        metadata["columns"][col_alias]["mode"] = max(metadata["columns"][col_alias]["frequencies"].iteritems(),
-                                                     key=itemgetter(1))[0]
-        metadata["columns"][col_alias].pop("frequencies")
+        distinct = metadata["columns"][col_alias].pop("distinct_sketch", None)
+        values = metadata["columns"][col_alias].pop("value_sketch", None)
+        if "frequencies" in metadata["columns"][col_alias]:
+            frequencies = metadata["columns"][col_alias].pop("frequencies")
+            metadata["columns"][col_alias]["mode"] = max(frequencies.iteritems(), key=itemgetter(1))[0]
+            # every distinct value has been counted already, so the count is exact
+            metadata["columns"][col_alias]["distinct"] = len(frequencies)
+
+        # the sketches are kept serialized, so that the columns of tables read in pieces can be combined, but
+        # extract_metadata drops them from what it returns
+        metadata["columns"][col_alias]["sketches"] = {}
+        if distinct is not None:
+            metadata["columns"][col_alias]["distinct"] = distinct.count()
+            metadata["columns"][col_alias]["sketches"]["distinct"] = distinct.to_dict()
+
+        if col_types[i] == "date":
+            column = metadata["columns"][col_alias]
+            column["date_format"] = col_formats[i][0]
+            column.pop("cache", None)
+            if "earliest" in column:
+                intervals = column.pop("intervals")
+                column.pop("previous")
+                column["span"] = column["latest"] - column["earliest"]
+                # the most common gap is the sampling interval, even if some samples are missing
+                column["interval"] = max(intervals.iteritems(), key=itemgetter(1))[0] if len(intervals) > 0 else None
+                column["earliest"] = format_date(column["earliest"], col_formats[i])
+                column["latest"] = format_date(column["latest"], col_formats[i])
 
         if col_types[i] == "num":
             metadata["columns"][col_alias]["max"] = [val for val in metadata["columns"][col_alias]["max"]
@@ -357,6 +1144,15 @@ def add_final_aggregates(metadata, col_aliases, col_types, num_rows):
             ) if len(metadata["columns"][col_alias]["min"]) > 0 else None
             metadata["columns"][col_alias].pop("total")
 
+            # the sketch's estimates are values from the column, so they need no rounding
+            if values is not None and values.count > 0:
+                metadata["columns"][col_alias]["quantiles"] = {
+                    "p01": values.quantile(0.01),
+                    "p50": values.quantile(0.5),
+                    "p99": values.quantile(0.99)
+                }
+                metadata["columns"][col_alias]["sketches"]["values"] = values.to_dict()
+
 
 def max_precision(nums):
     """Determine the maximum precision of a list of floating point numbers.
@@ -367,55 +1163,246 @@ def max_precision(nums):
 
 
 class ReverseReader:
-    """Reads column-formatted files in reverse as lists of fields.
+    """Reads column-formatted files in reverse as lists of fields, a block of bytes at a time. Lines may end
+    in '\n', '\r\n', or '\r', and blank lines are skipped. Fields are left as bytes.
 
-        :param file_handle: (file) open file
-        :param delimiter: (string) ',' or 'whitespace' """
+        :param file_handle: (file) file opened in binary mode
+        :param delimiter: (string) ',' or 'whitespace'
+        :param block_size: (int) number of bytes read at a time"""
 
-    def __init__(self, file_handle, delimiter=","):
+    def __init__(self, file_handle, delimiter=",", block_size=64 * 1024):
         self.fh = file_handle
         self.fh.seek(0, os.SEEK_END)
         self.delimiter = delimiter
-        self.position = self.fh.tell()
-        self.prev_position = self.fh.tell()
+        self.block_size = block_size
+        self.size = self.fh.tell()
+        # offset of the first byte not yet read
+        self.position = self.size
+        # (offset, line) pairs read but not yet returned, last line last
+        self.lines = []
+        # the top line of the last block read, which may start in the block above
+        self.partial = b""
+        # offset of the start of the row last read
+        self.row_start = self.size
 
     @staticmethod
     def fields(line, delimiter):
         # if space-delimited, do not keep whitespace fields, otherwise do
-        return [field.strip() for field in re.split("," if delimiter == "," else "\\s", line)
-                if delimiter != "whitespace" or delimiter == "whitespace" and field.strip() != ""]
+        if delimiter == "whitespace":
+            return line.split()
+        return [field.strip() for field in line.split(delimiter)]
 
     def next(self):
-        line = ''
-        if self.position <= 0:
-            raise StopIteration
-        self.prev_position = self.position
-        while self.position >= 0:
+        while len(self.lines) == 0:
+            if self.position == 0:
+                raise StopIteration
+            read_size = min(self.block_size, self.position)
+            self.position -= read_size
             self.fh.seek(self.position)
-            next_char = self.fh.read(1)
-            if next_char in ['\n', '\r']:
-                self.position -= 1
-                if len(line) > 1:
-                    return self.fields(line[::-1], self.delimiter)
-            else:
-                line += next_char
-                self.position -= 1
-        return self.fields(line[::-1], self.delimiter)
+            block = self.fh.read(read_size) + self.partial
+
+            self.lines = [(self.position + match.start(), match.group()) for match in line_pattern.finditer(block)]
+            self.partial = b""
+            if self.position > 0 and len(self.lines) > 0 and self.lines[0][0] == self.position:
+                self.partial = self.lines.pop(0)[1]
+
+        self.row_start, line = self.lines.pop()
+        return self.fields(line, self.delimiter)
 
     def __iter__(self):
         return self
 
 
-def is_header_row(row):
+class SampleReader:
+    """Reads a sample of a column-formatted file's rows in reverse, like ReverseReader, for files too large to
+    read whole: the block at the bottom of the file, where the last table ends, a number of blocks spread
+    through the middle, and the block at the top, where the first table's headers and any preamble are. Each
+    block is realigned to whole lines - it yields the lines that start inside it, reading on past its end to
+    finish the last one - so blocks that happen to be adjacent yield every line between them exactly once.
+
+    The number of middle blocks is set by a byte budget, a time budget, or both. Every block is the size of the
+    bottom one, so that the blocks are evenly weighted - that is smaller than block_size when the byte budget
+    can't fit three blocks otherwise, or under a time budget, where the bottom block is a small probe. A time
+    budget is turned into bytes at the rate the bottom block was read and aggregated, once that is known, and
+    any middle blocks left when it runs out are skipped.
+
+        :param file_handle: (file) file opened in binary mode
+        :param delimiter: (string) ',' or 'whitespace'
+        :param block_size: (int) largest number of bytes in each block
+        :param max_bytes: (int) number of bytes to read, or None for no byte budget
+        :param max_seconds: (float) seconds to spend, including aggregating the rows, or None for no time budget
+        :param random_blocks: (bool) whether to pick middle blocks at random rather than evenly spaced - the
+        choice is seeded with the file's size, so a file is always sampled the same way
+        :param bytes_read: (int) number of bytes already read from the file, which count against max_bytes"""
+
+    def __init__(self, file_handle, delimiter=",", block_size=64 * 1024, max_bytes=None, max_seconds=None,
+                 random_blocks=False, bytes_read=0):
+        self.fh = file_handle
+        self.fh.seek(0, os.SEEK_END)
+        self.delimiter = delimiter
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.random_blocks = random_blocks
+        self.size = self.fh.tell()
+        self.started = time.time()
+        # bytes read from the file so far, which count against the byte budget
+        self.bytes_read = bytes_read
+        self.lines_read = 0
+        self.block_started = self.started
+
+        # the bottom block leaves room in the byte budget for the top block and at least one in the middle,
+        # and under a time budget is kept small, since how fast rows are read isn't known until it's done
+        first_block = block_size
+        if max_bytes is not None:
+            first_block = min(first_block, max(1, (max_bytes - bytes_read) // 3))
+        if max_seconds is not None:
+            first_block = min(first_block, probe_block_size)
+
+        # (start, end) of the blocks still to read, last block first
+        self.blocks = [(max(0, self.size - first_block), self.size)]
+        self.planned = self.size <= first_block
+        # (start, end) of every block read - the lines that start in these ranges are the sample
+        self.ranges = []
+        # (offset, line) pairs read but not yet returned, last line last
+        self.lines = []
+        # offset of the start of the row last read
+        self.row_start = self.size
+
+    def plan(self):
+        """Choose the middle blocks to read once the bottom block is done, and finish with the top one. Under a
+        budget, the blocks are shrunk so that the top block and at least one middle block fit in what is left."""
+
+        self.planned = True
+        bottom = self.blocks_start()
+        if bottom == 0:
+            return
+
+        # bytes left to read, or None for no budget
+        allowance = None
+        if self.max_bytes is not None:
+            allowance = self.max_bytes - self.bytes_read
+        if self.max_seconds is not None:
+            elapsed = time.time() - self.started
+            rate = (self.size - bottom) / max(elapsed, 1e-6)
+            # rows get slower to read as the columns' distinct values pile up, and the columns are summarised
+            # once they're read, so only half of the time left is planned for
+            timed_allowance = int((self.max_seconds - elapsed) * rate / 2)
+            allowance = timed_allowance if allowance is None else min(allowance, timed_allowance)
+
+        # every block is the size of the bottom one, so that each stands for as much of the file as the others
+        block_size = min(self.block_size, self.size - bottom)
+        num_blocks = None
+        # each block also reads on to finish its last line, so that much is set aside for every block
+        line_length = 0
+        if allowance is not None:
+            line_length = (self.size - bottom) // max(1, self.lines_read) + 1
+            block_size = min(block_size, allowance // 2 - line_length)
+            if block_size < line_length:
+                # there's only room for the top block, if that
+                block_size = min(bottom, allowance - line_length)
+                if block_size > 0:
+                    self.blocks.append((0, block_size))
+                return
+            num_blocks = (allowance - block_size - line_length) // (block_size + line_length)
+
+        # the middle of the file is split into slots of one block each, after the top block
+        slots = max(0, (bottom - block_size) // block_size)
+        read_all = allowance is None or bottom + (slots + 1) * line_length <= allowance
+        if read_all:
+            indices = range(0, slots)
+        elif self.random_blocks:
+            indices = sorted(random.Random(self.size).sample(range(0, slots), min(slots, num_blocks)))
+        else:
+            num_blocks = min(slots, num_blocks)
+            indices = [int((i + 0.5) * slots / num_blocks) for i in range(0, num_blocks)]
+
+        # when everything is read, the bottom block may start partway through a slot, so the last slot (or the
+        # top block, if there are none) runs on to it
+        for index in reversed(indices):
+            start = block_size * (index + 1)
+            self.blocks.append((start, bottom if read_all and index == slots - 1 else start + block_size))
+        self.blocks.append((0, bottom if read_all and slots == 0 else min(block_size, bottom)))
+
+    def blocks_start(self):
+        return self.ranges[0][0] if len(self.ranges) > 0 else self.size
+
+    def time_for(self, *blocks):
+        # whether the blocks can be read in the time left, at the rate the last block's rows were read - rows
+        # take longer as a column's distinct values pile up, so the rate so far overall would be too hopeful
+        now = time.time()
+        last_start, last_end = self.ranges[-1]
+        rate = (last_end - last_start) / max(now - self.block_started, 1e-6)
+        needed = sum(end - start for start, end in blocks) / max(rate, 1e-6)
+        return now - self.started + needed * time_margin <= self.max_seconds
+
+    def read_block(self, start, end):
+        self.block_started = time.time()
+        # read from the byte before the block, to tell whether its first line starts inside it
+        self.fh.seek(max(0, start - 1))
+        data = self.fh.read(end - max(0, start - 1))
+        # finish the block's last line
+        while len(data) > 0 and data[-1] not in b"\r\n" and self.fh.tell() < self.size:
+            more = self.fh.read(line_search_size)
+            line_end = min([i for i in [more.find(b"\r"), more.find(b"\n")] if i >= 0] or [len(more)])
+            data += more[:line_end]
+            if line_end < len(more):
+                break
+        self.bytes_read += len(data)
+
+        offset = max(0, start - 1)
+        lines = [(offset + match.start(), match.group()) for match in line_pattern.finditer(data)]
+        if start > 0 and len(lines) > 0 and lines[0][0] < start:
+            lines.pop(0)
+        self.lines_read += len(lines)
+        self.ranges.append((start, end))
+
+        return lines
+
+    @property
+    def sampled_bytes(self):
+        return sum(end - start for start, end in self.ranges)
+
+    def next(self):
+        while len(self.lines) == 0:
+            if len(self.blocks) == 0:
+                if self.planned:
+                    raise StopIteration
+                self.plan()
+                continue
+            if self.planned and self.max_seconds is not None and len(self.blocks) > 1 and not self.time_for(
+                    self.blocks[0], self.blocks[-1]):
+                # out of time, so skip the rest of the middle blocks for the top one
+                del self.blocks[:-1]
+            start, end = self.blocks.pop(0)
+            self.lines = self.read_block(start, end)
+
+        self.row_start, line = self.lines.pop()
+        return ReverseReader.fields(line, self.delimiter)
+
+    def __iter__(self):
+        return self
+
+
+def is_header_row(row, col_formats=None):
     """Determine if row is a header row by checking that it contains no fields that are
-    only numeric.
+    only numeric, or dates or times.
 
         :param row: (list(str)) list of fields in row
+        :param col_formats: (list(tuple)) format of each column of the table the row is in, from
+        settle_column_formats - if given, fields are only checked against their own column's format, rather than
+        trying every format on each of them
         :returns: (bool) whether row is a header row"""
 
     for field in row:
         if is_number(field):
             return False
+    for i, field in enumerate(row):
+        if col_formats is None:
+            if infer_date_format(field) is not None:
+                return False
+        elif col_formats[i] is not None and col_formats[i][1].match(field):
+            return False
     return True
 
 
@@ -432,6 +1419,129 @@ def is_number(field):
         return False
 
 
+def infer_date_format(field):
+    """Find the first format a date or time fits, which is enough to tell that a field is one - a column's
+    format is settled from a sample of its values by settle_column_formats.
+
+        :param field: (str) field
+        :returns: ((str, re.RegexObject, tuple(int))) format from date_formats, or None if the field isn't a
+        date or time"""
+
+    # every format has at least four characters and starts with a digit
+    if len(field) < 4 or not field[:1].isdigit():
+        return None
+    for date_format in date_formats:
+        if date_format[1].match(field):
+            try:
+                parse_date(field, date_format)
+                return date_format
+            except ValueError:
+                # e.g. a day first date whose day looks like a month
+                continue
+
+    return None
+
+
+def date_format_candidates(field):
+    """Find every format a date or time could be in, e.g. both month-first and day-first for 01/02/2001.
+
+        :param field: (str) field
+        :returns: (list(tuple)) formats from date_formats that the field is a valid date or time in"""
+
+    # every format has at least four characters and starts with a digit
+    if len(field) < 4 or not field[:1].isdigit():
+        return []
+
+    return [date_format for date_format in date_formats if is_date(field, date_format)]
+
+
+def is_date(field, date_format):
+    """Determine if a field is a valid date or time in a format.
+
+        :param field: (str) field
+        :param date_format: ((str, re.RegexObject, tuple(int))) format from date_formats
+        :returns: (bool) whether the field parses in the format"""
+
+    try:
+        parse_date(field, date_format)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_date(field, date_format, cache=None):
+    """Convert a date or time to a number of seconds that can be aggregated like any other number. Columns
+    repeat the same days and times of day many times over, so their conversions can be remembered.
+
+        :param field: (str) field
+        :param date_format: ((str, re.RegexObject, tuple(int))) format from date_formats
+        :param cache: (dict) conversions remembered from earlier fields of the same column
+        :returns: (float) seconds since the start of year 1, or since midnight for formats without a date
+        :raises: (ValueError) if the field isn't a valid date or time in the format"""
+
+    match = date_format[1].match(field)
+    if match is None:
+        raise ValueError("{} doesn't match {}".format(field, date_format[0]))
+    groups = match.groups()
+    year, month, day, hour, minute, second = date_format[2]
+
+    seconds = 0.0
+    if year >= 0:
+        key = (groups[year], groups[month], groups[day])
+        days = cache.get(key) if cache is not None else None
+        if days is None:
+            days = day_number(*key)
+            if cache is not None and len(cache) < max_cached_dates:
+                cache[key] = days
+        seconds += 86400 * days
+    if hour >= 0:
+        key = (groups[hour], groups[minute])
+        minutes = cache.get(key) if cache is not None else None
+        if minutes is None:
+            minutes = 60 * int(groups[hour]) + int(groups[minute])
+            if cache is not None and len(cache) < max_cached_dates:
+                cache[key] = minutes
+        seconds += 60 * minutes
+        if groups[second] is not None:
+            seconds += float(groups[second])
+
+    return seconds
+
+
+def day_number(year, month, day):
+    """Count the days from the start of year 1 to a date.
+
+        :param year: (str) two or four digit year
+        :param month: (str) month number or three letter name
+        :param day: (str) day of the month
+        :returns: (int) number of days
+        :raises: (ValueError) if the month or day is out of range"""
+
+    month = int(month) if month.isdigit() else month_numbers.get(month.lower(), 0)
+    year_number = int(year)
+    if len(year) == 2:
+        # two digit years are read the way strptime reads them, as 1969 to 2068
+        year_number += 1900 if year_number >= 69 else 2000
+
+    return date(year_number, month, int(day)).toordinal() - 1
+
+
+def format_date(seconds, date_format):
+    """Write seconds from parse_date back out as an ISO 8601 date or time.
+
+        :param seconds: (float) seconds from parse_date
+        :param date_format: ((str, re.RegexObject, tuple(int))) format the seconds were parsed with
+        :returns: (str) date, date and time, or time"""
+
+    if "year" not in date_format[1].groupindex:
+        return str(timedelta(seconds=seconds)).rjust(8, "0")
+    moment = datetime(1, 1, 1) + timedelta(seconds=seconds)
+    if "hour" not in date_format[1].groupindex:
+        return moment.date().isoformat()
+
+    return moment.isoformat()
+
+
 def is_abstract(file_handle):
     """Determine if a file is a free-text abstract-like file that can be fed to the topic model.
 
@@ -457,3 +1567,151 @@ def is_abstract(file_handle):
         return True
     else:
         return False
+
+
+def extract_free_text_metadata(file_handle, classification_only=False):
+    """Accept a file as free text if it is long enough and not mostly numbers, and profile its text for
+    the topic model.
+
+        :param file_handle: (file) open file
+        :param classification_only: (bool) whether to exit after ascertaining file class
+        :returns: (dict) metadata dictionary with a "text_profile" summary and its bag-of-words "vector"
+        :raises: (ExtractionError) if the file is not abstract-like"""
+
+    # minimum length in bytes to be worth topic modelling
+    min_length = 1000
+
+    file_handle.seek(0, os.SEEK_END)
+    if file_handle.tell() <= min_length or not is_abstract(file_handle):
+        raise ExtractionError
+
+    if classification_only:
+        raise ExtractionPassed
+
+    # text_profile needs numpy, so it is only loaded once a free-text file turns up
+    from text_profile import profile_text
+
+    profile = profile_text(file_handle)
+
+    return {"vector": profile.pop("vector"), "text_profile": profile}
+
+
+def extract_xml_metadata(file_handle, classification_only=False, min_classification_elements=10, max_text=10000,
+                         max_paths=1000, max_attributes=1000):
+    """Get metadata from an xml file by parsing it incrementally, discarding each element once it has been
+    counted so that memory use doesn't grow with the size of the file. The text of descriptive elements like
+    titles, abstracts, and keywords is kept, and parsing stops once enough of it has been found.
+
+        :param file_handle: (file) open file
+        :param classification_only: (bool) whether to exit after ascertaining file class
+        :param min_classification_elements: (int) number of elements necessary to classify file as xml
+        :param max_text: (int) number of characters of descriptive text after which the rest of the file is ignored
+        :param max_paths: (int) number of distinct element paths to count
+        :param max_attributes: (int) number of distinct attribute keys to count
+        :returns: (dict) ascertained metadata
+        :raises: (ExtractionError) if the file is not well-formed xml"""
+
+    metadata = {"element_paths": {}, "attributes": {}, "namespaces": {}}
+    # open elements, and their local names
+    elements = []
+    path = []
+    # index in elements of the outermost open descriptive element, whose children are kept until it ends
+    descriptive_depth = None
+    num_elements = 0
+    text_length = 0
+
+    with binary_mode(file_handle) as binary_handle:
+        try:
+            for event, item in ElementTree.iterparse(binary_handle, events=("start", "end", "start-ns")):
+                if event == "start-ns":
+                    prefix, uri = item
+                    metadata["namespaces"].setdefault(prefix, uri)
+                    continue
+
+                local_name = item.tag.rsplit('}', 1)[-1]
+                if event == "start":
+                    if len(elements) == 0 and item.tag.startswith('{'):
+                        metadata["root_namespace"] = item.tag[1:].split('}', 1)[0]
+                    elements.append(item)
+                    path.append(local_name)
+
+                    element_path = "/" + "/".join(path)
+                    if element_path in metadata["element_paths"] or len(metadata["element_paths"]) < max_paths:
+                        metadata["element_paths"][element_path] = metadata["element_paths"].get(element_path, 0) + 1
+                    for key in item.attrib:
+                        key = key.rsplit('}', 1)[-1]
+                        if key in metadata["attributes"] or len(metadata["attributes"]) < max_attributes:
+                            metadata["attributes"][key] = metadata["attributes"].get(key, 0) + 1
+
+                    if descriptive_depth is None and local_name.lower() in descriptive_elements:
+                        descriptive_depth = len(elements) - 1
+                    continue
+
+                # end of an element
+                num_elements += 1
+                if classification_only and num_elements >= min_classification_elements:
+                    raise ExtractionPassed
+
+                if descriptive_depth == len(elements) - 1:
+                    # text may be nested in children, like the CharacterString elements of ISO 19115
+                    text = " ".join(" ".join(item.itertext()).split())
+                    if len(text) > 0:
+                        add_descriptive_text(metadata, descriptive_elements[local_name.lower()], text)
+                        text_length += len(text)
+                    descriptive_depth = None
+
+                elements.pop()
+                path.pop()
+                if descriptive_depth is None:
+                    item.clear()
+                    # the parent still refers to this element, so remove it to keep the tree from growing
+                    if len(elements) > 0:
+                        elements[-1].remove(item)
+
+                if text_length >= max_text:
+                    metadata["truncated"] = True
+                    break
+        except SyntaxError:
+            # includes ElementTree.ParseError
+            raise ExtractionError
+
+    if num_elements == 0:
+        raise ExtractionError
+    if classification_only:
+        raise ExtractionPassed
+
+    for key in ["element_paths", "attributes", "namespaces"]:
+        if len(metadata[key]) == 0:
+            metadata.pop(key)
+
+    return metadata
+
+
+def add_descriptive_text(metadata, key, text):
+    """Add the text of a descriptive xml element to metadata. Only the first title and abstract are kept,
+    while all distinct keywords are.
+
+        :param metadata: (dict) metadata dictionary to add to
+        :param key: ("title" | "abstract" | "keywords") metadata key for the text
+        :param text: (str) element text"""
+
+    if key == "keywords":
+        if text not in metadata.setdefault("keywords", []):
+            metadata["keywords"].append(text)
+    elif key not in metadata:
+        metadata[key] = text
+
+
+# format -> (class, extractor) pairs to try in order - formats that aren't listed, like images, PDFs,
+# and other binary files, are classified as unknown as soon as they are sniffed
+extractors = {
+    "netcdf": [("container-format", extract_netcdf_metadata)],
+    "hdf5": [("container-format", extract_netcdf_metadata)],
+    "zip": [("columnar", extract_spreadsheet_metadata), ("archive", extract_archive_metadata)],
+    "ole2": [("columnar", extract_spreadsheet_metadata)],
+    "gzip": [("archive", extract_archive_metadata)],
+    "compress": [("archive", extract_archive_metadata)],
+    "text": [("columnar", extract_columnar_metadata), ("free-text", extract_free_text_metadata)],
+    "markup": [("xml", extract_xml_metadata), ("columnar", extract_columnar_metadata),
+               ("free-text", extract_free_text_metadata)],
+}
@@ -1,21 +1,10 @@
-import pandas as pd
-import itertools
 from math import isnan
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.decomposition import PCA
-from sklearn.model_selection import train_test_split, GridSearchCV, ShuffleSplit, StratifiedKFold
-import scipy as sp
-import cPickle as pkl
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
 from metadata_util import is_number
-from pylab import cm
-
-np.set_printoptions(threshold=np.nan)
 
 
 def get_text_rows(matrix):
+    import numpy as np
+
     to_remove = []
     for i in range(0, len(matrix)):
         if not np.vectorize(is_number)(matrix[i]).all():
@@ -25,6 +14,8 @@ def get_text_rows(matrix):
 
 
 def fill_zeros(matrix):
+    import numpy as np
+
     num_rows, num_cols = matrix.shape
     output_matrix = np.empty(matrix.shape)
     for i in range(0, num_rows):
@@ -38,6 +29,8 @@ def fill_zeros(matrix):
 
 
 def clean_data(X, y):
+    import numpy as np
+
     to_remove = get_text_rows(X)
     X = np.delete(X, to_remove, axis=0)
     y = np.delete(y, to_remove, axis=0)
@@ -48,6 +41,8 @@ def clean_data(X, y):
 
 
 def bin_null_values(y):
+    import numpy as np
+
     y_output = np.zeros(y.shape)
 
     nulls = [0]
@@ -111,106 +106,125 @@ def percent_false_negative(actual, predicted):
     return float(num_false_neg) / num_rows
 
 
-data = pd.read_csv('col_metadata.csv')
-X = data.iloc[:, 3:-1].values
-y = data.iloc[:, -1:].values
-
-X, y = clean_data(X, y)
-nulls, y = bin_null_values(y)
-
-# all_y_test = np.zeros((0, 1))
-# all_y_pred = np.zeros((0, 1))
-
-# model = KNeighborsClassifier(algorithm='auto', leaf_size=30, metric='euclidean',
-#                              metric_params=None, n_jobs=1, n_neighbors=19,
-#                              weights='distance')
-
-# params = {"n_neighbors": np.arange(1, 31, 2),
-#           "metric": ["euclidean", "cityblock"],
-#           "weights": ['uniform', 'distance']
-#           }
-#
-# model = GridSearchCV(KNeighborsClassifier(algorithm='auto', leaf_size=30,
-#                                           metric_params=None, n_jobs=1), params)
-#
-# model.fit(X, y.reshape(y.shape[0], ))
-#
-# print model.best_params_
-
-
-# for train_inds, test_inds in ShuffleSplit(n_splits=100, test_size=0.01).split(X, y):
-#     # Split off the train and test set
-#     X_test, y_test = X[test_inds, :], y[test_inds]
-#     X_train, y_train = X[train_inds, :], y[train_inds]
-#
-#     # Train the model
-#     model.fit(X_train, y_train)
-#     y_pred = model.predict(X_test).reshape(-1, 1)  # 482, 1
-#
-#     # Append the results
-#     all_y_test = np.concatenate((all_y_test, y_test))
-#     all_y_pred = np.concatenate((all_y_pred, y_pred))
-#
-# print "accuracy: {}\nalpha: {}\nbeta: {}".format(percent_correct(all_y_test, all_y_pred),
-#                                                  percent_false_positive(all_y_test, all_y_pred),
-#                                                  percent_false_negative(all_y_test, all_y_pred)
-
-pca = PCA(n_components=2)
-X_fit_pca = pca.fit(X)
-X_r = X_fit_pca.transform(X)
-
-one = plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 0],
-            [X_r[i, 1] for i in range(0, 4813) if y[i] == 0],
-            c='r', s=100, alpha=.5)
-plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 1],
-            [X_r[i, 1] for i in range(0, 4813) if y[i] == 1],
-            c='g', s=100, alpha=.5)
-plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 2],
-            [X_r[i, 1] for i in range(0, 4813) if y[i] == 2],
-            c='m', s=100, alpha=.5)
-plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 3],
-            [X_r[i, 1] for i in range(0, 4813) if y[i] == 3],
-            c='c', s=100, alpha=.5)
-plt.suptitle('PCA visualization of null value data', fontsize=20)
-# one.axes.get_xaxis().set_visible(False)
-# one.axes.get_yaxis().set_visible(False)
-plt.show()
-
-# x_ranges = []
-# for i in range(0, 12):
-#     if i in [0, 1, 5, 10, 11]:
-#         i_min, i_max = X[:, i].min() - 1, X[:, i].max() + 1
-#         x_ranges.append(np.linspace(i_min, i_max, 3))
-#
-# x_mesh = list(itertools.product(*x_ranges))
-#
-# print len(x_mesh)
-# print "predicting x_mesh"
-# Z = model.predict(x_mesh).reshape(-1, 1)
-# print Z
-# print "performing PCA transformation on x_mesh result"
-# Z_r = X_fit_pca.transform(Z)
-#
-# print Z_r
-
-
-
-# Create color maps
-# cmap_light = ListedColormap(['#FFAAAA', '#AAFFAA', '#AAAAFF'])
-# cmap_bold = ListedColormap(['#FF0000', '#00FF00', '#0000FF'])
-
-# Plot the decision boundary. For that, we will assign a color to each point in the mesh
-
-
-# Put the result into a color plot
-# Z = Z.reshape(xx.shape)
-# plt.figure()
-# plt.pcolormesh(xx, yy, Z, cmap=cmap_light)
-
-# Plot also the training points
-# plt.scatter(X[:, 0], X[:, 1], c=y, cmap=cmap_bold)
-# plt.xlim(xx.min(), xx.max())
-# plt.ylim(yy.min(), yy.max())
-# plt.title("3-Class classification (k = %i, weights = '%s')"
-#           % (5, 'uniform'))
-# plt.show()
+def main():
+    """Train on the hand-labelled null values in col_metadata.csv and plot a PCA projection of the columns.
+    The model and plotting libraries are only imported here, and numpy only in the functions that use it, so
+    that importing the helpers above stays cheap."""
+
+    import numpy as np
+    import pandas as pd
+    import itertools
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.decomposition import PCA
+    from sklearn.model_selection import train_test_split, GridSearchCV, ShuffleSplit, StratifiedKFold
+    import scipy as sp
+    import cPickle as pkl
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import ListedColormap
+    from pylab import cm
+
+    np.set_printoptions(threshold=np.nan)
+
+    data = pd.read_csv('col_metadata.csv')
+    X = data.iloc[:, 3:-1].values
+    y = data.iloc[:, -1:].values
+
+    X, y = clean_data(X, y)
+    nulls, y = bin_null_values(y)
+
+    # all_y_test = np.zeros((0, 1))
+    # all_y_pred = np.zeros((0, 1))
+
+    # model = KNeighborsClassifier(algorithm='auto', leaf_size=30, metric='euclidean',
+    #                              metric_params=None, n_jobs=1, n_neighbors=19,
+    #                              weights='distance')
+
+    # params = {"n_neighbors": np.arange(1, 31, 2),
+    #           "metric": ["euclidean", "cityblock"],
+    #           "weights": ['uniform', 'distance']
+    #           }
+    #
+    # model = GridSearchCV(KNeighborsClassifier(algorithm='auto', leaf_size=30,
+    #                                           metric_params=None, n_jobs=1), params)
+    #
+    # model.fit(X, y.reshape(y.shape[0], ))
+    #
+    # print model.best_params_
+
+    # for train_inds, test_inds in ShuffleSplit(n_splits=100, test_size=0.01).split(X, y):
+    #     # Split off the train and test set
+    #     X_test, y_test = X[test_inds, :], y[test_inds]
+    #     X_train, y_train = X[train_inds, :], y[train_inds]
+    #
+    #     # Train the model
+    #     model.fit(X_train, y_train)
+    #     y_pred = model.predict(X_test).reshape(-1, 1)  # 482, 1
+    #
+    #     # Append the results
+    #     all_y_test = np.concatenate((all_y_test, y_test))
+    #     all_y_pred = np.concatenate((all_y_pred, y_pred))
+    #
+    # print "accuracy: {}\nalpha: {}\nbeta: {}".format(percent_correct(all_y_test, all_y_pred),
+    #                                                  percent_false_positive(all_y_test, all_y_pred),
+    #                                                  percent_false_negative(all_y_test, all_y_pred)
+
+    pca = PCA(n_components=2)
+    X_fit_pca = pca.fit(X)
+    X_r = X_fit_pca.transform(X)
+
+    one = plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 0],
+                      [X_r[i, 1] for i in range(0, 4813) if y[i] == 0],
+                      c='r', s=100, alpha=.5)
+    plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 1],
+                [X_r[i, 1] for i in range(0, 4813) if y[i] == 1],
+                c='g', s=100, alpha=.5)
+    plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 2],
+                [X_r[i, 1] for i in range(0, 4813) if y[i] == 2],
+                c='m', s=100, alpha=.5)
+    plt.scatter([X_r[i, 0] for i in range(0, 4813) if y[i] == 3],
+                [X_r[i, 1] for i in range(0, 4813) if y[i] == 3],
+                c='c', s=100, alpha=.5)
+    plt.suptitle('PCA visualization of null value data', fontsize=20)
+    # one.axes.get_xaxis().set_visible(False)
+    # one.axes.get_yaxis().set_visible(False)
+    plt.show()
+
+    # x_ranges = []
+    # for i in range(0, 12):
+    #     if i in [0, 1, 5, 10, 11]:
+    #         i_min, i_max = X[:, i].min() - 1, X[:, i].max() + 1
+    #         x_ranges.append(np.linspace(i_min, i_max, 3))
+    #
+    # x_mesh = list(itertools.product(*x_ranges))
+    #
+    # print len(x_mesh)
+    # print "predicting x_mesh"
+    # Z = model.predict(x_mesh).reshape(-1, 1)
+    # print Z
+    # print "performing PCA transformation on x_mesh result"
+    # Z_r = X_fit_pca.transform(Z)
+    #
+    # print Z_r
+
+    # Create color maps
+    # cmap_light = ListedColormap(['#FFAAAA', '#AAFFAA', '#AAAAFF'])
+    # cmap_bold = ListedColormap(['#FF0000', '#00FF00', '#0000FF'])
+
+    # Plot the decision boundary. For that, we will assign a color to each point in the mesh
+
+    # Put the result into a color plot
+    # Z = Z.reshape(xx.shape)
+    # plt.figure()
+    # plt.pcolormesh(xx, yy, Z, cmap=cmap_light)
+
+    # Plot also the training points
+    # plt.scatter(X[:, 0], X[:, 1], c=y, cmap=cmap_bold)
+    # plt.xlim(xx.min(), xx.max())
+    # plt.ylim(yy.min(), yy.max())
+    # plt.title("3-Class classification (k = %i, weights = '%s')"
+    #           % (5, 'uniform'))
+    # plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,29 @@ import time
 import csv
 import json
 import traceback
+import threading
 import globus_sdk
 from hashlib import sha256
 from re import compile
 from metadata_util import extract_metadata
+from instrumentation import stats
+from manifest import read_manifest, full_path
+from checksums import parse_checksum
+from work_queue import run_worker
+from concurrency import AdaptiveLimit, slot
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 
 # pattern used to distinguish files from directories - has '.' in 2nd, 3rd, or 4th to last character
 file_pattern = compile("^.*\..{2,4}$")
 
-PETREL_ID = os.environ["PETREL_ID"]
-LOCAL_ID = os.environ["LOCAL_ID"]
-TRANSFER_TOKEN = os.environ["TRANSFER_TOKEN"]
+# missing variables only matter once a transfer is attempted, so importing this module never fails for lack of them
+PETREL_ID = os.environ.get("PETREL_ID")
+LOCAL_ID = os.environ.get("LOCAL_ID")
+TRANSFER_TOKEN = os.environ.get("TRANSFER_TOKEN")
 
 
 def globus_first_login():
@@ -66,46 +78,146 @@ def get_globus_client():
     return tc
 
 
-def write_file_list(tc, endpoint_id, globus_path, list_file):
+def list_directory(tc, endpoint_id, globus_path, page_size=1000, limit=None):
+    """List a Globus directory one page at a time, so huge directories don't have to come back in
+    a single response.
+
+        :param tc: (globus_sdk.TransferClient) transfer client
+        :param endpoint_id: (str) endpoint to list
+        :param globus_path: (str) directory path ending with '/'
+        :param page_size: (int) number of items to request per operation_ls call
+        :param limit: (concurrency.AdaptiveLimit) limit to run each operation_ls call under, if any
+        :returns: (generator(dict)) listing items with "name", "type", "size", and "last_modified" keys"""
+
+    offset = 0
+    while True:
+        with stats.timer("list"), slot(limit):
+            page = list(tc.operation_ls(endpoint_id, path=globus_path, offset=offset, limit=page_size))
+        for item in page:
+            yield item
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+
+def write_file_list(tc, endpoint_id, globus_path, manifest_writer, num_workers=16, page_size=1000, limit=None,
+                    progress=None, max_attempts=5):
+    """Write every file below a Globus directory to a manifest. A pool of threads keeps up to
+    `num_workers` directory listings in flight at once, fewer while Globus is rate limiting or slowing
+    down, and files are written to the manifest as soon as their directory's listing arrives. A listing
+    that Globus turns away because it is busy is queued again after a pause, rather than losing the
+    directory's whole subtree.
+
+        :param tc: (globus_sdk.TransferClient) transfer client
+        :param endpoint_id: (str) endpoint to list
+        :param globus_path: (str) directory to list
+        :param manifest_writer: (manifest.ManifestWriter) writer used to record each file
+        :param num_workers: (int) number of concurrent listing threads
+        :param page_size: (int) number of items to request per operation_ls call
+        :param limit: (concurrency.AdaptiveLimit) limit on listings in flight, whose status shows how it has
+        adapted - by default one starting at 4 and growing to `num_workers`
+        :param progress: (progress.Progress) reporter to show the directories still to list and the listing
+        limit in, if any
+        :param max_attempts: (int) number of times a directory is listed while Globus is overloaded
+        :returns: (int) number of files written"""
+
+    if limit is None:
+        limit = AdaptiveLimit("globus_list", initial=min(4, num_workers), maximum=num_workers)
+    directories = Queue.Queue()
+    write_lock = threading.Lock()
+    num_files = [0]
+    if progress is not None:
+        progress.watch_queue("directories", directories.qsize)
+        progress.watch_limit(limit)
+
+    def list_directories():
+        while True:
+            task = directories.get()
+            if task is None:
+                directories.task_done()
+                return
+            directory, attempts = task
+            try:
+                # every page is fetched before anything is written, so a listing that is tried again can't
+                # write the same files twice
+                items = list(list_directory(tc, endpoint_id, directory, page_size=page_size, limit=limit))
+                for item in items:
+                    if item["type"] == "dir":
+                        directories.put((directory + item["name"] + "/", 0))
+                    elif item["type"] == "file":
+                        # keep the size and modification time from the listing so later stages don't have to ask again
+                        with write_lock:
+                            manifest_writer.write(item["name"], directory, item.get("size"), item.get("last_modified"))
+                            num_files[0] += 1
+                        stats.count("files")
+                stats.count("directories")
+            except Exception as e:
+                if limit.is_overload(e) and attempts + 1 < max_attempts:
+                    # give Globus a moment before asking again - the directory is queued before this one is
+                    # marked done, so the listing can't be taken to have finished in the meantime
+                    time.sleep(min(0.1 * 2 ** attempts, 5.0))
+                    directories.put((directory, attempts + 1))
+                    continue
+                stats.count("failures")
+                with open("errors.log", "a") as error_file:
+                    error_file.write("{} :: {}\n{}\n\n".format(directory, str(e), traceback.format_exc()))
+            finally:
+                directories.task_done()
+
     # corrects the path with '/' if necessary
-    globus_path = (globus_path + '{}').format('/' if globus_path[-1] != '/' else '')
+    directories.put(((globus_path + '{}').format('/' if globus_path[-1] != '/' else ''), 0))
 
-    list = tc.operation_ls(endpoint_id, path=globus_path)
-    for item in list:
-        item_path = globus_path + item["name"]
-        if item["type"] == "dir":
-            write_file_list(tc, endpoint_id, item_path, list_file)
-        elif item["type"] == "file":
-            list_file.write(item_path + '\n')
+    workers = [threading.Thread(target=list_directories) for _ in range(0, num_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
 
+    # every directory has been listed once the queue is empty and no listing is still adding to it
+    directories.join()
+    for _ in workers:
+        directories.put(None)
+    for worker in workers:
+        worker.join()
 
-def download_file(tc, endpoint_id, globus_path, file_name, local_path):
-    print("downloading file {}".format(globus_path + file_name))
-    tdata = globus_sdk.TransferData(tc, endpoint_id, LOCAL_ID)
-    tdata.add_item(globus_path + file_name, local_path + file_name)
+    return num_files[0]
 
-    result = tc.submit_transfer(tdata)
 
-    while not tc.task_wait(result["task_id"], polling_interval=1, timeout=60):
-        pass
-        # print("waiting for download: {}".format(globus_path + file_name))
+def download_file(tc, endpoint_id, globus_path, file_name, local_path, checksum=None):
+    extension = file_name.split('.', 1)[1] if '.' in file_name else "no extension"
+    with stats.timer("download", extension=extension):
+        if checksum is not None:
+            # a checksum already known, e.g. from an FTP server's HASH command, is checked by the transfer
+            # service, so it doesn't need to be hashed again locally
+            tdata = globus_sdk.TransferData(tc, endpoint_id, LOCAL_ID, verify_checksum=True)
+            tdata.add_item(globus_path + file_name, local_path + file_name,
+                           external_checksum=checksum[1], checksum_algorithm=checksum[0].upper())
+        else:
+            tdata = globus_sdk.TransferData(tc, endpoint_id, LOCAL_ID)
+            tdata.add_item(globus_path + file_name, local_path + file_name)
+
+        result = tc.submit_transfer(tdata)
+
+        while not tc.task_wait(result["task_id"], polling_interval=1, timeout=60):
+            pass
+            # print("waiting for download: {}".format(globus_path + file_name))
 
 
 def delete_file(tc, local_path, file_name):
-    print("deleting file {}".format(local_path + file_name))
     ddata = globus_sdk.DeleteData(tc, LOCAL_ID)
 
     ddata.add_item(local_path + file_name)
 
-    tc.submit_delete(ddata)
+    with stats.timer("delete"):
+        tc.submit_delete(ddata)
 
 
-def download_extract_delete(tc, endpoint_id, globus_path, file_name, local_path):
+def download_extract_delete(tc, endpoint_id, globus_path, file_name, local_path, vector_writer=None, checksum=None,
+                            search_index=None):
 
-    download_file(tc, endpoint_id, globus_path, file_name, local_path)
+    download_file(tc, endpoint_id, globus_path, file_name, local_path, checksum=checksum)
 
-    print("extracting metadata from {}".format(globus_path + file_name))
-    metadata = extract_metadata(file_name, local_path)
+    metadata = extract_metadata(file_name, local_path, vector_writer=vector_writer, checksum=checksum,
+                                search_index=search_index, index_path=globus_path + file_name)
 
     # overwrite the recorded local path with the globus path
     metadata["system"]["path"] = globus_path
@@ -117,13 +229,13 @@ def download_extract_delete(tc, endpoint_id, globus_path, file_name, local_path)
 
 def write_metadata(tc, endpoint_id, files, start_file_number, local_path, csv_writer, restart_file):
     for file_number in range(start_file_number, len(files)):
-        full_file_name = files[file_number]
-        globus_path, file_name = full_file_name.strip().rsplit("/", 1)
-        globus_path += "/"
+        entry = files[file_number]
+        globus_path, file_name = entry["path"], entry["file"]
 
         metadata = {}
         try:
-            metadata = download_extract_delete(tc, endpoint_id, globus_path, file_name, local_path)
+            metadata = download_extract_delete(tc, endpoint_id, globus_path, file_name, local_path,
+                                               checksum=parse_checksum(entry.get("checksum")))
         except Exception as e:
             with open("errors.log", "a") as error_file:
                 error_file.write(
@@ -134,7 +246,8 @@ def write_metadata(tc, endpoint_id, files, start_file_number, local_path, csv_wr
             # print("writing to col_metadata.csv:")
             # print(metadata)
             try:
-                write_dict_to_csv(metadata, csv_writer)
+                with stats.timer("write", extension=metadata["system"]["extension"], file_class=metadata["class"]):
+                    write_dict_to_csv(metadata, csv_writer)
             except Exception as e:
                 with open("errors.log", "a") as error_file:
                     error_file.write(
@@ -167,62 +280,126 @@ def write_dict_to_csv(metadata, csv_writer):
         ])
 
 
-def classify_files(tc, endpoint_id, files, start_file_number, local_path, metadata_file, restart):
+def classify_files(tc, endpoint_id, files, start_file_number, local_path, metadata_file, restart,
+                   stats_file=None, stats_interval=100, vector_writer=None, search_index=None):
     for file_number in range(start_file_number, len(files)):
-        full_file_name = files[file_number]
-        globus_path, file_name = full_file_name.strip().rsplit("/", 1)
-        globus_path += "/"
+        entry = files[file_number]
+        globus_path, file_name = entry["path"], entry["file"]
 
         try:
-            metadata = download_extract_delete(tc, endpoint_id, globus_path, file_name, local_path)
-            metadata_file.write(json.dumps(metadata)+",")
-            print(metadata)
+            metadata = download_extract_delete(tc, endpoint_id, globus_path, file_name, local_path,
+                                               vector_writer=vector_writer,
+                                               checksum=parse_checksum(entry.get("checksum")),
+                                               search_index=search_index)
+            with stats.timer("write", extension=metadata["system"]["extension"], file_class=metadata["class"]):
+                metadata_file.write(json.dumps(metadata)+",")
         except (UnicodeDecodeError, MemoryError, TypeError) as e:
+            stats.count("failures")
             with open(os.path.expanduser("~/Documents/paul/metadata/errors.log"), "a") as error_file:
                 error_file.write(
                     "{}{} :: {}\n{}\n\n".format(globus_path, file_name, str(e), traceback.format_exc()))
 
         with open(restart, "w") as restart_file:
-            restart_file.write("{},{}".format(file_number, full_file_name))
-
-
-# get client
-tc = get_globus_client()
-
-# # activate Petrel endpoint
-# tc.endpoint_autoactivate(PETREL_ID)
-#
-# # activate local endpoint
-# tc.endpoint_autoactivate(LOCAL_ID)
-
-# with open("pub8_list.txt", "w") as f:
-#     write_file_list(tc, PETREL_ID, "/cdiac/cdiac.ornl.gov/pub8/", f)
-
-# csv_writer = csv.writer(open("col_metadata.csv", "a"))
-# csv_writer.writerow([
-#     "path", "file", "column",
-#     "min_1", "min_diff_1", "min_2", "min_diff_1", "min_3",
-#     "max_1", "max_diff_1", "max_2", "max_diff_1", "max_3",
-#     "avg", "mode",
-#     "null"
-# ])
-
-# with open("pub8_list.txt", "r") as file_list:
-#     with open("restart.txt", "a") as restart_file:
-#         write_metadata(tc, PETREL_ID, file_list.readlines(), 0, "/home/paul/", csv_writer, restart_file)
-
-t0 = time.time()
-
-with open(os.path.expanduser("~/Documents/paul/metadata/pub8_list.txt"), "r") as file_list:
-    with open(os.path.expanduser("~/Documents/paul/metadata/metadata.txt"), "a") as metadata_file:
-        # metadata_file.write('{"files":[')
-        classify_files(tc, PETREL_ID, file_list.readlines(), 16482,
-                       os.path.expanduser("~/Documents/paul/metadata/download/"),
-                       metadata_file,
-                       os.path.expanduser("~/Documents/paul/metadata/restart.csv"))
-        metadata_file.seek(-1, 1)
-        metadata_file.write(']}')
-
-t1 = time.time()
-
-print("time taken: {}".format(str(t1 - t0)))
+            restart_file.write("{},{}".format(file_number, full_path(entry)))
+
+        # periodically save stats so that an interrupted run still shows where its time went
+        if stats_file is not None and (file_number - start_file_number) % stats_interval == 0:
+            stats.dump(stats_file)
+
+
+def classify_queued_files(tc, endpoint_id, queue, local_path, batch_size=20, vector_writer=None, search_index=None):
+    """Classify files leased from a shared work queue until it is drained, recording each file's metadata
+    in the queue. Any number of these can run at once, on one host or many, each with its own local path.
+
+        :param tc: (globus_sdk.TransferClient) transfer client
+        :param endpoint_id: (str) endpoint to download from
+        :param queue: (work_queue.WorkQueue) queue of manifest entries
+        :param local_path: (str) local directory to download into, not shared with other workers
+        :param batch_size: (int) number of files to lease at a time
+        :param vector_writer: (text_profile.VectorWriter) writer to save free-text files' vectors with
+        :param search_index: (search_index.SearchIndex) index to add each file's metadata to
+        :returns: ((int, int)) number of files classified and number that failed"""
+
+    def process(entry):
+        return download_extract_delete(tc, endpoint_id, entry["path"], entry["file"], local_path,
+                                       vector_writer=vector_writer, checksum=parse_checksum(entry.get("checksum")),
+                                       search_index=search_index)
+
+    return run_worker(queue, process, batch_size=batch_size)
+
+
+def main():
+    """Classify the files listed in the pub8 manifest, picking up from a restart point, and save their metadata
+    and stats. Nothing is listed, downloaded, or classified until this is called."""
+
+    from text_profile import VectorWriter
+    from search_index import SearchIndex
+    from progress import Progress
+
+    tc = get_globus_client()
+
+    # # activate Petrel endpoint
+    # tc.endpoint_autoactivate(PETREL_ID)
+    #
+    # # activate local endpoint
+    # tc.endpoint_autoactivate(LOCAL_ID)
+
+    # from manifest import ManifestWriter
+    # with open("pub8_manifest.csv", "w") as f:
+    #     write_file_list(tc, PETREL_ID, "/cdiac/cdiac.ornl.gov/pub8/", ManifestWriter(f))
+
+    # csv_writer = csv.writer(open("col_metadata.csv", "a"))
+    # csv_writer.writerow([
+    #     "path", "file", "column",
+    #     "min_1", "min_diff_1", "min_2", "min_diff_1", "min_3",
+    #     "max_1", "max_diff_1", "max_2", "max_diff_1", "max_3",
+    #     "avg", "mode",
+    #     "null"
+    # ])
+
+    # order the manifest by predicted value per byte once, before the run, so restart numbers stay valid:
+    # python scheduler.py pub8_manifest.csv pub8_scheduled.csv --history metadata.txt --budget 500G
+
+    # or, to spread the run over several processes or hosts, queue the manifest and start a worker on each:
+    # python work_queue.py add pub8_queue.db pub8_scheduled.csv
+    # python work_queue.py work pub8_queue.db /home/paul/download/
+    # python work_queue.py export pub8_queue.db metadata.txt
+
+    # with open("pub8_list.txt", "r") as file_list:
+    #     with open("restart.txt", "a") as restart_file:
+    #         write_metadata(tc, PETREL_ID, list(read_manifest(file_list)), 0, "/home/paul/", csv_writer, restart_file)
+
+    t0 = time.time()
+
+    # searchable from the start of the run - query it with: python search_index.py search_index.db --header ...
+    search_index = SearchIndex(os.path.expanduser("~/Documents/paul/metadata/search_index.db"))
+
+    try:
+        with open(os.path.expanduser("~/Documents/paul/metadata/pub8_list.txt"), "r") as file_list:
+            with open(os.path.expanduser("~/Documents/paul/metadata/metadata.txt"), "a") as metadata_file, \
+                    open(os.path.expanduser("~/Documents/paul/metadata/text_vectors.bin"), "ab") as vector_file:
+                # metadata_file.write('{"files":[')
+                files = list(read_manifest(file_list))
+                start_file_number = 16482
+                # a line every minute, and the same numbers at http://localhost:9100/metrics
+                with Progress(total_files=len(files) - start_file_number, interval=60, port=9100):
+                    classify_files(tc, PETREL_ID, files, start_file_number,
+                                   os.path.expanduser("~/Documents/paul/metadata/download/"),
+                                   metadata_file,
+                                   os.path.expanduser("~/Documents/paul/metadata/restart.csv"),
+                                   stats_file=os.path.expanduser("~/Documents/paul/metadata/stats.json"),
+                                   vector_writer=VectorWriter(vector_file), search_index=search_index)
+                metadata_file.seek(-1, 1)
+                metadata_file.write(']}')
+    finally:
+        # keep what was indexed before an interruption
+        search_index.close()
+
+    t1 = time.time()
+
+    print("time taken: {}".format(str(t1 - t0)))
+    stats.dump(os.path.expanduser("~/Documents/paul/metadata/stats.json"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+from __future__ import print_function
+import sys
+import time
+import threading
+from collections import deque
+from instrumentation import stats
+
+try:
+    import BaseHTTPServer as http_server
+except ImportError:
+    import http.server as http_server
+
+
+class Progress:
+    """Reports a run's progress on one line every `interval` seconds, instead of a line per item: files and
+    bytes done and their rates, failures, the depth of any queues being watched, the limits of any adaptive
+    concurrency controllers, and, if the number of files to do is known, the time left. Everything is read
+    from the shared stats that the crawlers and collectors already keep, so reporting costs nothing per item.
+    The same numbers can be served in Prometheus' text format, so that a long run can be watched from a
+    browser or a scraper.
+
+        :param total_files: (int) number of files the run will do, e.g. the manifest's length, or None if unknown
+        :param interval: (float) seconds between reports
+        :param stream: (file) where to write reports
+        :param port: (int) localhost port to serve metrics on at /metrics, or None to not serve them
+        :param window: (float) seconds over which rates are measured"""
+
+    def __init__(self, total_files=None, interval=10.0, stream=sys.stderr, port=None, window=60.0):
+        self.total_files = total_files
+        self.interval = interval
+        self.stream = stream
+        self.port = port
+        self.window = window
+        self.queues = []
+        self.limits = []
+        self.started = None
+        # (time, files, bytes) at each report, for measuring recent rates
+        self.samples = deque()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.server = None
+
+    def watch_queue(self, name, depth):
+        """Include a queue's depth in reports.
+
+            :param name: (str) queue name
+            :param depth: (function) returns the number of items waiting, e.g. Queue.qsize"""
+
+        self.queues.append((name, depth))
+
+    def watch_limit(self, limit):
+        """Include an adaptive concurrency limit in reports.
+
+            :param limit: (concurrency.AdaptiveLimit) limit"""
+
+        self.limits.append(limit)
+
+    def start(self):
+        self.started = time.time()
+        self.samples.append((self.started, self.files_done(), stats.total("bytes")))
+        self.thread = threading.Thread(target=self.report_periodically)
+        self.thread.daemon = True
+        self.thread.start()
+        if self.port is not None:
+            self.server = http_server.HTTPServer(("127.0.0.1", self.port), metrics_handler(self))
+            server_thread = threading.Thread(target=self.server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+
+        return self
+
+    def stop(self):
+        """Stop reporting, after one last report."""
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.report()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def report_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def files_done(self):
+        # files the collectors passed over without downloading are done too
+        return stats.total("files") + stats.total("failures") + stats.total("skipped")
+
+    def status(self):
+        """Measure the run's progress.
+
+            :returns: (dict) "files", "bytes", "failures", "directories", "files_per_second", "bytes_per_second",
+            "elapsed", "eta" (seconds, or None if unknown), "queues" (name -> depth), and "limits" (list of
+            AdaptiveLimit statuses)"""
+
+        now = time.time()
+        files = self.files_done()
+        num_bytes = stats.total("bytes")
+        self.samples.append((now, files, num_bytes))
+        while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+            self.samples.popleft()
+        then, files_then, bytes_then = self.samples[0]
+        elapsed = max(now - then, 1e-6)
+        files_per_second = (files - files_then) / elapsed
+        bytes_per_second = (num_bytes - bytes_then) / elapsed
+
+        eta = None
+        if self.total_files is not None and files_per_second > 0:
+            eta = max(self.total_files - files, 0) / files_per_second
+
+        return {
+            "files": files,
+            "bytes": num_bytes,
+            "failures": stats.total("failures"),
+            "directories": stats.total("directories"),
+            "files_per_second": files_per_second,
+            "bytes_per_second": bytes_per_second,
+            "elapsed": now - (self.started or now),
+            "eta": eta,
+            "queues": dict((name, depth()) for name, depth in self.queues),
+            "limits": [limit.status() for limit in self.limits]
+        }
+
+    def report(self):
+        status = self.status()
+        parts = ["{} files".format(status["files"]) if self.total_files is None else
+                 "{}/{} files".format(status["files"], self.total_files),
+                 "{:.1f} files/s".format(status["files_per_second"]),
+                 "{}/s".format(format_bytes(status["bytes_per_second"])),
+                 "{} failed".format(status["failures"])]
+        if status["directories"] > 0:
+            parts.append("{} directories".format(status["directories"]))
+        for name, depth in sorted(status["queues"].items()):
+            parts.append("{} {} queued".format(depth, name))
+        for limit in status["limits"]:
+            parts.append("{} {}/{} in flight".format(limit["name"], limit["in_flight"], limit["limit"]))
+        parts.append("elapsed {}".format(format_duration(status["elapsed"])))
+        if status["eta"] is not None:
+            parts.append("eta {}".format(format_duration(status["eta"])))
+
+        print(", ".join(parts), file=self.stream)
+        self.stream.flush()
+
+    def metrics(self):
+        """Format the run's progress, and every stats counter and timer, in Prometheus' text format.
+
+            :returns: (str) metrics"""
+
+        status = self.status()
+        summary = stats.summary()
+        lines = []
+        typed = set()
+
+        def add(name, metric_type, value, labels=None):
+            if value is None:
+                return
+            if name not in typed:
+                lines.append("# TYPE {} {}".format(name, metric_type))
+                typed.add(name)
+            label_text = "" if labels is None else "{" + ",".join(
+                '{}="{}"'.format(key, str(label).replace('"', "'")) for key, label in sorted(labels.items())) + "}"
+            lines.append("{}{} {}".format(name, label_text, value))
+
+        add("collector_files_per_second", "gauge", status["files_per_second"])
+        add("collector_bytes_per_second", "gauge", status["bytes_per_second"])
+        add("collector_elapsed_seconds", "gauge", status["elapsed"])
+        add("collector_eta_seconds", "gauge", status["eta"])
+        add("collector_total_files", "gauge", self.total_files)
+        for name, depth in sorted(status["queues"].items()):
+            add("collector_queue_depth", "gauge", depth, {"queue": name})
+        for limit in status["limits"]:
+            for key in ["limit", "in_flight", "operations_per_second", "bytes_per_second", "latency", "errors",
+                        "overloads"]:
+                add("collector_concurrency_" + key, "gauge", limit[key], {"name": limit["name"]})
+        for name, counter in sorted(summary["counters"].items()):
+            add("collector_{}_total".format(name), "counter", counter["total"])
+        for stage, timer in sorted(summary["timers"].items()):
+            add("collector_stage_seconds_total", "counter", timer["total"], {"stage": stage})
+            add("collector_stage_calls_total", "counter", timer["count"], {"stage": stage})
+
+        return "\n".join(lines) + "\n"
+
+
+def metrics_handler(progress):
+    """Make a request handler that serves a Progress' metrics.
+
+        :param progress: (Progress) progress to serve
+        :returns: (class) request handler class"""
+
+    class MetricsHandler(http_server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = progress.metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # requests would otherwise be logged to stderr, between the progress reports
+            pass
+
+    return MetricsHandler
+
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num_bytes) < 1024:
+            return "{:.1f} {}".format(num_bytes, unit)
+        num_bytes /= 1024.0
+
+    return "{:.1f} TB".format(num_bytes)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
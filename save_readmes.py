@@ -1,29 +1,102 @@
+from __future__ import print_function
 import os
+import traceback
 import globus_sdk
 from petrel_metadata_collector import get_globus_client
+from manifest import read_manifest, full_path
+from text_corpus import TextCorpus
+from instrumentation import stats
 
-PETREL_ID = os.environ["PETREL_ID"]
-LOCAL_ID = os.environ["LOCAL_ID"]
-TRANSFER_TOKEN = os.environ["TRANSFER_TOKEN"]
+PETREL_ID = os.environ.get("PETREL_ID")
+LOCAL_ID = os.environ.get("LOCAL_ID")
+TRANSFER_TOKEN = os.environ.get("TRANSFER_TOKEN")
 
 
-def save_readmes(tc, endpoint_id, local_path, files, start_file_number):
-    for i in range(start_file_number, len(files)):
-        full_file_name = files[i]
-        globus_path, file_name = full_file_name.strip().rsplit("/", 1)
-        globus_path += "/"
-        if "readme" in file_name.lower():
-            print("downloading file {}".format(globus_path + file_name))
-            tdata = globus_sdk.TransferData(tc, endpoint_id, LOCAL_ID)
-            tdata.add_item(globus_path + file_name, local_path + file_name + str(i))
+def is_readme(entry):
+    """Determine if a manifest entry is a README.
 
-            result = tc.submit_transfer(tdata)
+        :param entry: (dict) manifest entry
+        :returns: (bool) whether the file is a README"""
+
+    return "readme" in entry["file"].lower()
+
+
+def save_readmes(tc, endpoint_id, local_path, entries, corpus, batch_size=500):
+    """Download every README in a manifest into a text corpus. READMEs are fetched in batches of one Globus
+    transfer each, and paths already in the corpus are skipped, so an interrupted harvest can be run again
+    to pick up where it stopped. Identical READMEs are stored once.
+
+        :param tc: (globus_sdk.TransferClient) transfer client
+        :param endpoint_id: (str) endpoint to download from
+        :param local_path: (str) local directory to download each batch to before it is added to the corpus
+        :param entries: (iterable(dict)) manifest entries - only READMEs are downloaded
+        :param corpus: (text_corpus.TextCorpus) corpus to add READMEs to
+        :param batch_size: (int) number of READMEs per transfer
+        :returns: ((int, int)) number of READMEs saved, and number of those that were new"""
+
+    readmes = [entry for entry in entries if is_readme(entry) and full_path(entry) not in corpus]
+    num_saved = 0
+    num_new = 0
+    # deletes run while the next batch downloads, and are waited for before returning
+    delete_task_ids = []
+
+    for start in range(0, len(readmes), batch_size):
+        batch = readmes[start:start + batch_size]
+        print("downloading READMEs {} to {} of {}".format(start + 1, start + len(batch), len(readmes)))
 
+        # name local copies by position, since READMEs in different directories share names - the batch's start
+        # is part of the name, so that a copy is never a previous batch's file or deleted by its delete task
+        local_names = [local_path + "{}_{}".format(start, i) for i in range(0, len(batch))]
+        tdata = globus_sdk.TransferData(tc, endpoint_id, LOCAL_ID)
+        for local_name, entry in zip(local_names, batch):
+            # a copy left by an interrupted run would be read as if this transfer had written it
+            if os.path.exists(local_name):
+                os.remove(local_name)
+            tdata.add_item(full_path(entry), local_name)
+        with stats.timer("download", extension="readme"):
+            result = tc.submit_transfer(tdata)
             while not tc.task_wait(result["task_id"], polling_interval=1, timeout=60):
-                print("waiting for download: {}".format(globus_path + file_name))
+                print("waiting for batch starting at {}".format(full_path(batch[0])))
+
+        ddata = globus_sdk.DeleteData(tc, LOCAL_ID)
+        for local_name, entry in zip(local_names, batch):
+            try:
+                with open(local_name, "rb") as f:
+                    text = f.read()
+            except IOError as e:
+                # the transfer skipped or failed this file
+                stats.count("failures")
+                with open("errors.log", "a") as error_file:
+                    error_file.write("{} :: {}\n{}\n\n".format(full_path(entry), str(e), traceback.format_exc()))
+                continue
+            with stats.timer("write", extension="readme"):
+                if corpus.add(full_path(entry), text):
+                    num_new += 1
+                    stats.count("bytes", len(text), extension="readme")
+            ddata.add_item(local_name)
+            num_saved += 1
+
+        if len(ddata["DATA"]) > 0:
+            with stats.timer("delete"):
+                delete_task_ids.append(tc.submit_delete(ddata)["task_id"])
+
+    # so that a run started straight after this one can't have its copies deleted under it
+    with stats.timer("delete"):
+        for task_id in delete_task_ids:
+            while not tc.task_wait(task_id, polling_interval=1, timeout=60):
+                pass
+
+    print("saved {} READMEs, {} of them not already in the corpus".format(num_saved, num_new))
+
+    return num_saved, num_new
 
 
-tc = get_globus_client()
+if __name__ == "__main__":
+    tc = get_globus_client()
 
-with open("pub8_list.txt", "r") as file_list:
-    save_readmes(tc, PETREL_ID, "/home/paul/", file_list.readlines(), 3066)
+    with open("pub8_list.txt", "r") as file_list:
+        corpus = TextCorpus(os.path.expanduser("~/Documents/paul/metadata/readmes.z"))
+        try:
+            save_readmes(tc, PETREL_ID, "/home/paul/readmes/", read_manifest(file_list), corpus)
+        finally:
+            corpus.close()
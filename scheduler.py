@@ -0,0 +1,215 @@
+from __future__ import print_function
+import json
+import argparse
+from manifest import ManifestWriter, read_manifest
+
+# prior probability that a file with this extension yields metadata, before any history is seen
+extension_priors = {
+    "csv": 0.9, "CSV": 0.9, "txt": 0.7, "TXT": 0.7, "dat": 0.8, "tsv": 0.9, "prn": 0.6, "nc": 0.95,
+    "exc.csv": 0.9, "pdf": 0.0, "PDF": 0.0, "jpg": 0.0, "JPG": 0.0, "jpeg": 0.0, "png": 0.0, "gif": 0.0,
+    "DS_Store": 0.0, "ps": 0.0, "eps": 0.0, "doc": 0.0, "docx": 0.0, "exe": 0.0, "m": 0.0,
+    "zip": 0.5, "gz": 0.5, "tar.gz": 0.5, "tgz": 0.5, "Z": 0.5, "tar.Z": 0.5, "xls": 0.6, "XLS": 0.6, "xlsx": 0.6,
+    "xml": 0.8
+}
+
+# prior for extensions that aren't in extension_priors
+default_prior = 0.3
+
+# how many observations the prior is worth when combined with history
+prior_weight = 5
+
+
+def read_metadata_output(metadata_file, chunk_size=1024 * 1024):
+    """Stream the records of a collector's metadata output - comma-separated JSON objects, optionally
+    wrapped in '{"files":[' - without reading the whole file into memory. A record cut off by an
+    interrupted run ends the stream.
+
+        :param metadata_file: (file) open metadata output
+        :param chunk_size: (int) number of bytes read at a time
+        :returns: (generator(dict)) records"""
+
+    decoder = json.JSONDecoder()
+    wrapper = '{"files":['
+    text = metadata_file.read(max(chunk_size, len(wrapper)))
+    is_last = len(text) < max(chunk_size, len(wrapper))
+    # skip the wrapper that a completed run writes around its objects
+    position = len(wrapper) if text.startswith(wrapper) else 0
+
+    while True:
+        # skip separators between objects
+        while position < len(text) and text[position] in ',[]} \r\n\t':
+            position += 1
+        if position == len(text) and is_last:
+            break
+        try:
+            if position == len(text):
+                raise ValueError
+            record, position = decoder.raw_decode(text, position)
+        except ValueError:
+            if is_last:
+                # a truncated final object from an interrupted run
+                break
+            chunk = metadata_file.read(chunk_size)
+            is_last = len(chunk) < chunk_size
+            text = text[position:] + chunk
+            position = 0
+            continue
+        yield record
+
+
+def load_class_history(metadata_files):
+    """Count, for each extension, how many files were seen and how many yielded metadata, from the
+    metadata output of previous runs (comma-separated JSON objects, optionally wrapped in '{"files":[').
+
+        :param metadata_files: (list(str)) paths of metadata files written by earlier runs
+        :returns: (dict) extension -> [number of files seen, number of files classified as anything but unknown]"""
+
+    history = {}
+
+    for metadata_file in metadata_files:
+        with open(metadata_file) as f:
+            for metadata in read_metadata_output(f):
+                if "system" in metadata:
+                    # written by petrel_metadata_collector
+                    update_history(history, metadata["system"]["extension"], metadata["class"])
+                elif "type" in metadata:
+                    # written by ftp_metadata_collector
+                    update_history(history, metadata["type"],
+                                   metadata.get("content_metadata", {}).get("class", "unknown"))
+
+    return history
+
+
+def update_history(history, extension, file_class):
+    """Add a classified file to the extension history.
+
+        :param history: (dict) extension history to update
+        :param extension: (str) file extension
+        :param file_class: (str) class the file was given"""
+
+    counts = history.setdefault(extension, [0, 0])
+    counts[0] += 1
+    if file_class != "unknown":
+        counts[1] += 1
+
+
+def yield_probability(extension, history):
+    """Estimate the probability that a file with an extension yields metadata, combining the
+    extension's prior with its history.
+
+        :param extension: (str) file extension
+        :param history: (dict) extension history from load_class_history
+        :returns: (float) probability between 0 and 1"""
+
+    prior = extension_priors.get(extension, default_prior)
+    seen, yielded = history.get(extension, [0, 0])
+
+    return (yielded + prior * prior_weight) / float(seen + prior_weight)
+
+
+def schedule(entries, history=None, byte_budget=None, per_file_overhead=64 * 1024, unknown_size=1024 * 1024,
+             skip_threshold=0.01, defer_threshold=0.1, min_observations=20):
+    """Order manifest entries by predicted value per byte, so that small files likely to yield
+    metadata come first and large or unpromising files come last or not at all.
+
+    Extensions that have been seen at least `min_observations` times without ever yielding metadata,
+    or whose estimated yield is below `skip_threshold`, are skipped, as are files whose checksum matches
+    a file already scheduled. Extensions with an estimated yield
+    below `defer_threshold` are deferred until after everything else. If a byte budget is given, files
+    that would exceed it are skipped, while smaller files further down the order may still fit.
+
+        :param entries: (iterable(dict)) manifest entries
+        :param history: (dict) extension history from load_class_history
+        :param byte_budget: (int) maximum total bytes to download, or None for no limit
+        :param per_file_overhead: (int) fixed cost of fetching any file, expressed in bytes
+        :param unknown_size: (int) size assumed for entries whose size isn't in the manifest
+        :param skip_threshold: (float) estimated yield below which extensions are skipped
+        :param defer_threshold: (float) estimated yield below which extensions are deferred
+        :param min_observations: (int) number of files of an extension that must have been seen without
+        any yielding metadata before the extension is skipped
+        :returns: ((list(dict), list(dict))) scheduled entries in order, and skipped entries, each with
+        "score" and "reason" keys added"""
+
+    history = history if history is not None else {}
+    probabilities = {}
+    checksums = set()
+    scheduled = []
+    deferred = []
+    skipped = []
+
+    for entry in entries:
+        extension = entry["extension"]
+        if extension not in probabilities:
+            probabilities[extension] = yield_probability(extension, history)
+        probability = probabilities[extension]
+        seen, yielded = history.get(extension, [0, 0])
+        size = entry["size"] if entry["size"] is not None else unknown_size
+
+        entry = dict(entry, score=probability / (size + per_file_overhead))
+        if probability < skip_threshold or seen >= min_observations and yielded == 0:
+            entry["reason"] = "never yields metadata"
+            skipped.append(entry)
+        elif entry.get("checksum") is not None and entry["checksum"] in checksums:
+            entry["reason"] = "duplicate checksum"
+            skipped.append(entry)
+        elif probability < defer_threshold:
+            deferred.append(entry)
+        else:
+            scheduled.append(entry)
+        if entry.get("checksum") is not None:
+            checksums.add(entry["checksum"])
+
+    scheduled.sort(key=lambda e: e["score"], reverse=True)
+    deferred.sort(key=lambda e: e["score"], reverse=True)
+
+    ordered = []
+    total_bytes = 0
+    for entry in scheduled + deferred:
+        size = entry["size"] if entry["size"] is not None else unknown_size
+        if byte_budget is not None and total_bytes + size > byte_budget:
+            entry["reason"] = "over byte budget"
+            skipped.append(entry)
+            continue
+        total_bytes += size
+        ordered.append(entry)
+
+    return ordered, skipped
+
+
+def parse_bytes(value):
+    """Parse a byte count like "500M" or "10G".
+
+        :param value: (str) byte count, optionally suffixed with K, M, G, or T
+        :returns: (int) number of bytes"""
+
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    value = value.strip().upper().rstrip("B")
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Order a manifest by predicted metadata value per byte.")
+    parser.add_argument("manifest", help="manifest, catalog, or path list to schedule")
+    parser.add_argument("output", help="file to write the scheduled manifest to")
+    parser.add_argument("--history", action="append", default=[],
+                        help="metadata output of a previous run (may be given more than once)")
+    parser.add_argument("--budget", type=parse_bytes, default=None, help="total bytes to download, e.g. 50G")
+    args = parser.parse_args()
+
+    with open(args.manifest) as manifest_file:
+        ordered, skipped = schedule(read_manifest(manifest_file), load_class_history(args.history),
+                                    byte_budget=args.budget)
+
+    with open(args.output, "w") as output_file:
+        writer = ManifestWriter(output_file)
+        for entry in ordered:
+            writer.write(entry["file"], entry["path"], entry["size"], entry["modified"], entry["checksum"])
+
+    reasons = {}
+    for entry in skipped:
+        reasons[entry["reason"]] = reasons.get(entry["reason"], 0) + 1
+    print("scheduled {} files, skipped {}".format(
+        len(ordered), ", ".join(["{} ({})".format(count, reason) for reason, count in reasons.items()]) or 0))
@@ -0,0 +1,237 @@
+from __future__ import print_function
+import re
+import sys
+import math
+import time
+import sqlite3
+import argparse
+
+# words of a preamble worth indexing - runs of three or more letters, in any script
+term_pattern = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+
+# kinds of term that are indexed, and so can be searched for
+fields = ["header", "column", "variable", "dimension", "attribute", "preamble", "keyword"]
+
+# netCDF variable and dimension keys that describe the array rather than name one of its attributes
+array_keys = ["type", "size", "dimensions"]
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, class TEXT);
+CREATE TABLE IF NOT EXISTS postings (field TEXT NOT NULL, term TEXT NOT NULL, file INTEGER NOT NULL,
+                                     PRIMARY KEY (field, term, file)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+CREATE TABLE IF NOT EXISTS ranges (file INTEGER NOT NULL, name TEXT NOT NULL, low REAL NOT NULL, high REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS ranges_name ON ranges (name, low);
+CREATE INDEX IF NOT EXISTS ranges_low ON ranges (low);
+CREATE INDEX IF NOT EXISTS ranges_file ON ranges (file);
+"""
+
+
+class SearchIndex:
+    """Inverted index over extracted metadata, kept in a SQLite file: postings from the headers, column
+    aliases, netCDF variable, dimension, and attribute names, preamble words, and keywords of each file to
+    the file, and the range of values of each numeric column, so that files can be found by what they
+    contain without reading their metadata again. Files can be added one at a time as they are extracted,
+    and adding a file that is already indexed replaces it.
+
+        :param path: (str) index file path - created if it doesn't exist
+        :param batch_size: (int) number of files added between commits"""
+
+    def __init__(self, path, batch_size=1000):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+        self.batch_size = batch_size
+        self.num_uncommitted = 0
+
+    def add(self, path, metadata, file_class=None):
+        """Index a file's metadata, replacing anything already indexed for its path.
+
+            :param path: (str) full path of the file
+            :param metadata: (dict) metadata from extract_metadata or one of the extractors, before it is
+            reduced to what the collectors write out
+            :param file_class: (str) file class, or None to take it from the metadata"""
+
+        terms = set()
+        ranges = []
+        index_metadata(metadata, terms, ranges)
+
+        cursor = self.connection.cursor()
+        path = to_unicode(path)
+        cursor.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (path,))
+        cursor.execute("SELECT id FROM files WHERE path = ?", (path,))
+        file_id = cursor.fetchone()[0]
+        cursor.execute("UPDATE files SET class = ? WHERE id = ?", (file_class or metadata.get("class"), file_id))
+        cursor.execute("DELETE FROM postings WHERE file = ?", (file_id,))
+        cursor.execute("DELETE FROM ranges WHERE file = ?", (file_id,))
+        cursor.executemany("INSERT INTO postings (field, term, file) VALUES (?, ?, ?)",
+                           [(field, term, file_id) for field, term in terms])
+        cursor.executemany("INSERT INTO ranges (file, name, low, high) VALUES (?, ?, ?, ?)",
+                           [(file_id, name, low, high) for name, low, high in ranges])
+
+        self.num_uncommitted += 1
+        if self.num_uncommitted >= self.batch_size:
+            self.commit()
+
+    def search(self, terms=None, ranges=None, file_class=None, limit=None):
+        """Find the files that match every condition given. Terms ending in '*' match any term with that
+        prefix, and terms and range names match regardless of case.
+
+            :param terms: (list((str, str))) field from `fields` and term, e.g. ("header", "temperature")
+            :param ranges: (list((str, float, float))) column or variable name, or '*' for any, and the
+            lowest and highest value of interest, either of which may be None - a file matches if the
+            column's values overlap the range
+            :param file_class: (str) file class that matching files must have
+            :param limit: (int) maximum number of files to return, or None for all
+            :returns: (list((str, str))) path and class of each matching file"""
+
+        conditions = []
+        parameters = []
+
+        for field, term in terms or []:
+            if field not in fields:
+                raise ValueError("can't search by {}, only {}".format(field, ", ".join(fields)))
+            term = normalize_term(term)
+            if term.endswith("*"):
+                prefix = term[:-1]
+                # every term with the prefix sorts before the prefix with its last character incremented
+                end = prefix[:-1] + unichr(ord(prefix[-1]) + 1) if prefix != u"" else u"\uffff"
+                conditions.append("id IN (SELECT file FROM postings WHERE field = ? AND term >= ? AND term < ?)")
+                parameters.extend([field, prefix, end])
+            else:
+                conditions.append("id IN (SELECT file FROM postings WHERE field = ? AND term = ?)")
+                parameters.extend([field, term])
+
+        for name, low, high in ranges or []:
+            range_conditions = []
+            if name != "*":
+                range_conditions.append("name = ?")
+                parameters.append(normalize_term(name))
+            if high is not None:
+                range_conditions.append("low <= ?")
+                parameters.append(high)
+            if low is not None:
+                range_conditions.append("high >= ?")
+                parameters.append(low)
+            conditions.append("id IN (SELECT file FROM ranges WHERE {})".format(
+                " AND ".join(range_conditions or ["1"])))
+
+        if file_class is not None:
+            conditions.append("class = ?")
+            parameters.append(file_class)
+
+        query = "SELECT path, class FROM files WHERE {} ORDER BY path".format(" AND ".join(conditions or ["1"]))
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+
+        return self.connection.execute(query, parameters).fetchall()
+
+    def commit(self):
+        self.connection.commit()
+        self.num_uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def index_metadata(metadata, terms, ranges):
+    """Collect the searchable terms and numeric ranges of a file's metadata, including those of its
+    tables, spreadsheet sheets, and archive members.
+
+        :param metadata: (dict) metadata dictionary
+        :param terms: (set((str, str))) field and term pairs to add to
+        :param ranges: (list((str, float, float))) column or variable names and value ranges to add to"""
+
+    # the top-level columns and headers repeat the last table's
+    for table in metadata.get("tables", [metadata]):
+        for header in table.get("headers", []):
+            terms.add(("header", normalize_term(header)))
+        for name, column in table.get("columns", {}).items():
+            terms.add(("column", normalize_term(name)))
+            low = [value for value in column.get("min", []) if is_finite(value)]
+            high = [value for value in column.get("max", []) if is_finite(value)]
+            if len(low) > 0 and len(high) > 0:
+                ranges.append((normalize_term(name), min(low), max(high)))
+
+    for sheet in metadata.get("sheets", {}).values():
+        index_metadata(sheet, terms, ranges)
+    for member in metadata.get("members", []):
+        index_metadata(member, terms, ranges)
+
+    for field, key in [("variable", "variables"), ("dimension", "dimensions")]:
+        for name, attributes in metadata.get(key, {}).items():
+            terms.add((field, normalize_term(name)))
+            for attribute in attributes:
+                if attribute not in array_keys:
+                    terms.add(("attribute", normalize_term(attribute)))
+            if is_finite(attributes.get("valid_min")) and is_finite(attributes.get("valid_max")):
+                ranges.append((normalize_term(name), attributes["valid_min"], attributes["valid_max"]))
+    # netCDF global attributes, and xml attribute names
+    for key in ["global_attributes", "attributes"]:
+        for attribute in metadata.get(key, {}):
+            terms.add(("attribute", normalize_term(attribute)))
+
+    if "preamble" in metadata:
+        for term in term_pattern.findall(to_unicode(metadata["preamble"]).lower()):
+            terms.add(("preamble", term))
+    for keyword in metadata.get("text_profile", {}).get("keywords", []) + metadata.get("keywords", []):
+        terms.add(("keyword", normalize_term(keyword)))
+
+
+def normalize_term(term):
+    """Put a term in the form it is indexed and searched in - lowercase with single spaces.
+
+        :param term: (str) term
+        :returns: (unicode) normalized term"""
+
+    return u" ".join(to_unicode(term).lower().split())
+
+
+def to_unicode(text):
+    if isinstance(text, bytes):
+        return text.decode("utf-8", "replace")
+
+    return unicode(text)
+
+
+def is_finite(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool) and not math.isinf(value) \
+        and not math.isnan(value)
+
+
+def parse_range(value):
+    """Parse a range argument like "temperature:-10:40", where either bound may be left out.
+
+        :param value: (str) name, lowest value, and highest value, separated by ':'
+        :returns: ((str, float, float)) name and bounds, None where left out"""
+
+    name, low, high = value.rsplit(":", 2)
+
+    return name, float(low) if low != "" else None, float(high) if high != "" else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the files in a search index of extracted metadata that "
+                                                 "match every condition given.")
+    parser.add_argument("index", help="index file")
+    for field in fields:
+        parser.add_argument("--" + field, action="append", default=[],
+                            help="{} term, optionally ending in '*' (may be given more than once)".format(field))
+    parser.add_argument("--range", action="append", default=[], type=parse_range,
+                        help="column or variable whose values overlap a range, e.g. temperature:-10:40 or "
+                             "'*:1000:' for any column (may be given more than once)")
+    parser.add_argument("--class", dest="file_class", default=None, help="file class, e.g. columnar")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    index = SearchIndex(args.index)
+    try:
+        t0 = time.time()
+        terms = [(field, term) for field in fields for term in getattr(args, field)]
+        matches = index.search(terms, args.range, file_class=args.file_class, limit=args.limit)
+        for path, file_class in matches:
+            print("{}\t{}".format(path, file_class))
+        print("{} files in {:.1f} ms".format(len(matches), 1000 * (time.time() - t0)), file=sys.stderr)
+    finally:
+        index.close()
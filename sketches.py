@@ -0,0 +1,372 @@
+import math
+import zlib
+import base64
+import random
+import struct
+from hashlib import md5
+
+
+class QuantileSketch:
+    """Estimates quantiles of a stream of numbers in fixed memory, to within a relative error, by counting
+    values in logarithmically sized buckets. Sketches of different streams can be merged, and the result is
+    the same as if one sketch had seen both streams, so sketches can be built in pieces and combined later.
+
+        :param relative_accuracy: (float) maximum error of an estimate, relative to the true quantile
+        :param max_buckets: (int) maximum number of buckets kept for each sign - once exceeded, the buckets
+        closest to zero are merged, so only the smallest magnitudes lose accuracy"""
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # bucket index -> number of values, for values above and below zero
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket(self, magnitude):
+        return int(math.ceil(math.log(magnitude) / self.log_gamma))
+
+    def add(self, value, count=1):
+        """Add a value to the sketch.
+
+            :param value: (float) value
+            :param count: (int) number of times to add it"""
+
+        if value > 0:
+            index = self.bucket(value)
+            self.positive[index] = self.positive.get(index, 0) + count
+            if len(self.positive) > self.max_buckets:
+                collapse(self.positive, self.max_buckets)
+        elif value < 0:
+            index = self.bucket(-value)
+            self.negative[index] = self.negative.get(index, 0) + count
+            if len(self.negative) > self.max_buckets:
+                collapse(self.negative, self.max_buckets)
+        else:
+            self.zeros += count
+
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add every value another sketch has seen to this one.
+
+            :param other: (QuantileSketch) sketch with the same relative accuracy"""
+
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("can't merge sketches with relative accuracies {} and {}".format(
+                self.relative_accuracy, other.relative_accuracy))
+        if other.count == 0:
+            return
+
+        for buckets, other_buckets in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for index, count in other_buckets.iteritems():
+                buckets[index] = buckets.get(index, 0) + count
+            if len(buckets) > self.max_buckets:
+                collapse(buckets, self.max_buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        """Estimate a quantile of the values seen.
+
+            :param q: (float) quantile between 0 and 1, e.g. 0.5 for the median
+            :returns: (float) estimate, or None if no values have been seen"""
+
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = 0
+        # walk from the most negative value up
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                # a bucket's point may lie just beyond the values actually seen
+                return min(max(-self.value(index), self.min), self.max)
+        seen += self.zeros
+        if seen > rank:
+            return 0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(max(self.value(index), self.min), self.max)
+
+        return self.max
+
+    def value(self, index):
+        # the point of a bucket with the smallest relative error to anything in it
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def to_dict(self):
+        """Serialize the sketch so that it can be saved as JSON and merged later.
+
+            :returns: (dict) sketch"""
+
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_buckets": self.max_buckets,
+            "positive": {str(index): count for index, count in self.positive.iteritems()},
+            "negative": {str(index): count for index, count in self.negative.iteritems()},
+            "zeros": self.zeros,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max
+        }
+
+
+class KLLSketch:
+    """Estimates quantiles of a stream of numbers in fixed memory, to within a rank error - the estimate of a
+    quantile q lies between the true quantiles q - e and q + e, with e about 1.7 / k - however far the values
+    are from zero or however close together. QuantileSketch's relative error suits file sizes, which span many
+    orders of magnitude, but not columns like years or concentrations, whose values all sit in one or two of
+    its buckets. Values are kept in levels, each weighing twice the one below, and a full level is sorted and
+    every other value of it promoted to the next. Sketches can be merged, like QuantileSketch.
+
+        :param k: (int) capacity of the top level - the sketch keeps about 3 * k values"""
+
+    def __init__(self, k=200):
+        self.k = k
+        self.levels = [[]]
+        # number of values kept, and the most that can be kept before a level is compacted
+        self.size = 0
+        self.max_size = self.capacity(0)
+        self.count = 0
+        self.min = None
+        self.max = None
+        # which half of a full level is promoted is picked at random, so that errors cancel out - seeded,
+        # so that the same values always give the same estimates
+        self.random = random.Random(0)
+
+    def capacity(self, level):
+        # lower levels are smaller, by a factor of 2/3 for each level below the top
+        return max(2, int(math.ceil(self.k * (2.0 / 3) ** (len(self.levels) - 1 - level))))
+
+    def add(self, value):
+        """Add a value to the sketch.
+
+            :param value: (float) value"""
+
+        self.levels[0].append(value)
+        self.size += 1
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        # only once the sketch as a whole is full is a level compacted - the lowest that is over its capacity -
+        # so that the small bottom levels of a tall sketch aren't sorted every few values
+        while self.size >= self.max_size:
+            for level in range(0, len(self.levels)):
+                if len(self.levels[level]) >= self.capacity(level):
+                    if level + 1 == len(self.levels):
+                        self.levels.append([])
+                    values = sorted(self.levels[level])
+                    # an odd value out stays where it is, so no weight is lost
+                    self.levels[level] = [values.pop()] if len(values) % 2 == 1 else []
+                    self.levels[level + 1].extend(values[self.random.randint(0, 1)::2])
+                    break
+            self.size = sum(len(values) for values in self.levels)
+            self.max_size = sum(self.capacity(level) for level in range(0, len(self.levels)))
+
+    def merge(self, other):
+        """Add every value another sketch has seen to this one.
+
+            :param other: (KLLSketch) sketch"""
+
+        if other.count == 0:
+            return
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.size = sum(len(values) for values in self.levels)
+        self.max_size = sum(self.capacity(level) for level in range(0, len(self.levels)))
+        self.compress()
+
+    def quantile(self, q):
+        """Estimate a quantile of the values seen.
+
+            :param q: (float) quantile between 0 and 1, e.g. 0.5 for the median
+            :returns: (float) estimate, or None if no values have been seen"""
+
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        weighted = sorted((value, 2 ** level) for level, values in enumerate(self.levels) for value in values)
+        total = sum(weight for value, weight in weighted)
+        rank = q * (total - 1)
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen > rank:
+                return value
+
+        return self.max
+
+    def to_dict(self):
+        """Serialize the sketch so that it can be saved as JSON and merged later.
+
+            :returns: (dict) sketch"""
+
+        return {
+            "k": self.k,
+            "levels": self.levels,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max
+        }
+
+
+class HyperLogLog:
+    """Estimates the number of distinct values in a stream in fixed memory - one byte per register, with a
+    standard error of about 1.04 / sqrt(registers). Like QuantileSketch, sketches of different streams can be
+    merged into the sketch of both, so a count can be built in pieces and combined later. Adding a value that
+    was already added changes nothing, so a value only needs to be added the first time it is seen.
+
+        :param precision: (int) number of bits of each value's hash used to pick its register - there are
+        2 ** precision registers"""
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+
+    def add(self, value):
+        """Add a value to the sketch.
+
+            :param value: (str) value"""
+
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        # 64 bits of hash leave enough for any count without correcting for collisions
+        hashed = struct.unpack("<Q", md5(value).digest()[:8])[0]
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        # position of the first 1 bit in what is left of the hash
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Add every value another sketch has seen to this one.
+
+            :param other: (HyperLogLog) sketch with the same precision"""
+
+        if other.precision != self.precision:
+            raise ValueError("can't merge sketches with precisions {} and {}".format(self.precision, other.precision))
+
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        """Estimate the number of distinct values seen.
+
+            :returns: (int) estimate"""
+
+        alpha = 0.7213 / (1 + 1.079 / self.num_registers)
+        estimate = alpha * self.num_registers ** 2 / sum(2.0 ** -register for register in self.registers)
+        num_zeros = self.registers.count(b"\x00")
+        # small counts leave registers empty, and are estimated better from how many
+        if estimate <= 2.5 * self.num_registers and num_zeros > 0:
+            estimate = self.num_registers * math.log(float(self.num_registers) / num_zeros)
+
+        return int(round(estimate))
+
+    def to_dict(self):
+        """Serialize the sketch so that it can be saved as JSON and merged later.
+
+            :returns: (dict) sketch"""
+
+        # the registers of small counts are mostly empty, and compress to little
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(zlib.compress(bytes(self.registers)))
+        }
+
+
+def collapse(buckets, max_buckets):
+    """Merge the buckets closest to zero until no more than `max_buckets` are left.
+
+        :param buckets: (dict) bucket index -> count, changed in place
+        :param max_buckets: (int) number of buckets to keep"""
+
+    indices = sorted(buckets)
+    excess = indices[:len(indices) - max_buckets + 1]
+    buckets[excess[-1]] = sum(buckets.pop(index) for index in excess)
+
+
+def load_sketch(data):
+    """Load a sketch serialized by QuantileSketch.to_dict.
+
+        :param data: (dict) serialized sketch
+        :returns: (QuantileSketch) sketch"""
+
+    sketch = QuantileSketch(relative_accuracy=data["relative_accuracy"], max_buckets=data["max_buckets"])
+    sketch.positive = {int(index): count for index, count in data["positive"].iteritems()}
+    sketch.negative = {int(index): count for index, count in data["negative"].iteritems()}
+    sketch.zeros = data["zeros"]
+    sketch.count = data["count"]
+    sketch.total = data["total"]
+    sketch.min = data["min"]
+    sketch.max = data["max"]
+
+    return sketch
+
+
+def load_hyperloglog(data):
+    """Load a sketch serialized by HyperLogLog.to_dict.
+
+        :param data: (dict) serialized sketch
+        :returns: (HyperLogLog) sketch"""
+
+    sketch = HyperLogLog(precision=data["precision"])
+    sketch.registers = bytearray(zlib.decompress(base64.b64decode(data["registers"])))
+
+    return sketch
+
+
+def load_kll(data):
+    """Load a sketch serialized by KLLSketch.to_dict.
+
+        :param data: (dict) serialized sketch
+        :returns: (KLLSketch) sketch"""
+
+    sketch = KLLSketch(k=data["k"])
+    sketch.levels = [list(values) for values in data["levels"]]
+    sketch.size = sum(len(values) for values in sketch.levels)
+    sketch.max_size = sum(sketch.capacity(level) for level in range(0, len(sketch.levels)))
+    sketch.count = data["count"]
+    sketch.min = data["min"]
+    sketch.max = data["max"]
+
+    return sketch
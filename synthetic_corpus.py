@@ -0,0 +1,333 @@
+from __future__ import print_function
+import os
+import gzip
+import json
+import random
+import zipfile
+import argparse
+from io import BytesIO
+from datetime import datetime
+
+# words used to build free text, preambles, and string-valued columns
+vocabulary = [
+    "carbon", "dioxide", "ocean", "surface", "temperature", "salinity", "station", "cruise",
+    "measurement", "atmospheric", "emission", "methane", "concentration", "sample", "depth",
+    "instrument", "calibration", "data", "set", "analysis", "global", "regional", "flux",
+    "the", "of", "and", "in", "was", "were", "from", "with", "for", "each", "by", "at"
+]
+
+
+def write_tall_csv(path, rng, num_rows=50000, num_cols=6):
+    """Write a long, narrow comma-separated file with a single header row.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :param num_cols: (int) number of columns
+        :returns: (int) number of value rows written"""
+
+    with open(path, "w") as f:
+        f.write(",".join(["col_{}".format(i) for i in range(0, num_cols)]) + "\n")
+        for i in range(0, num_rows):
+            f.write(",".join(["{:.3f}".format(rng.uniform(-100, 100)) for _ in range(0, num_cols)]) + "\n")
+
+    return num_rows
+
+
+def write_wide_csv(path, rng, num_rows=2000, num_cols=200):
+    """Write a short, wide comma-separated file with a single header row.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :param num_cols: (int) number of columns
+        :returns: (int) number of value rows written"""
+
+    return write_tall_csv(path, rng, num_rows=num_rows, num_cols=num_cols)
+
+
+def write_whitespace_dat(path, rng, num_rows=20000, num_cols=8):
+    """Write a whitespace-delimited, fixed-width file like the CDIAC .dat files.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :param num_cols: (int) number of columns
+        :returns: (int) number of value rows written"""
+
+    with open(path, "w") as f:
+        f.write("Year" + "".join(["{:>16}".format("var_{}".format(i)) for i in range(1, num_cols)]) + "\n")
+        for i in range(0, num_rows):
+            f.write("{:<4}".format(1700 + i) +
+                    "".join(["{:>16.1f}".format(rng.uniform(0, 500)) for _ in range(1, num_cols)]) + "\n")
+
+    return num_rows
+
+
+def write_preamble_dat(path, rng, num_rows=5000, num_cols=5, preamble_lines=40):
+    """Write a whitespace-delimited table preceded by a free-text preamble.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :param num_cols: (int) number of columns
+        :param preamble_lines: (int) number of lines of free text before the table
+        :returns: (int) number of value rows written"""
+
+    with open(path, "w") as f:
+        for _ in range(0, preamble_lines):
+            f.write("*** " + " ".join([rng.choice(vocabulary) for _ in range(0, 8)]) + " ***\n")
+        f.write("\n")
+        f.write("".join(["{:>12}".format("v{}".format(i)) for i in range(0, num_cols)]) + "\n")
+        for _ in range(0, num_rows):
+            f.write("".join(["{:>12.2f}".format(rng.uniform(0, 50)) for _ in range(0, num_cols)]) + "\n")
+
+    return num_rows
+
+
+def write_multiple_headers_csv(path, rng, num_rows=5000, num_cols=10):
+    """Write a comma-separated file with a header row followed by a units row.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :param num_cols: (int) number of columns
+        :returns: (int) number of value rows written"""
+
+    with open(path, "w") as f:
+        f.write(",".join(["NAME_{}".format(i) for i in range(0, num_cols)]) + "\n")
+        f.write(",".join([rng.choice(["DBAR", "UMOL/KG", "ITS-90", ""]) for _ in range(0, num_cols)]) + "\n")
+        for _ in range(0, num_rows):
+            f.write(",".join(["{:.4f}".format(rng.gauss(10, 3)) for _ in range(0, num_cols)]) + "\n")
+
+    return num_rows
+
+
+def write_high_cardinality_csv(path, rng, num_rows=30000):
+    """Write a comma-separated file whose columns are almost all distinct values,
+    which stresses the per-column frequency dictionaries.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :returns: (int) number of value rows written"""
+
+    with open(path, "w") as f:
+        f.write("id,value,label\n")
+        for i in range(0, num_rows):
+            f.write("{},{:.6f},{}{}\n".format(i, rng.random(), rng.choice(vocabulary), i))
+
+    return num_rows
+
+
+def write_free_text(path, rng, num_words=20000):
+    """Write an abstract-like free-text file.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_words: (int) number of words
+        :returns: (int) number of lines written"""
+
+    num_lines = 0
+    with open(path, "w") as f:
+        for _ in range(0, num_words, 12):
+            f.write(" ".join([rng.choice(vocabulary) for _ in range(0, 12)]) + ".\n")
+            num_lines += 1
+
+    return num_lines
+
+
+def write_netcdf(path, rng, num_times=2000, num_lats=20, num_lons=20):
+    """Write a small netCDF file with a few gridded variables.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_times: (int) length of time dimension
+        :param num_lats: (int) length of latitude dimension
+        :param num_lons: (int) length of longitude dimension
+        :returns: (int) number of records along the unlimited dimension"""
+
+    import numpy
+    from netCDF4 import Dataset
+
+    dataset = Dataset(path, "w", format="NETCDF3_CLASSIC")
+    try:
+        dataset.title = "synthetic benchmark dataset"
+        dataset.createDimension("time", None)
+        dataset.createDimension("lat", num_lats)
+        dataset.createDimension("lon", num_lons)
+        time = dataset.createVariable("time", "f8", ("time",))
+        time.units = "days since 1900-01-01"
+        for name in ["sst", "sal"]:
+            var = dataset.createVariable(name, "f4", ("time", "lat", "lon"))
+            var.long_name = name
+            numpy_rng = numpy.random.RandomState(rng.randint(0, 2 ** 31 - 1))
+            var[:] = numpy_rng.uniform(0, 40, (num_times, num_lats, num_lons))
+        time[:] = numpy.arange(0, num_times)
+    finally:
+        dataset.close()
+
+    return num_times
+
+
+def write_xlsx(path, rng, num_rows=20000, num_cols=6):
+    """Write an Excel workbook with one sheet of numbers under a single header row. Its timestamps are fixed,
+    so that the same rows always make the same file.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :param num_cols: (int) number of columns
+        :returns: (int) number of value rows written"""
+
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    workbook.properties.created = workbook.properties.modified = datetime(2000, 1, 1)
+    sheet = workbook.create_sheet("data")
+    sheet.append(["col_{}".format(i) for i in range(0, num_cols)])
+    for i in range(0, num_rows):
+        sheet.append([round(rng.uniform(-100, 100), 3) for _ in range(0, num_cols)])
+    workbook_bytes = BytesIO()
+    workbook.save(workbook_bytes)
+
+    with zipfile.ZipFile(workbook_bytes) as workbook_zip:
+        write_zip(path, [(name, workbook_zip.read(name)) for name in workbook_zip.namelist()])
+
+    return num_rows
+
+
+def write_xml(path, rng, num_records=5000):
+    """Write an xml file of records with attributes and child elements, followed by the title, abstract, and
+    keywords that describe them, so that the whole file is parsed before the descriptive text is found.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_records: (int) number of record elements
+        :returns: (int) number of record elements written"""
+
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<dataset xmlns="http://example.org/synthetic">\n')
+        for i in range(0, num_records):
+            f.write('  <record id="{}" station="{}">\n'.format(i, rng.choice(vocabulary)))
+            for name in ["temperature", "salinity", "depth"]:
+                f.write('    <{0} units="si">{1:.3f}</{0}>\n'.format(name, rng.uniform(-100, 100)))
+            f.write('  </record>\n')
+        f.write("  <title>{}</title>\n".format(" ".join([rng.choice(vocabulary) for _ in range(0, 6)])))
+        f.write("  <abstract>{}</abstract>\n".format(" ".join([rng.choice(vocabulary) for _ in range(0, 200)])))
+        for _ in range(0, 5):
+            f.write("  <keyword>{}</keyword>\n".format(rng.choice(vocabulary)))
+        f.write("</dataset>\n")
+
+    return num_records
+
+
+def write_zip_archive(path, rng, num_rows=20000):
+    """Write a zip archive of a comma-separated file and a free-text file.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows in the comma-separated member
+        :returns: (int) number of value rows written"""
+
+    members = []
+    for name, writer, size in [("member.csv", write_tall_csv, num_rows), ("member.txt", write_free_text, 5000)]:
+        writer(path + ".tmp", rng, size)
+        with open(path + ".tmp", "rb") as f:
+            members.append((name, f.read()))
+        os.remove(path + ".tmp")
+    write_zip(path, members)
+
+    return num_rows
+
+
+def write_gzip_csv(path, rng, num_rows=50000):
+    """Write a gzip-compressed comma-separated file, with no modification time in its header.
+
+        :param path: (str) path of file to write
+        :param rng: (random.Random) seeded random number generator
+        :param num_rows: (int) number of value rows
+        :returns: (int) number of value rows written"""
+
+    write_tall_csv(path + ".tmp", rng, num_rows=num_rows)
+    with open(path + ".tmp", "rb") as f:
+        data = f.read()
+    os.remove(path + ".tmp")
+    with open(path, "wb") as f:
+        with gzip.GzipFile(os.path.basename(path)[:-len(".gz")], "wb", fileobj=f, mtime=0) as gzip_file:
+            gzip_file.write(data)
+
+    return num_rows
+
+
+def write_zip(path, members):
+    """Write a zip archive whose members all have the same fixed date, so that its bytes depend only on
+    the members' contents.
+
+        :param path: (str) path of file to write
+        :param members: (list((str, bytes))) name and contents of each member"""
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, data)
+
+
+# file name -> writer, in the order the corpus is generated
+corpus_files = [
+    ("tall.csv", write_tall_csv),
+    ("wide.csv", write_wide_csv),
+    ("whitespace.dat", write_whitespace_dat),
+    ("preamble.dat", write_preamble_dat),
+    ("multiple_headers.csv", write_multiple_headers_csv),
+    ("high_cardinality.csv", write_high_cardinality_csv),
+    ("free_text.txt", write_free_text),
+    ("gridded.nc", write_netcdf),
+    ("spreadsheet.xlsx", write_xlsx),
+    ("records.xml", write_xml),
+    ("archive.zip", write_zip_archive),
+    ("tall.csv.gz", write_gzip_csv),
+]
+
+
+def generate_corpus(directory, seed=0, scale=1.0):
+    """Deterministically write the benchmark corpus to a directory. The same seed and
+    scale always produce byte-identical files.
+
+        :param directory: (str) directory to write files into
+        :param seed: (int) random seed
+        :param scale: (float) multiplier applied to the row counts of every file
+        :returns: (list(dict)) one entry per file with its name, size, and number of rows"""
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    corpus = []
+    for file_name, writer in corpus_files:
+        # each file gets its own generator so that adding a file doesn't change the others
+        rng = random.Random("{}:{}".format(seed, file_name))
+        defaults = writer.__defaults__
+        # scale the first keyword argument, which is always the row (or word/record) count
+        num_rows = writer(os.path.join(directory, file_name), rng, max(int(defaults[0] * scale), 1))
+        corpus.append({
+            "file": file_name,
+            "size": os.path.getsize(os.path.join(directory, file_name)),
+            "rows": num_rows
+        })
+
+    with open(os.path.join(directory, "corpus.json"), "w") as f:
+        json.dump({"seed": seed, "scale": scale, "files": corpus}, f, indent=4)
+
+    return corpus
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the synthetic benchmark corpus.")
+    parser.add_argument("directory", help="directory to write the corpus into")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    for entry in generate_corpus(args.directory, seed=args.seed, scale=args.scale):
+        print("{file}: {size} bytes, {rows} rows".format(**entry))
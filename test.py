@@ -1,9 +1,15 @@
 import csv
 import json
 import os
+import shutil
+import tempfile
 from ftplib import FTP
 # from catalog_maker import write_agg, write_catalog
-from metadata_util import extract_metadata, extract_netcdf_metadata
+from metadata_util import extract_metadata, extract_netcdf_metadata, extract_columnar_metadata, add_row_to_aggregates, \
+    add_final_aggregates
+from ftp_fixture import FixtureFTPServer, file_content
+from ftp_session import FTPSession
+from instrumentation import stats
 
 # ftp = FTP("cdiac.ornl.gov")
 # ftp.login()
@@ -18,10 +24,10 @@ from metadata_util import extract_metadata, extract_netcdf_metadata
 # failure_writer.writerow(["item name", "path"])
 
 
-# # test writing aggregates and catalogs
-# write_agg(
-#     write_catalog(ftp, "/pub2/ndp026c/", catalog_writer, failure_writer),
-#     agg_writer)
+# # test writing aggregates, catalogs, and the directory tree summary
+# summary = write_catalog(ftp, "/pub2/ndp026c/", catalog_writer, failure_writer)
+# write_agg(summary, agg_writer)
+# summary.write(open("cdiac_summary.json", "w"))
 
 
 def display_metadata(file_name, path):
@@ -43,6 +49,86 @@ def test_metadata_extraction():
     display_metadata("preamble.exc.csv", "test_files/")
     display_metadata("preamble.dat", "test_files/")
     display_metadata("preamble.c32", "test_files/")
+    display_metadata("archive.zip", "test_files/")
+    display_metadata("preamble.dat.Z", "test_files/")
+    display_metadata("spreadsheet.xlsx", "test_files/")
+    display_metadata("spreadsheet.xls", "test_files/")
+    display_metadata("descriptor.xml", "test_files/")
+    display_metadata("stacked_tables.dat", "test_files/")
+    display_metadata("mixed_encoding.csv", "test_files/")
+
+
+def display_columns(file_name, path):
+    # the columns themselves, which extract_metadata leaves out of its output
+    with open(path + file_name, "rb") as f:
+        metadata = extract_columnar_metadata(f)
+    print "{} ({}):".format(path + file_name, metadata["encoding"])
+    for header in sorted(metadata["columns"]):
+        column = dict((key, value) for key, value in metadata["columns"][header].items() if key != "sketches")
+        print u"    {}: {}".format(header, json.dumps(column, sort_keys=True)).encode("utf-8")
+
+    return metadata
+
+
+def test_column_extraction():
+    display_columns("single_header.csv", "test_files/")
+    # headers and values in a legacy encoding are decoded, and every value is counted
+    metadata = display_columns("mixed_encoding.csv", "test_files/")
+    assert u"Temp\xe9rature" in metadata["columns"], metadata["headers"]
+    assert metadata["columns"]["Station"]["distinct"] == 6, metadata["columns"]["Station"]
+
+
+def test_day_first_dates():
+    # the rows read first, from the bottom, have days of 12 or less, which fit month-first dates too
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "day_first.csv"), "w") as f:
+            f.write("date,value\n")
+            for day in range(31, 0, -1):
+                for hour in range(0, 24):
+                    f.write("{:02d}/01/2001,{}\n".format(day, hour))
+        with open(os.path.join(directory, "day_first.csv"), "rb") as f:
+            column = extract_columnar_metadata(f)["columns"]["date"]
+    finally:
+        shutil.rmtree(directory)
+    print "day-first dates: {} to {}, as {}".format(column["earliest"], column["latest"], column["date_format"])
+    assert (column["date_format"], column["earliest"], column["latest"]) == ("DD/MM/YYYY", "2001-01-01", "2001-01-31")
+
+
+def test_column_quantiles():
+    # columns far from zero, like years, must still spread across their quantiles
+    for name, values in [("1..100", range(1, 101)), ("years", [1990 + i % 4 for i in range(1000)])]:
+        metadata = {"columns": {}}
+        for i, value in enumerate(values):
+            add_row_to_aggregates(metadata, [str(value)], ["value"], ["num"], i == 0)
+        add_final_aggregates(metadata, ["value"], ["num"], len(values))
+        quantiles = metadata["columns"]["value"]["quantiles"]
+        print "{} quantiles: {}".format(name, json.dumps(quantiles, sort_keys=True))
+        sorted_values = sorted(values)
+        for key, q in [("p01", 0.01), ("p50", 0.5), ("p99", 0.99)]:
+            assert abs(quantiles[key] - sorted_values[int(q * (len(values) - 1))]) <= 1, (name, key, quantiles)
+
+
+def test_ftp_session_resume():
+    # with a drop every 6 commands (PWD, CWD, SIZE, TYPE, PASV, RETR) the server cuts the transfer halfway
+    size = 256 * 1024
+    server = FixtureFTPServer({"data": {"big.csv": size}}, drop_every=6)
+    host, port = server.start()
+    resumed = stats.total("resumed_transfers")
+    try:
+        ftp = FTPSession(host, port=port, backoff=0.01, keepalive=None)
+        ftp.cwd("/data")
+        assert ftp.size("big.csv") == size
+        blocks = []
+        ftp.retrbinary("RETR big.csv", blocks.append)
+        ftp.close()
+    finally:
+        server.stop()
+    print "resumed download: {} of {} bytes over {} connections".format(len(b"".join(blocks)), size,
+                                                                       ftp.num_connections)
+    assert server.command_counts["dropped"] == 1 and server.command_counts["REST"] == 1
+    assert stats.total("resumed_transfers") == resumed + 1
+    assert b"".join(blocks) == file_content("/data/big.csv", size)
 
 
 def write_agg_csv(agg_writer, agg):
@@ -50,3 +136,7 @@ def write_agg_csv(agg_writer, agg):
         agg_writer.writerow([extension, extension_data["total_bytes"], extension_data["total_bytes_with_metadata"]])
 
 test_metadata_extraction()
+test_column_extraction()
+test_day_first_dates()
+test_column_quantiles()
+test_ftp_session_resume()
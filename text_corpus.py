@@ -0,0 +1,113 @@
+import os
+import csv
+import zlib
+from hashlib import sha256
+
+# index columns - a text stored under several paths has one row per path, all pointing at the same bytes
+index_headers = ["checksum", "offset", "compressed_size", "size", "path"]
+
+
+class TextCorpus:
+    """Stores many small texts, like READMEs, in a single file of individually compressed records, with
+    a CSV index of where each one starts. Texts are deduplicated by checksum, and any text can be read
+    back by path or checksum without decompressing the others. Both files are only ever appended to, so
+    a harvest can be interrupted and continued.
+
+        :param corpus_path: (str) path of the compressed corpus file
+        :param index_path: (str) path of the index file, by default the corpus path followed by ".index.csv"
+        :param compression_level: (int) zlib compression level"""
+
+    def __init__(self, corpus_path, index_path=None, compression_level=9):
+        self.corpus_path = corpus_path
+        self.index_path = index_path if index_path is not None else corpus_path + ".index.csv"
+        self.compression_level = compression_level
+        # checksum -> (offset, compressed size, size), and path -> checksum
+        self.records = {}
+        self.paths = {}
+        # checksums in the order their texts were added
+        self.order = []
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                for row in csv.reader(index_file):
+                    # a short row is one cut off by an interrupted write
+                    if len(row) < len(index_headers) or row[0] == index_headers[0]:
+                        continue
+                    self.add_to_index(row[0], int(row[1]), int(row[2]), int(row[3]), row[4])
+
+        write_header = not os.path.exists(self.index_path)
+        self.corpus_file = open(self.corpus_path, "ab")
+        self.index_file = open(self.index_path, "a")
+        self.index_writer = csv.writer(self.index_file)
+        if write_header:
+            self.index_writer.writerow(index_headers)
+
+        # new records go after any bytes left by an interrupted write, which the index never points to
+        self.corpus_file.seek(0, os.SEEK_END)
+        self.end = self.corpus_file.tell()
+
+    def add_to_index(self, checksum, offset, compressed_size, size, path):
+        if checksum not in self.records:
+            self.records[checksum] = (offset, compressed_size, size)
+            self.order.append(checksum)
+        self.paths[path] = checksum
+
+    def add(self, path, text):
+        """Add a text to the corpus, unless an identical one is already stored, in which case only its path is.
+
+            :param path: (str) path the text was found at
+            :param text: (bytes) text
+            :returns: (bool) whether the text was new"""
+
+        checksum = sha256(text).hexdigest()
+        is_new = checksum not in self.records
+        if is_new:
+            data = zlib.compress(text, self.compression_level)
+            # write the record before the index row, so the index never points past the end of the corpus
+            self.corpus_file.write(data)
+            self.corpus_file.flush()
+            offset = self.end
+            self.end += len(data)
+            record = (offset, len(data), len(text))
+        else:
+            record = self.records[checksum]
+
+        self.index_writer.writerow([checksum, record[0], record[1], record[2], path])
+        self.index_file.flush()
+        self.add_to_index(checksum, record[0], record[1], record[2], path)
+
+        return is_new
+
+    def get(self, key):
+        """Read a text back.
+
+            :param key: (str) path or checksum of the text
+            :returns: (bytes) text
+            :raises: (KeyError) if no text is stored under the key"""
+
+        checksum = self.paths.get(key, key)
+        offset, compressed_size, size = self.records[checksum]
+        with open(self.corpus_path, "rb") as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(compressed_size))
+
+    def __contains__(self, key):
+        return key in self.paths or key in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        """Iterate over the distinct texts in the order they were added, reading the corpus file once.
+
+            :returns: (generator((str, bytes))) checksum and text"""
+
+        with open(self.corpus_path, "rb") as f:
+            for checksum in self.order:
+                offset, compressed_size, size = self.records[checksum]
+                f.seek(offset)
+                yield checksum, zlib.decompress(f.read(compressed_size))
+
+    def close(self):
+        self.corpus_file.close()
+        self.index_file.close()
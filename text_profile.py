@@ -0,0 +1,230 @@
+from __future__ import print_function
+import io
+import os
+import re
+import json
+import zlib
+import math
+import codecs
+import struct
+import argparse
+import numpy
+
+# identifies a file of hashed bag-of-words vectors
+vector_file_magic = b"HBOW"
+# magic followed by the number of dimensions as a little-endian unsigned int
+vector_file_header = struct.Struct("<4sI")
+
+# words are runs of letters, in any script
+word_pattern = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+# common words of each language, used both to guess a text's language and to keep them out of its keywords
+stopwords = {
+    "en": ["the", "and", "of", "to", "in", "is", "that", "for", "are", "with", "this", "be", "on", "as", "by", "from",
+           "these", "were", "which", "or"],
+    "fr": ["le", "la", "les", "et", "des", "du", "une", "est", "dans", "pour", "sont", "avec", "sur", "par", "au",
+           "qui", "ces", "pas"],
+    "de": ["der", "die", "und", "das", "den", "ist", "mit", "von", "sich", "des", "auf", "nicht", "ein", "eine",
+           "dem", "sind", "wird"],
+    "es": ["el", "los", "las", "del", "en", "que", "por", "con", "una", "para", "es", "se", "su", "al", "como", "son",
+           "entre", "fueron"],
+    "it": ["il", "di", "che", "della", "per", "sono", "gli", "delle", "nel", "con", "una", "dei", "del", "alla",
+           "questo", "anche"],
+    "pt": ["os", "das", "dos", "que", "em", "para", "com", "uma", "por", "foram", "pelo", "pela", "ao", "entre"],
+    "nl": ["de", "het", "een", "van", "en", "dat", "zijn", "voor", "met", "niet", "op", "ook", "bij", "worden", "deze"],
+}
+stopword_languages = {}
+for language, words in stopwords.items():
+    for word in words:
+        stopword_languages.setdefault(word, []).append(language)
+
+
+def profile_text(file_handle, dimensions=1024, max_bytes=16 * 1024 * 1024, num_keywords=10, keyword_capacity=200,
+                 distinct_bits=2 ** 16, min_language_hits=5, chunk_size=64 * 1024):
+    """Profile a free-text file in one pass, keeping memory bounded however long it is: count its tokens,
+    estimate how many are distinct, hash them into a fixed-size bag-of-words vector, track its most frequent
+    words, and guess its language from common words.
+
+        :param file_handle: (file) open file
+        :param dimensions: (int) length of the hashed bag-of-words vector
+        :param max_bytes: (int) number of bytes after which the rest of the file is ignored
+        :param num_keywords: (int) number of keywords to report
+        :param keyword_capacity: (int) number of candidate keywords counted at once - larger is more accurate
+        :param distinct_bits: (int) size of the bitmap used to estimate the number of distinct tokens
+        :param min_language_hits: (int) number of common words of a language needed to report it
+        :param chunk_size: (int) number of bytes read at a time
+        :returns: (dict) "tokens", "distinct_tokens", "keywords", "language", and "vector" (numpy.ndarray) of
+        float32 weights with unit length, or all zeros if there were no tokens"""
+
+    vector = numpy.zeros(dimensions, dtype=numpy.float32)
+    distinct = numpy.zeros(distinct_bits, dtype=numpy.bool_)
+    keywords = {}
+    language_hits = dict((language, 0) for language in stopwords)
+    num_tokens = 0
+    num_bytes = 0
+
+    # decode incrementally so characters split between chunks aren't mangled
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # a word that may continue in the next chunk
+    partial = u""
+
+    file_handle.seek(0)
+    while num_bytes < max_bytes:
+        chunk = file_handle.read(min(chunk_size, max_bytes - num_bytes))
+        num_bytes += len(chunk)
+        is_last = len(chunk) == 0 or num_bytes >= max_bytes
+        text = partial + decoder.decode(chunk, final=is_last)
+
+        words = word_pattern.findall(text.lower())
+        partial = u""
+        if not is_last and len(words) > 0 and text[-1:].isalpha():
+            partial = words.pop()
+
+        hashes = [zlib.crc32(word.encode("utf-8")) & 0xffffffff for word in words]
+        if len(hashes) > 0:
+            hashes = numpy.array(hashes, dtype=numpy.int64)
+            # the top bit picks a sign, so that collisions cancel out rather than pile up
+            signs = numpy.where(hashes >> 31, -1.0, 1.0).astype(numpy.float32)
+            numpy.add.at(vector, (hashes % dimensions).astype(numpy.intp), signs)
+            distinct[((hashes >> 8) % distinct_bits).astype(numpy.intp)] = True
+        num_tokens += len(words)
+
+        for word in words:
+            if word in stopword_languages:
+                for language in stopword_languages[word]:
+                    language_hits[language] += 1
+            elif len(word) > 2:
+                count_keyword(keywords, word, keyword_capacity)
+
+        if is_last:
+            break
+
+    norm = numpy.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+
+    language = max(language_hits, key=language_hits.get)
+
+    return {
+        "tokens": num_tokens,
+        "distinct_tokens": estimate_distinct(distinct),
+        "keywords": [word for word, count in sorted(keywords.items(), key=lambda item: (-item[1], item[0]))
+                     [:num_keywords]],
+        "language": language if language_hits[language] >= min_language_hits else "unknown",
+        "vector": vector
+    }
+
+
+def count_keyword(keywords, word, capacity):
+    """Count a word with the space-saving algorithm, which keeps the most frequent words in a fixed number
+    of counters by handing the least frequent counter to each new word.
+
+        :param keywords: (dict) word -> approximate count
+        :param word: (str) word to count
+        :param capacity: (int) maximum number of counters"""
+
+    if word in keywords:
+        keywords[word] += 1
+    elif len(keywords) < capacity:
+        keywords[word] = 1
+    else:
+        least = min(keywords, key=keywords.get)
+        keywords[word] = keywords.pop(least) + 1
+
+
+def estimate_distinct(bitmap):
+    """Estimate the number of distinct values hashed into a bitmap by linear counting.
+
+        :param bitmap: (numpy.ndarray) bitmap with a bit set for each hashed value
+        :returns: (int) estimated number of distinct values"""
+
+    size = len(bitmap)
+    empty = size - int(numpy.count_nonzero(bitmap))
+    if empty == 0:
+        # saturated - the estimate is only a lower bound
+        return int(size * math.log(size))
+
+    return int(round(size * math.log(float(size) / empty)))
+
+
+class VectorWriter:
+    """Appends hashed bag-of-words vectors to a binary file as rows of little-endian float32, after a header
+    holding the number of dimensions, so that the whole file can be memory-mapped as one matrix.
+
+        :param vector_file: (file) file opened in binary write or append mode
+        :param dimensions: (int) length of each vector"""
+
+    def __init__(self, vector_file, dimensions=1024):
+        self.vector_file = vector_file
+        self.dimensions = dimensions
+        self.vector_file.seek(0, os.SEEK_END)
+        if self.vector_file.tell() == 0:
+            self.vector_file.write(vector_file_header.pack(vector_file_magic, dimensions))
+        self.num_rows = (self.vector_file.tell() - vector_file_header.size) // (4 * dimensions)
+
+    def write(self, vector):
+        """Add a vector to the file.
+
+            :param vector: (numpy.ndarray) vector of length `dimensions`
+            :returns: (int) row number of the vector"""
+
+        if len(vector) != self.dimensions:
+            raise ValueError("expected a vector of {} dimensions, got {}".format(self.dimensions, len(vector)))
+        self.vector_file.write(numpy.asarray(vector, dtype="<f4").tobytes())
+        self.num_rows += 1
+
+        return self.num_rows - 1
+
+
+def load_vectors(path):
+    """Load every vector in a file written by VectorWriter at once, without reading it into memory.
+
+        :param path: (str) vector file path
+        :returns: (numpy.memmap) read-only matrix with one row per vector"""
+
+    with open(path, "rb") as f:
+        magic, dimensions = vector_file_header.unpack(f.read(vector_file_header.size))
+    if magic != vector_file_magic:
+        raise ValueError("{} is not a vector file".format(path))
+
+    vectors = numpy.memmap(path, dtype="<f4", mode="r", offset=vector_file_header.size)
+    # a row cut off by an interrupted run is dropped
+    num_rows = len(vectors) // dimensions
+
+    return vectors[:num_rows * dimensions].reshape(num_rows, dimensions)
+
+
+if __name__ == "__main__":
+    from text_corpus import TextCorpus
+
+    parser = argparse.ArgumentParser(description="Profile free-text files, such as the READMEs saved by save_readmes.")
+    parser.add_argument("source", help="directory of text files, or text corpus file, to profile")
+    parser.add_argument("profiles", help="file to append one JSON profile per line to")
+    parser.add_argument("vectors", help="file to append hashed bag-of-words vectors to")
+    parser.add_argument("--dimensions", type=int, default=1024)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        def texts():
+            for file_name in sorted(os.listdir(args.source)):
+                with open(os.path.join(args.source, file_name), "rb") as f:
+                    yield file_name, f.read()
+    else:
+        def texts():
+            corpus = TextCorpus(args.source)
+            try:
+                for checksum, text in corpus:
+                    yield checksum, text
+            finally:
+                corpus.close()
+
+    with open(args.profiles, "a") as profile_file, open(args.vectors, "ab") as vector_file:
+        vector_writer = VectorWriter(vector_file, dimensions=args.dimensions)
+        num_files = 0
+        for name, text in texts():
+            profile = profile_text(io.BytesIO(text), dimensions=args.dimensions)
+            profile["vector_row"] = vector_writer.write(profile.pop("vector"))
+            profile["source"] = name
+            profile_file.write(json.dumps(profile) + "\n")
+            num_files += 1
+        print("profiled {} files".format(num_files))
@@ -0,0 +1,292 @@
+from __future__ import print_function
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import traceback
+from manifest import read_manifest, full_path
+from instrumentation import stats
+
+schema = """
+CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, entry TEXT NOT NULL,
+                                  state TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_expires REAL,
+                                  attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires);
+"""
+
+# states a task can be in
+states = ["pending", "leased", "done", "failed"]
+
+
+class WorkQueue:
+    """Queue of manifest entries shared by any number of worker processes, on one host or many, kept in a
+    SQLite file. Workers lease batches of entries for a limited time and renew their leases as they finish
+    entries, so the entries of a worker that crashes or hangs go back to the queue once its lease expires.
+    Each entry's result is stored with it, so the output of every worker ends up in one result set.
+
+    SQLite's locking is only as good as the filesystem's - on a network filesystem, make sure it supports
+    POSIX locks, or run the queue on one host's local disk and have the others reach it through a mount.
+
+        :param path: (str) queue file path - created if it doesn't exist
+        :param lease_seconds: (float) time a worker has to finish or renew an entry before it is handed out again
+        :param max_attempts: (int) number of times an entry is leased before it is given up on as failed
+        :param timeout: (float) seconds to wait for another worker's lock before giving up"""
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3, timeout=60):
+        # transactions are begun explicitly, so that leases can take the write lock up front
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.executescript(schema)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def add(self, entries):
+        """Add manifest entries to the queue. Entries whose path is already queued are left as they are, so
+        a manifest can be added again after more files were listed.
+
+            :param entries: (iterable(dict)) manifest entries
+            :returns: (int) number of entries added"""
+
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany("INSERT OR IGNORE INTO tasks (path, entry) VALUES (?, ?)",
+                               ((full_path(entry), json.dumps(entry)) for entry in entries))
+            num_added = cursor.rowcount
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+        return num_added
+
+    def lease(self, worker, batch_size=20):
+        """Lease a batch of pending entries, after returning the entries of expired leases to the queue.
+
+            :param worker: (str) name of the worker taking the lease
+            :param batch_size: (int) maximum number of entries to lease
+            :returns: (list((int, dict))) task ids and manifest entries - empty once the queue is drained"""
+
+        now = time.time()
+        cursor = self.connection.cursor()
+        with stats.timer("lease"):
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # entries of workers that stopped renewing are tried again, unless they've been tried enough
+                cursor.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                               "worker = NULL WHERE state = 'leased' AND lease_expires < ?", (self.max_attempts, now))
+                cursor.execute("SELECT id, entry FROM tasks WHERE state = 'pending' ORDER BY id LIMIT ?", (batch_size,))
+                tasks = [(task_id, json.loads(entry)) for task_id, entry in cursor.fetchall()]
+                cursor.executemany("UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, "
+                                   "attempts = attempts + 1 WHERE id = ?",
+                                   [(worker, now + self.lease_seconds, task_id) for task_id, entry in tasks])
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+        return tasks
+
+    def complete(self, worker, task_id, result):
+        """Record an entry's result, and renew the worker's lease on the rest of its batch. A result is
+        kept even if the lease had expired, unless another worker already finished the entry.
+
+            :param worker: (str) name of the worker
+            :param task_id: (int) task id from lease
+            :param result: (dict) result, e.g. the file's metadata"""
+
+        self.finish(worker, task_id, "done", result=json.dumps(result))
+
+    def fail(self, worker, task_id, error):
+        """Record that an entry couldn't be processed, returning it to the queue unless it has been
+        tried `max_attempts` times, and renew the worker's lease on the rest of its batch. The failure is
+        dropped if the worker's lease expired and the entry has been handed out again since.
+
+            :param worker: (str) name of the worker
+            :param task_id: (int) task id from lease
+            :param error: (str) what went wrong"""
+
+        self.finish(worker, task_id, "failed", error=error)
+
+    def finish(self, worker, task_id, state, result=None, error=None):
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if state == "failed":
+                cursor.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                               "worker = NULL, error = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                               (self.max_attempts, error, task_id, worker))
+            else:
+                cursor.execute("UPDATE tasks SET state = 'done', worker = ?, result = ?, error = NULL "
+                               "WHERE id = ? AND state != 'done'", (worker, result, task_id))
+            cursor.execute("UPDATE tasks SET lease_expires = ? WHERE worker = ? AND state = 'leased'",
+                           (time.time() + self.lease_seconds, worker))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def counts(self):
+        """Count the entries in each state.
+
+            :returns: (dict) state -> number of entries"""
+
+        counts = dict((state, 0) for state in states)
+        counts.update(self.connection.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+        return counts
+
+    def results(self):
+        """Stream the results of every finished entry, in queue order.
+
+            :returns: (generator(dict)) results"""
+
+        for (result,) in self.connection.execute("SELECT result FROM tasks WHERE state = 'done' ORDER BY id"):
+            yield json.loads(result)
+
+    def retry_failed(self):
+        """Return every failed entry to the queue with its attempts reset.
+
+            :returns: (int) number of entries returned"""
+
+        cursor = self.connection.execute("UPDATE tasks SET state = 'pending', attempts = 0 WHERE state = 'failed'")
+
+        return cursor.rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+def worker_name():
+    """Name this process uniquely across hosts.
+
+        :returns: (str) host name and process id"""
+
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def run_worker(queue, process, worker=None, batch_size=20, poll_seconds=30):
+    """Lease and process batches of entries until the queue is drained. Errors are recorded against the
+    entry they happened on rather than stopping the worker. While other workers still hold leases, the
+    worker waits rather than stopping, since their entries go back to the queue if they die.
+
+        :param queue: (WorkQueue) queue to work from
+        :param process: (function) takes a manifest entry and returns its result, e.g. the file's metadata
+        :param worker: (str) worker name, or None to name it after the host and process
+        :param batch_size: (int) number of entries to lease at a time
+        :param poll_seconds: (float) seconds to wait between leases while every pending entry is leased
+        :returns: ((int, int)) number of entries completed and number failed"""
+
+    worker = worker or worker_name()
+    num_done = 0
+    num_failed = 0
+
+    while True:
+        tasks = queue.lease(worker, batch_size=batch_size)
+        if len(tasks) == 0:
+            if queue.counts()["leased"] == 0:
+                break
+            # leases that expire are returned to the queue by the next lease
+            time.sleep(poll_seconds)
+            continue
+        for task_id, entry in tasks:
+            try:
+                result = process(entry)
+            except Exception as e:
+                stats.count("failures")
+                queue.fail(worker, task_id, "{} :: {}\n{}".format(full_path(entry), str(e), traceback.format_exc()))
+                num_failed += 1
+                continue
+            queue.complete(worker, task_id, result)
+            num_done += 1
+
+    return num_done, num_failed
+
+
+def export_results(queue, metadata_file):
+    """Write every result in the queue as one metadata output, in the form the collectors write.
+
+        :param queue: (WorkQueue) queue
+        :param metadata_file: (file) file to write to
+        :returns: (int) number of results written"""
+
+    num_results = 0
+    metadata_file.write('{"files":[')
+    for result in queue.results():
+        metadata_file.write(("," if num_results > 0 else "") + json.dumps(result))
+        num_results += 1
+    metadata_file.write(']}')
+
+    return num_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share a manifest between any number of collector processes.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    add_parser = subparsers.add_parser("add", help="queue the entries of a manifest")
+    add_parser.add_argument("queue", help="queue file, created if it doesn't exist")
+    add_parser.add_argument("manifest", help="manifest, catalog, or path list to queue")
+
+    work_parser = subparsers.add_parser("work", help="classify queued files from Petrel until the queue is drained")
+    work_parser.add_argument("queue", help="queue file")
+    work_parser.add_argument("local_path", help="local directory to download into - each worker uses its own "
+                                                "subdirectory")
+    work_parser.add_argument("--batch-size", type=int, default=20)
+    work_parser.add_argument("--stats", default=None, help="file to save this worker's stats to")
+    work_parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    work_parser.add_argument("--progress-port", type=int, default=None,
+                             help="localhost port to serve progress metrics on at /metrics")
+
+    status_parser = subparsers.add_parser("status", help="count entries in each state")
+    status_parser.add_argument("queue", help="queue file")
+
+    export_parser = subparsers.add_parser("export", help="write every result to one metadata output file")
+    export_parser.add_argument("queue", help="queue file")
+    export_parser.add_argument("output", help="file to write results to")
+
+    retry_parser = subparsers.add_parser("retry", help="return failed entries to the queue")
+    retry_parser.add_argument("queue", help="queue file")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    try:
+        if args.command == "add":
+            with open(args.manifest) as manifest_file:
+                print("queued {} files".format(queue.add(read_manifest(manifest_file))))
+        elif args.command == "work":
+            from petrel_metadata_collector import classify_queued_files, get_globus_client, PETREL_ID
+            from progress import Progress
+            local_path = os.path.join(args.local_path, worker_name().replace(":", "_"), "")
+            # the time left assumes this worker gets through every entry pending now, so with several workers
+            # it is an overestimate
+            progress = Progress(total_files=queue.counts()["pending"], interval=args.progress_interval,
+                                port=args.progress_port)
+
+            def num_pending():
+                # the progress reporter runs in its own thread, which can't share this one's connection
+                connection = sqlite3.connect(args.queue, timeout=5)
+                try:
+                    return connection.execute("SELECT COUNT(*) FROM tasks WHERE state = 'pending'").fetchone()[0]
+                finally:
+                    connection.close()
+
+            progress.watch_queue("pending", num_pending)
+            try:
+                with progress:
+                    num_done, num_failed = classify_queued_files(get_globus_client(), PETREL_ID, queue, local_path,
+                                                                 batch_size=args.batch_size)
+                print("classified {} files, {} failed".format(num_done, num_failed))
+            finally:
+                if args.stats is not None:
+                    stats.dump(args.stats)
+        elif args.command == "status":
+            print(", ".join("{} {}".format(count, state) for state, count in sorted(queue.counts().items())))
+        elif args.command == "export":
+            with open(args.output, "w") as output_file:
+                print("wrote {} results".format(export_results(queue, output_file)))
+        else:
+            print("returned {} failed files to the queue".format(queue.retry_failed()))
+    finally:
+        queue.close()